@@ -1,56 +1,248 @@
-import supervision as sv
-import cv2
-from ultralytics import YOLO
+import time
+from typing import List, Optional, Sequence
 import numpy as np
-import torch
-
-
-class YOLODetector:
-    def __init__(self, model_path: str):
-        """
-        Initialize YOLO detector with model path
-        
-        Args:
-            model_path: Path to the YOLO model weights file
-        """
-        self.model = YOLO(model_path)
-    
-    def detect_text_boxes(self, image: np.ndarray) -> list:
-        """
-        Detect text bounding boxes in the input image
-        
-        Args:
-            image: Input image as numpy array
-            
-        Returns:
-            list: List of text bounding boxes in [x1, y1, x2, y2] format
-        """
-        
-        results = self.model(image)
-        results = results[0]
-        
-
-        boxes = results.boxes.xyxy
-        
-
-        detections = sv.Detections.from_ultralytics(results)
-        
-        class_names = detections.data['class_name'].tolist()
-        text_indices = np.where(np.array(class_names) == 'Text')[0]
-        
-
-        text_boxes = []
-        for idx in text_indices:
-            text_boxes.append(boxes[idx])
-        
-
-        boxes_list = [box.round().int().cpu().tolist() for box in text_boxes]
-        
-        return boxes_list[1:]
+
+
+def _bands(top: np.ndarray, bottom: np.ndarray) -> np.ndarray:
+    """
+    Split boxes into horizontal bands separated by empty rows
+
+    Boxes are sorted by their top edge; a running maximum of the bottoms gives
+    the covered extent so far, and every box that starts below that extent
+    opens a new band.
+
+    Returns:
+        np.ndarray: Band index of every box, numbered from the top
+    """
+    order = top.argsort(kind='stable')
+    reach = np.maximum.accumulate(bottom[order])
+    opens = np.zeros(len(top), dtype=np.int64)
+    opens[1:] = top[order[1:]] > reach[:-1]
+    band = np.empty_like(opens)
+    band[order] = opens.cumsum()
+    return band
+
+
+def _gutters(counts: np.ndarray) -> np.ndarray:
+    """Gutter candidates of each projection row: nothing blocks the gap after c and boxes lie on both sides"""
+    beyond = counts[:, :-1]
+    return (beyond >= 1) & (beyond < counts[:, -1:])
+
+
+def _xy_cut(boxes: np.ndarray, idx: np.ndarray, col_gap: float, slack: float, out: List[int]):
+    """
+    XY-cut, one level of blocks and columns per call
+
+    Boxes are shrunk by `slack` on both sides so that columns which overlap
+    the gutter slightly still separate, while a box that really crosses it (a
+    full-width title or figure) prevents the cut. The region is split into
+    horizontal bands and the x-projection of every run of bands is computed
+    at once, as a matrix product of band membership with per-box counts at
+    each right edge. If the whole region has a column gutter it is one block;
+    otherwise consecutive bands are merged as long as the merged block still
+    has a gutter, so the rows of a multi-column block between two full-width
+    elements stay together. Every block is cut at its gutters into columns
+    and the page is read block by block, column by column, top to bottom.
+    Only a column that is itself split further is handled recursively.
+    """
+    n = len(idx)
+    if n <= 1:
+        out.extend(idx.tolist())
+        return
+
+    region = boxes[idx]
+    left, top = region[:, 0], region[:, 1]
+    lo = left + slack
+    hi = np.maximum(region[:, 2] - slack, lo)
+    if lo.max() <= hi.min():
+        # every box covers a common x position, so no subset has a column gutter
+        out.extend(idx[np.lexsort((left, top))].tolist())
+        return
+
+    band = _bands(top, region[:, 3])
+    bands = int(band.max()) + 1
+
+    # projection measured at every right edge c: a box counts 1 when it lies
+    # beyond a gutter after c, n + 1 when it blocks one and 0 when it ends by
+    # c; the last column counts the boxes
+    features = np.ones((n, n + 1))
+    np.subtract((hi[:, None] > hi) * (n + 1.0), (lo[:, None] > hi + col_gap) * float(n), out=features[:, :n])
+    prefix = (band < np.arange(bands + 1)[:, None]).astype(np.float64) @ features
+
+    center = ((lo + hi) / 2)[:, None]
+    whole = _gutters(prefix[-1:])
+    if whole.any():
+        block = np.zeros(n, dtype=np.int64)
+        column = (whole & (hi < center)).sum(axis=1)
+    else:
+        # a band that can merge with its successor starts a multi-band block,
+        # which grows while the merged block keeps a gutter
+        pairs = _gutters(prefix[2:] - prefix[:-2]).any(axis=1)
+        heads, s = [], 0
+        for p in pairs.nonzero()[0].tolist():
+            if p < s:
+                continue
+            heads.extend(range(s, p + 1))
+            closed = (~_gutters(prefix[p + 2:] - prefix[p]).any(axis=1)).nonzero()[0]
+            s = p + 1 + int(closed[0]) if closed.size else bands
+        heads.extend(range(s, bands))
+        gutters = _gutters(prefix[heads[1:] + [bands]] - prefix[heads])
+        block = np.searchsorted(heads, band, side='right') - 1
+        column = (gutters[block] & (hi < center)).sum(axis=1)
+
+    order = np.lexsort((left, top, column, block))
+    cell = (block * n + column)[order]
+    change = np.ones(n, dtype=bool)
+    change[1:] = cell[1:] != cell[:-1]
+    starts = change.nonzero()[0]
+    simple = np.maximum.reduceat(lo[order], starts) <= np.minimum.reduceat(hi[order], starts)
+    members = idx[order]
+    if simple.all() or len(starts) == 1:
+        out.extend(members.tolist())
+        return
+    bounds = starts.tolist() + [n]
+    for k, plain in enumerate(simple.tolist()):
+        cell_members = members[bounds[k]:bounds[k + 1]]
+        if plain:
+            out.extend(cell_members.tolist())
+        else:
+            _xy_cut(boxes, cell_members, col_gap, slack, out)
+
+
+def reading_order(boxes: np.ndarray, page_width: Optional[float] = None, page_height: Optional[float] = None,
+                  col_gap: float = 0.01, slack: float = 0.005, margin: float = 0.06,
+                  drop_margins: bool = False) -> np.ndarray:
+    """
+    Compute the reading order of text boxes on a page
+
+    Running headers (boxes entirely within the top `margin` of the page) come
+    first and footers (entirely within the bottom `margin`) come last; the
+    body is ordered with XY-cut, which handles any number of columns as well
+    as full-width titles, figures and captions between column blocks.
+
+    Args:
+        boxes: Array of shape (N, 4) in [left, top, right, bottom] format
+        page_width: Page width in pixels, defaults to the right edge of the widest box
+        page_height: Page height in pixels; headers and footers are only
+            separated when it is given
+        col_gap: Minimum column gutter as a fraction of the page width
+        slack: Tolerated overlap into a gutter as a fraction of the page width
+        margin: Header/footer band height as a fraction of the page height
+        drop_margins: Leave headers and footers out instead of placing them
+            first and last (only when the page also has body boxes)
+
+    Returns:
+        np.ndarray: Indices into `boxes` in reading order
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    n = len(boxes)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    if page_width is None:
+        page_width = boxes[:, 2].max()
+
+    head = np.zeros(n, dtype=bool)
+    foot = np.zeros(n, dtype=bool)
+    if page_height is not None:
+        head = boxes[:, 3] <= margin * page_height
+        foot = boxes[:, 1] >= (1 - margin) * page_height
+        if (head | foot).all():
+            head[:] = foot[:] = False
+
+    body = ~(head | foot)
+    masks = (body,) if drop_margins and body.any() else (head, body, foot)
+    out: List[int] = []
+    for mask in masks:
+        idx = mask.nonzero()[0]
+        _xy_cut(boxes, idx, col_gap * page_width, slack * page_width, out)
+    return np.asarray(out, dtype=np.int64)
+
+
+def Layout_Order(pppd: Sequence[Sequence[float]], page_height: Optional[float] = None,
+                 drop_margins: bool = False) -> List[List[int]]:
+    """
+    Sort detected text boxes into reading order
+
+    Args:
+        pppd: One row per box as built by `PDFQAProcessor.process_boxes`:
+            [left, top, width, page_width / 2, right, bottom]
+        page_height: Page height in pixels, enables header/footer handling
+        drop_margins: Drop running headers and footers instead of placing
+            them first and last
+
+    Returns:
+        list: Boxes in [left, top, right, bottom] format, in reading order
+    """
+    if not len(pppd):
+        return []
+    rows = np.asarray(pppd, dtype=np.float64)
+    boxes = rows[:, [0, 1, 4, 5]]
+    page_width = rows[0, 3] * 2
+    order = reading_order(boxes, page_width, page_height, drop_margins=drop_margins)
+    return boxes[order].round().astype(int).tolist()
+
+
+def _rows(boxes: List[List[int]], page_width: int) -> List[List[float]]:
+    return [[l, t, r - l, page_width / 2, r, b] for l, t, r, b in boxes]
+
+
+def _column(left: int, right: int, top: int, count: int, height: int = 60, gap: int = 20) -> List[List[int]]:
+    return [[left, top + i * (height + gap), right, top + i * (height + gap) + height] for i in range(count)]
+
+
+def test_layout_order():
+    rng = np.random.RandomState(0)
+    width, height = 2480, 3508
+
+    def check(name: str, expected: List[List[int]], **kwargs):
+        shuffled = [expected[i] for i in rng.permutation(len(expected))]
+        result = Layout_Order(_rows(shuffled, width), **kwargs)
+        assert result == expected, f"{name}: {result} != {expected}"
+        print(f"✓ {name}: {len(expected)} 个文本框")
+
+    single = _column(200, 2280, 300, 12)
+    check("单栏", single)
+
+    left = _column(200, 1180, 300, 10)
+    right = _column(1300, 2280, 300, 10)
+    check("双栏", left + right)
+
+    title = [[200, 150, 2280, 250]]
+    figure = [[200, 1150, 2280, 1500]]
+    top_left, top_right = _column(200, 1180, 300, 10), _column(1300, 2280, 300, 10)
+    bottom_left, bottom_right = _column(200, 1180, 1600, 10), _column(1300, 2280, 1600, 10)
+    check("通栏标题与通栏插图", title + top_left[:10] + top_right[:10] + figure + bottom_left + bottom_right,
+          page_height=height)
+
+    three = _column(200, 880, 300, 8) + _column(900, 1580, 300, 8) + _column(1600, 2280, 300, 8)
+    check("三栏", three)
+
+    header = [[200, 60, 600, 120], [2000, 60, 2280, 120]]
+    footer = [[1180, 3400, 1300, 3460]]
+    check("页眉页脚", header + left + right + footer, page_height=height)
+    body = Layout_Order(_rows(header + left + right + footer, width), page_height=height, drop_margins=True)
+    assert body == left + right, "drop_margins 应去掉页眉页脚"
+    print("✓ 去除页眉页脚")
+
+    overlapping = [[l, t, r + 10, b] for l, t, r, b in _column(200, 1180, 300, 10)] + _column(1300, 2280, 300, 10)
+    check("栏间轻微重叠", overlapping)
+
+    intro = _column(200, 2280, 300, 3)
+    middle = _column(200, 1180, 560, 6) + _column(1300, 2280, 560, 4)
+    outro = _column(200, 2280, 1100, 3)
+    check("单栏与双栏混排", intro + middle + outro)
+
+    assert Layout_Order([]) == []
+    print("✓ 空页面")
+
+    page = _rows(title + top_left + top_right + figure + bottom_left + bottom_right, width)
+    runs = 1000
+    start = time.perf_counter()
+    for _ in range(runs):
+        Layout_Order(page, page_height=height)
+    elapsed = (time.perf_counter() - start) / runs
+    print(f"{len(page)} 个文本框排序耗时 {elapsed * 1e6:.0f} µs/页")
 
 
 if __name__ == "__main__":
-    detector = YOLODetector("yolov11x_best.pt")
-    image = cv2.imread("sample.jpg")
-    text_boxes = detector.detect_text_boxes(image)
-    print(f"Detected {len(text_boxes)} text boxes")
+    test_layout_order()
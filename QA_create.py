@@ -1,14 +1,23 @@
 
 
+import asyncio
 import json
-from typing import List
+from typing import Iterator, List, Optional, Union
 import requests
+from llm_client import AsyncLLMClient, LLMClient, get_shared_client
+from instrumentation import metrics
+from grounding import GroundingIndex, dominant_script
+from match import JSONStreamExtractor, extract_json
+from chunker import num_predict_for
 
 
 class QAcreate_Engine:
-    def __init__(self, base_url='http://localhost:11434', model='qwen2.5:7b'):
+    def __init__(self, base_url='http://localhost:11434', model='qwen2.5:7b', client: LLMClient = None,
+                 grounding_threshold: float = 0.0):
         self.base_url = base_url
         self.model = model
+        self.grounding_threshold = grounding_threshold
+        self.client = client or get_shared_client(base_url)
         self.setup_system_prompts()
     
     def setup_system_prompts(self):
@@ -42,10 +51,8 @@ class QAcreate_Engine:
             如无可生成内容，则输出空数组 []。"""
         }
     
-    def call_model_api(self, prompt: str, text_chunk: str) -> str:
-        url = f"{self.base_url}/api/generate"
-        
-        payload = {
+    def _build_payload(self, prompt: str, text_chunk: str) -> dict:
+        return {
             "model": self.model,
             "prompt": prompt,
             "system": self.cleaning_prompts["qa_create"],
@@ -53,21 +60,32 @@ class QAcreate_Engine:
             "options": {
                 "temperature": 0.1,
                 "top_p": 0.8,
-                "num_predict": min(len(text_chunk) * 2, 4000),
+                "num_predict": num_predict_for(text_chunk),
                 "repeat_penalty": 1.2
             }
         }
+    
+    def call_model_api(self, prompt: str, text_chunk: str) -> str:
+        payload = self._build_payload(prompt, text_chunk)
         
         try:
-            response = requests.post(
-                url,
-                json=payload,
-                headers={"Content-Type": "application/json"},
-                timeout=60
-            )
-            response.raise_for_status()
+            with metrics.span("llm.qa_create", chars=len(text_chunk)):
+                result = self.client.generate(payload)
+            return result.get('response', '').strip()
             
-            result = response.json()
+        except requests.exceptions.RequestException as e:
+            print(f"API调用失败: {e}")
+            return ""
+        except json.JSONDecodeError as e:
+            print(f"JSON解析失败: {e}")
+            return ""
+    
+    async def acall_model_api(self, prompt: str, text_chunk: str, client: AsyncLLMClient) -> str:
+        payload = self._build_payload(prompt, text_chunk)
+        
+        try:
+            with metrics.span("llm.qa_create", chars=len(text_chunk)):
+                result = await client.generate(payload)
             return result.get('response', '').strip()
             
         except requests.exceptions.RequestException as e:
@@ -77,51 +95,124 @@ class QAcreate_Engine:
             print(f"JSON解析失败: {e}")
             return ""
     
-    def validate_qa_pairs(self, qa_pairs: str, original_text: str) -> bool:
+    def stream_qa_pairs(self, text_chunk: str, max_pairs: Optional[int] = None) -> Iterator[dict]:
+        """
+        流式生成问答对，每个问答对对象在模型输出中闭合后立即返回
+
+        达到 max_pairs 个问答对后关闭连接，模型停止生成；输出被截断时保留截断前已完成的问答对。
+        重复的问答对只返回一次；grounding_threshold 大于0时，与原文文字相同且溯源得分低于阈值的问答对被丢弃，二者都不计入 max_pairs。
+        
+        Args:
+            text_chunk: 文本块
+            max_pairs: 最多返回的问答对数量，None 表示不限制
+        
+        Yields:
+            dict: 包含 human 与 assistant 字段的问答对
+        """
+        payload = self._build_payload(self._create_qa_prompt(text_chunk), text_chunk)
+        extractor = JSONStreamExtractor()
+        stream = self.client.stream_generate(payload)
+        index = source_script = None
+        if self.grounding_threshold > 0:
+            index = GroundingIndex()
+            index.add_page(text_chunk)
+            source_script = dominant_script(text_chunk)
+        seen = set()
+        count = 0
+        
         try:
-            qa_list = json.loads(qa_pairs)
-            for qa in qa_list:
-                if 'human' not in qa or 'assistant' not in qa:
-                    return False
-                if not qa['human'] or not qa['assistant']:
-                    return False
-                if qa['assistant'] not in original_text:
-                    return False
-            return True
-        except:
-            return False
+            for piece in stream:
+                for item in extractor.feed(piece):
+                    if isinstance(item, dict) and item.get('human') and item.get('assistant'):
+                        key = (str(item['human']), str(item['assistant']))
+                        if key in seen:
+                            continue
+                        seen.add(key)
+                        if (index is not None and dominant_script(key[1]) == source_script
+                                and index.score(key[1])['score'] < self.grounding_threshold):
+                            continue
+                        yield item
+                        count += 1
+                        if max_pairs is not None and count >= max_pairs:
+                            return
+                if extractor.done:
+                    return
+        except requests.exceptions.RequestException as e:
+            print(f"API调用失败: {e}")
+        except json.JSONDecodeError as e:
+            print(f"JSON解析失败: {e}")
+        finally:
+            stream.close()
+    
+    def validate_qa_pairs(self, qa_pairs: Union[str, List[dict]], original_text: str,
+                          threshold: Optional[float] = None) -> List[dict]:
+        """
+        检查每个问答对的答案能否在原文中找到依据
+        
+        使用最长公共子串与 n-gram 覆盖率评分，对改写、空白差异等具有容忍度。
+        qa_pairs 为模型输出文本时用 extract_json 解析，容忍代码块标记与前后说明文字。
+        
+        Returns:
+            List[dict]: 每个问答对的评分结果（valid、grounded、score 等），找不到JSON数组时返回空列表
+        """
+        qa_list = extract_json(qa_pairs) if isinstance(qa_pairs, str) else qa_pairs
+        if not isinstance(qa_list, list):
+            return []
+        if threshold is None:
+            threshold = self.grounding_threshold
+        index = GroundingIndex()
+        index.add_page(original_text)
+        return index.score_pairs(qa_list, threshold)
 
-    def create_qa_pairs(self, text_chunk: str, mode="qa_create") -> str:
-        prompt = f"""
+    def _create_qa_prompt(self, text_chunk: str) -> str:
+        return f"""
         文本内容：
         {text_chunk}
 
-        请基于以上文本生成问题和答案，确保每个问题都能在原文中找到对应的明确答案："""   
-        
-        qa_pairs = self.call_model_api(prompt, text_chunk)
-        
+        请基于以上文本生成问题和答案，确保每个问题都能在原文中找到对应的明确答案："""
+    
+    def _check_qa_pairs(self, qa_pairs: str, text_chunk: str) -> str:
+        """
+        丢弃字段不完整的问答对，返回保留部分的 JSON 数组文本；输出无法解析时原样返回
+
+        grounding_threshold 大于0时还丢弃答案在原文中找不到依据的问答对。答案与原文文字不同（如英文原文、
+        中文译文答案）时溯源得分没有意义，这类问答对不按得分丢弃。
+        """
         if not qa_pairs:
             print("生成问答对失败")
-        
-        if not self.validate_qa_pairs(qa_pairs, text_chunk):
-            print("生成的问答对验证失败，可能存在没有答案的问题")
-        
-        try:
-            qa_list = json.loads(qa_pairs)
-            if len(qa_list) < 3:
-                print("生成的有效问答对数量不足")
-        except:
-            print( "生成的格式不是有效的JSON")
+            return ""
         
         if len(qa_pairs) < len(text_chunk) * 0.3:
             print("生成的问答对内容过少")
-        # elif len(qa_pairs) > len(text_chunk) * 3:
-        #     return qa_pairs[:len(text_chunk) * 2]
         
-        if not qa_pairs:
-            return ""
-        else:
+        qa_list = extract_json(qa_pairs)
+        if not isinstance(qa_list, list):
+            print("生成的格式不是有效的JSON")
             return qa_pairs
+        
+        scores = self.validate_qa_pairs(qa_list, text_chunk)
+        source_script = dominant_script(text_chunk)
+        kept = [qa for qa, result in zip(qa_list, scores)
+                if result['valid'] and (result['grounded'] or dominant_script(str(qa['assistant'])) != source_script)]
+        if len(kept) < len(qa_list):
+            print(f"丢弃 {len(qa_list) - len(kept)} 个字段不完整或在原文中找不到依据的问答对")
+        if len(kept) < 3:
+            print("生成的有效问答对数量不足")
+        return json.dumps(kept, ensure_ascii=False)
+
+    def create_qa_pairs(self, text_chunk: str, mode="qa_create") -> str:
+        prompt = self._create_qa_prompt(text_chunk)
+        qa_pairs = self.call_model_api(prompt, text_chunk)
+        return self._check_qa_pairs(qa_pairs, text_chunk)
+
+    async def acreate_qa_pairs(self, text_chunk: str, mode="qa_create", client: AsyncLLMClient = None) -> str:
+        if client is None:
+            async with self.client.async_client() as client:
+                return await self.acreate_qa_pairs(text_chunk, mode, client)
+        
+        prompt = self._create_qa_prompt(text_chunk)
+        qa_pairs = await self.acall_model_api(prompt, text_chunk, client)
+        return self._check_qa_pairs(qa_pairs, text_chunk)
 
     def batch_clean_text(self, text_chunks: List[str], mode="qa_create") -> List[str]:
         cleaned_chunks = []
@@ -130,6 +221,26 @@ class QAcreate_Engine:
             cleaned_chunks.append(cleaned_chunk)
         return cleaned_chunks
 
+    async def abatch_clean_text(self, text_chunks: List[str], mode="qa_create", concurrency: int = 4) -> List[str]:
+        """
+        并发生成多个文本块的问答对
+
+        最多同时发起 concurrency 个请求，结果按输入顺序返回。
+        单个文本块失败时打印错误并返回空字符串，不影响其余文本块。
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async with self.client.async_client(pool_size=concurrency) as client:
+            async def run(index: int, chunk: str) -> str:
+                async with semaphore:
+                    try:
+                        return await self.acreate_qa_pairs(chunk, mode, client)
+                    except Exception as e:
+                        print(f"第 {index} 个文本块生成问答对失败: {e}")
+                        return ""
+            
+            return list(await asyncio.gather(*(run(i, chunk) for i, chunk in enumerate(text_chunks))))
+
 
 def test_qa_engine():
     engine = QAcreate_Engine()
@@ -0,0 +1,322 @@
+import os
+import glob
+import json
+import time
+import logging
+import argparse
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Any, Dict, List
+from main import PDFQAProcessor
+from pdf_pages import get_page_count
+from dedup import QADeduplicator
+from checkpoint import file_hash
+from instrumentation import configure, format_summary, metrics
+
+
+_worker_processor = None
+
+
+def _init_batch_worker(config: Dict[str, Any]):
+    """每个 worker 进程只初始化一次处理器（YOLO、EasyOCR 等模型）"""
+    global _worker_processor
+    _worker_processor = PDFQAProcessor(dict(config, ocr_processes=0))
+    # fork 出的进程继承了父进程已有的计时记录，清空后只上报本进程的记录
+    metrics.drain()
+
+
+def _process_shard(pdf_path: str, output_dir: str, page_nums: List[int], pdf_hash: str = None) -> Dict[str, Any]:
+    """在 worker 进程中处理一个文档的若干页，pdf_hash 为调度进程按文档算好的文件哈希"""
+    os.makedirs(output_dir, exist_ok=True)
+    start = time.time()
+    pages, provenance = {}, {}
+    items = _worker_processor.iter_page_items(pdf_path, output_dir, page_nums, pdf_hash=pdf_hash)
+    for item in _worker_processor.batch_detect(items):
+        pages[item['page_num']] = _worker_processor.process_item(item)
+        provenance[item['page_num']] = {'route': item.get('route'), 'timings': item.get('timings'),
+                                        'text': _worker_processor.page_text(item)}
+    return {'pdf_path': pdf_path, 'pages': pages, 'provenance': provenance, 'seconds': time.time() - start,
+            'metrics': metrics.drain()}
+
+
+def discover_pdfs(inputs: List[str]) -> List[str]:
+    """将目录、glob 模式或文件路径展开为排序去重后的PDF列表"""
+    found = []
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            found.extend(glob.glob(os.path.join(pattern, "**", "*.pdf"), recursive=True))
+        else:
+            found.extend(glob.glob(pattern, recursive=True))
+    return sorted({os.path.abspath(p) for p in found if p.lower().endswith(".pdf")})
+
+
+def document_output_dirs(pdf_paths: List[str], output_root: str) -> Dict[str, str]:
+    """为每个文档分配独立的输出目录，同名文档追加序号"""
+    dirs, used = {}, set()
+    for pdf_path in pdf_paths:
+        stem = os.path.splitext(os.path.basename(pdf_path))[0]
+        name, n = stem, 1
+        while name in used:
+            n += 1
+            name = f"{stem}_{n}"
+        used.add(name)
+        dirs[pdf_path] = os.path.join(output_root, name)
+    return dirs
+
+
+class BatchRunner:
+    """
+    多文档批处理调度器
+
+    将所有文档按页切分为固定大小的分片，统一放入进程池的工作队列，
+    大文档不会独占某个 worker，其余 worker 也不会空闲。每个 worker 进程只加载一次模型。
+    """
+
+    def __init__(self, config: Dict[str, Any] = None, workers: int = 2, shard_pages: int = 8):
+        self.config = config or {}
+        self.workers = max(1, workers)
+        self.shard_pages = max(1, shard_pages)
+        self.logger = logging.getLogger(__name__)
+        self.exporter = None
+        self._dedup: Dict[str, QADeduplicator] = {}
+        self._dedup_next: Dict[str, int] = {}
+        if self.config.get('chunk_qa'):
+            self.logger.warning("批处理按页分片，不支持 chunk_qa，仍按页生成QA对")
+
+    def plan(self, pdf_paths: List[str]) -> Dict[str, int]:
+        """读取每个文档的页数，无法读取的文档记录错误后跳过"""
+        page_counts = {}
+        for pdf_path in pdf_paths:
+            try:
+                page_counts[pdf_path] = get_page_count(pdf_path)
+            except Exception as e:
+                self.logger.error(f"读取页数失败，跳过 {pdf_path}: {e}")
+        return page_counts
+
+    def hash_document(self, pdf_path: str):
+        """读取一次文档计算文件哈希，供该文档所有分片的检查点使用；读取失败时返回 None，交给分片自行处理"""
+        try:
+            return file_hash(pdf_path)
+        except OSError as e:
+            self.logger.error(f"计算文件哈希失败 {pdf_path}: {e}")
+            return None
+
+    def run(self, pdf_paths: List[str], output_root: str = "output") -> Dict[str, Any]:
+        page_counts = self.plan(pdf_paths)
+        output_dirs = document_output_dirs(list(page_counts), output_root)
+        total_pages = sum(page_counts.values())
+        self.logger.info(f"共 {len(page_counts)} 个文档, {total_pages} 页, {self.workers} 个 worker")
+
+        shards = {pdf_path: [list(range(start, min(start + self.shard_pages, count)))
+                             for start in range(0, count, self.shard_pages)]
+                  for pdf_path, count in page_counts.items() if count}
+
+        doc_pages = {pdf_path: {} for pdf_path in page_counts}
+        doc_provenance = {pdf_path: {} for pdf_path in page_counts}
+        doc_failures = {pdf_path: 0 for pdf_path in page_counts}
+        doc_seconds = {pdf_path: 0.0 for pdf_path in page_counts}
+        report = {'documents': {}, 'total_pages': total_pages}
+        if self.config.get('dedup'):
+            threshold = self.config.get('dedup_threshold', 0.7)
+            self._dedup = {pdf_path: QADeduplicator(threshold=threshold) for pdf_path in page_counts}
+            self._dedup_next = {pdf_path: 0 for pdf_path in page_counts}
+        pages_done = 0
+        start = time.time()
+        configure(bool(self.config.get('metrics')))
+
+        # 没有页面的文档不会产生分片，直接写出空结果
+        for pdf_path, count in page_counts.items():
+            if not count:
+                self.logger.warning(f"{os.path.basename(pdf_path)} 没有页面")
+                report['documents'][pdf_path] = self.finish_document(
+                    pdf_path, output_dirs[pdf_path], doc_pages.pop(pdf_path), 0, 0.0, doc_provenance.pop(pdf_path)
+                )
+
+        if self.config.get('parquet'):
+            from export_arrow import ParquetQAWriter
+            self.exporter = ParquetQAWriter(os.path.join(output_root, "QA.parquet"),
+                                            grounding=self.config.get('parquet_grounding', True))
+        # 文件哈希在后台线程中按文档顺序计算，一个文档的哈希算好就提交它的分片，
+        # 第一个分片不必等整个语料库都被读一遍
+        hasher = ThreadPoolExecutor(max_workers=1)
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_batch_worker,
+                                     initargs=(self.config,)) as executor:
+                hashing = {hasher.submit(self.hash_document, pdf_path): pdf_path for pdf_path in shards}
+                futures = {}
+                pending = set(hashing)
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        if future in hashing:
+                            pdf_path = hashing.pop(future)
+                            for page_nums in shards[pdf_path]:
+                                shard = executor.submit(_process_shard, pdf_path, output_dirs[pdf_path], page_nums,
+                                                        future.result())
+                                futures[shard] = (pdf_path, page_nums)
+                                pending.add(shard)
+                            continue
+
+                        pdf_path, page_nums = futures.pop(future)
+                        try:
+                            result = future.result()
+                            doc_pages[pdf_path].update(result['pages'])
+                            doc_provenance[pdf_path].update(result['provenance'])
+                            doc_seconds[pdf_path] += result['seconds']
+                            metrics.merge(result.get('metrics'))
+                        except Exception as e:
+                            self.logger.error(f"{os.path.basename(pdf_path)} 第 {page_nums[0] + 1}-{page_nums[-1] + 1} 页处理失败: {e}")
+                            doc_failures[pdf_path] += len(page_nums)
+                            for n in page_nums:
+                                doc_pages[pdf_path][n] = []
+                        self.feed_dedup(pdf_path, doc_pages[pdf_path])
+
+                        pages_done += len(page_nums)
+                        elapsed = time.time() - start
+                        rate = pages_done / elapsed if elapsed else 0.0
+                        eta = (total_pages - pages_done) / rate if rate else 0.0
+                        self.logger.info(
+                            f"进度: {pages_done}/{total_pages} 页, {rate:.2f} 页/秒, 预计剩余 {eta:.0f} 秒"
+                        )
+
+                        if len(doc_pages[pdf_path]) == page_counts[pdf_path]:
+                            report['documents'][pdf_path] = self.finish_document(
+                                pdf_path, output_dirs[pdf_path], doc_pages.pop(pdf_path),
+                                doc_failures[pdf_path], doc_seconds[pdf_path], doc_provenance.pop(pdf_path)
+                            )
+        except BaseException:
+            if self.exporter is not None:
+                self.exporter.abort()
+                self.exporter = None
+            raise
+        finally:
+            hasher.shutdown(wait=False, cancel_futures=True)
+        if self.exporter is not None:
+            self.exporter.close()
+            report['parquet'] = self.exporter.path
+            self.exporter = None
+
+        elapsed = time.time() - start
+        report['seconds'] = elapsed
+        report['pages_per_second'] = total_pages / elapsed if elapsed else 0.0
+        report['qa_pairs'] = sum(doc['qa_pairs'] for doc in report['documents'].values())
+        os.makedirs(output_root, exist_ok=True)
+        with open(os.path.join(output_root, "batch_report.json"), "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        if metrics.enabled:
+            for line in format_summary(metrics.write_report(os.path.join(output_root, "metrics.json"))):
+                self.logger.info(f"阶段统计 {line}")
+        self.logger.info(
+            f"批处理完成: {len(report['documents'])} 个文档, {total_pages} 页, "
+            f"{report['qa_pairs']} 个QA对, 用时 {elapsed:.1f} 秒 ({report['pages_per_second']:.2f} 页/秒)"
+        )
+        return report
+
+    def feed_dedup(self, pdf_path: str, pages: Dict[int, List[Dict]]):
+        """开启 dedup 时，把从上次位置起已连续完成的页面按页码顺序增量加入该文档的去重索引"""
+        deduplicator = self._dedup.get(pdf_path)
+        if deduplicator is None:
+            return
+        page_num = self._dedup_next[pdf_path]
+        while page_num in pages:
+            deduplicator.add_many(pages[page_num])
+            page_num += 1
+        self._dedup_next[pdf_path] = page_num
+
+    def finish_document(self, pdf_path: str, output_dir: str, pages: Dict[int, List[Dict]],
+                        failures: int, seconds: float, provenance: Dict[int, Dict] = None) -> Dict[str, Any]:
+        """
+        文档所有分片完成后按页码顺序写出最终QA，开启 parquet 时同时追加到汇总的 QA.parquet
+
+        开启 dedup 时 QA.parquet 与 QA.txt 一致，只写入各簇的代表QA对，pair_index 仍是它在该页QA对中的位置。
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        qa_pairs = [pair for page_num in sorted(pages) for pair in pages[page_num]]
+        keep = None
+        if pdf_path in self._dedup:
+            self.feed_dedup(pdf_path, pages)
+            qa_pairs = self._dedup.pop(pdf_path).representatives()
+            keep = {id(pair) for pair in qa_pairs}
+        if self.exporter is not None:
+            document = os.path.basename(output_dir)
+            for page_num in sorted(pages):
+                indices = [i for i, pair in enumerate(pages[page_num]) if keep is None or id(pair) in keep]
+                if not indices:
+                    continue
+                page_info = (provenance or {}).get(page_num, {})
+                self.exporter.add_page([pages[page_num][i] for i in indices], document, page_num,
+                                       source_path=pdf_path, route=page_info.get('route'),
+                                       timings=page_info.get('timings'), source_text=page_info.get('text'),
+                                       pair_indices=indices)
+        PDFQAProcessor.save_final_qa(qa_pairs, output_dir)
+        self.logger.info(f"文档完成: {os.path.basename(pdf_path)}, {len(pages)} 页, {len(qa_pairs)} 个QA对")
+        return {
+            'output_dir': output_dir,
+            'pages': len(pages),
+            'failed_pages': failures,
+            'qa_pairs': len(qa_pairs),
+            'worker_seconds': seconds,
+        }
+
+
+def main():
+    """批处理入口"""
+    parser = argparse.ArgumentParser(description="多文档批量QA对提取工具")
+    parser.add_argument("inputs", nargs="+", help="PDF文件、目录或glob模式，如 Document/ 或 'Document/**/*.pdf'")
+    parser.add_argument("--output_dir", type=str, default="output", help="输出根目录，每个文档一个子目录")
+    parser.add_argument("--workers", type=int, default=2, help="worker进程数，每个进程加载一份模型")
+    parser.add_argument("--shard_pages", type=int, default=8, help="每个任务分片的页数")
+    parser.add_argument("--gpu", type=bool, default=True, help="是否使用GPU")
+    parser.add_argument("--dpi", type=int, default=300, help="页面渲染分辨率")
+    parser.add_argument("--no_text_layer", action="store_true", help="忽略PDF自带文本层，所有页面都走版面检测与OCR")
+    parser.add_argument("--detect_dpi", type=int, default=0, help="版面检测的整页渲染分辨率（如150），默认0表示整页按 --dpi 渲染")
+    parser.add_argument("--detect_batch", type=int, default=4, help="版面检测每次前向推理的页数，1表示逐页检测")
+    parser.add_argument("--resume", action="store_true", help="跳过检查点中已完成的页面与阶段")
+    parser.add_argument("--dedup", action="store_true", help="页面完成时把QA对按页码顺序增量加入该文档的近似去重索引，保存去重后的QA对")
+    parser.add_argument("--dedup_threshold", type=float, default=0.7, help="判为重复的相似度阈值")
+    parser.add_argument("--parquet", action="store_true", help="把所有文档的QA对与来源信息汇总写入 output_dir/QA.parquet")
+    parser.add_argument("--no_parquet_grounding", action="store_true", help="写入 QA.parquet 时不计算答案溯源得分")
+    parser.add_argument("--metrics", action="store_true", help="汇总所有 worker 的各阶段耗时与模型 token 用量，写入 output_dir/metrics.json")
+    parser.add_argument("--metrics_port", type=int, default=None, help="在该端口以 Prometheus 文本格式提供 /metrics（隐含 --metrics）")
+    parser.add_argument("--metrics_host", type=str, default="127.0.0.1", help="/metrics 监听的地址，默认只允许本机访问；供其他机器抓取时设为 0.0.0.0")
+    parser.add_argument("--llm_base_url", type=str, default="http://localhost:11434", help="Ollama服务地址")
+    parser.add_argument("--llm_cache", type=str, default="llm_cache.sqlite", help="模型响应缓存文件路径，为空则不使用缓存")
+
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    config = {
+        'gpu': args.gpu,
+        'dpi': args.dpi,
+        'detect_dpi': args.detect_dpi,
+        'detect_batch': args.detect_batch,
+        'text_layer': not args.no_text_layer,
+        'resume': args.resume,
+        'dedup': args.dedup,
+        'dedup_threshold': args.dedup_threshold,
+        'parquet': args.parquet,
+        'parquet_grounding': not args.no_parquet_grounding,
+        'metrics': args.metrics or bool(args.metrics_port),
+        'llm_base_url': args.llm_base_url,
+        'llm_cache': args.llm_cache
+    }
+
+    pdf_paths = discover_pdfs(args.inputs)
+    if not pdf_paths:
+        print("未找到PDF文件")
+        return
+
+    runner = BatchRunner(config, workers=args.workers, shard_pages=args.shard_pages)
+    if args.metrics_port:
+        configure(True, args.metrics_port, args.metrics_host)
+    report = runner.run(pdf_paths, args.output_dir)
+
+    print(f"处理完成！共 {len(report['documents'])} 个文档, 提取 {report['qa_pairs']} 个QA对")
+    print(f"汇总报告: {args.output_dir}/batch_report.json")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import re
+import json
+import time
+import random
+import argparse
+from match import extract_json
+
+
+def legacy_extract(data_text: str):
+    """原正则提取 + 正则修复流程（不含打印），作为对照"""
+    patterns = [r'```json\s*(\[.*?\])\s*```', r'```\s*(\[.*?\])\s*```', r'(\[.*\])', r'(\{.*\})']
+    json_str = None
+    for pattern in patterns:
+        match = re.search(pattern, data_text, re.DOTALL)
+        if match:
+            json_str = match.group(1).strip()
+            break
+    if not json_str:
+        return None
+    try:
+        return json.loads(json_str)
+    except json.JSONDecodeError:
+        pass
+    fixes = [
+        (r'(\s*)(\w+)(\s*):', r'\1"\2"\3:'),
+        (r"'", '"'),
+        (r',\s*}', '}'),
+        (r',\s*]', ']'),
+        (r',,', ','),
+        (r'([^\\])"', r'\1\\"'),
+    ]
+    for pattern, replacement in fixes:
+        json_str = re.sub(pattern, replacement, json_str)
+    try:
+        return json.loads(json_str)
+    except json.JSONDecodeError:
+        return None
+
+
+def _dump_single_quoted(pairs: list) -> str:
+    items = []
+    for pair in pairs:
+        fields = ", ".join(f"'{k}': '{v}'" for k, v in pair.items())
+        items.append("{" + fields + "}")
+    return "[" + ", ".join(items) + "]"
+
+
+def make_variants(pairs: list, rng: random.Random) -> dict:
+    """把一组QA对渲染成模型常见的各种输出形式，返回 {变体名: (文本, 期望结果)}"""
+    body = json.dumps(pairs, ensure_ascii=False, indent=2)
+    compact = json.dumps(pairs, ensure_ascii=False)
+    cut = rng.randint(len(body) // 3, len(body) * 2 // 3)
+    # 截断处之前完整输出的元素，即 pairs[:k + 1] 的序列化结果（去掉结尾的 "\n]"）是截断文本的前缀
+    complete = sum(len(json.dumps(pairs[:k + 1], ensure_ascii=False, indent=2)) - 2 <= cut
+                   for k in range(len(pairs)))
+    return {
+        'plain': (body, pairs),
+        'fenced': (f"```json\n{body}\n```", pairs),
+        'prose': (f"以下是根据文本生成的问答对：\n{body}\n以上问答对均来自原文。", pairs),
+        'citation': (f"根据原文[1]和第[2]节的内容，生成如下问答对：\n```json\n{body}\n```\n参考文献[3]。", pairs),
+        'brace_note': (f"注意 {{示例}} 如下:\n{compact}", pairs),
+        'trailing_comma': (compact[:-1] + ",]", pairs),
+        'unquoted_keys': (re.sub(r'"(human|assistant)":', r'\1:', compact), pairs),
+        'single_quotes': (_dump_single_quoted(pairs), pairs),
+        'truncated': (body[:cut], pairs[:complete]),
+        'stray_closer': (compact[:-1] + " }", pairs),
+    }
+
+
+def build_corpus(path: str, group: int, limit: int, seed: int) -> list:
+    """从QA数据集确定性地构造模拟的模型输出，每条包含 group 个QA对"""
+    with open(path, "r", encoding="utf-8") as f:
+        pairs = [json.loads(line) for line in f if line.strip()]
+    pairs = [p for p in pairs if "'" not in p['human'] + p['assistant']]
+    rng = random.Random(seed)
+    corpus = []
+    for start in range(0, min(len(pairs), limit * group), group):
+        chunk = pairs[start:start + group]
+        for name, (text, expected) in make_variants(chunk, rng).items():
+            corpus.append((name, text, expected))
+    return corpus
+
+
+def run(func, corpus: list) -> tuple:
+    stats = {}
+    start = time.perf_counter()
+    for name, text, expected in corpus:
+        ok = func(text) == expected
+        total, passed = stats.get(name, (0, 0))
+        stats[name] = (total + 1, passed + ok)
+    return stats, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模型输出JSON提取正确率与速度基准测试")
+    parser.add_argument("--data", type=str, default="medical_qa.json", help="JSONL格式的QA数据集")
+    parser.add_argument("--group", type=int, default=20, help="每条模拟输出包含的QA对数")
+    parser.add_argument("--limit", type=int, default=200, help="模拟输出条数（每种变体）")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--dump", type=str, default=None, help="将构造的语料写入该JSONL文件")
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.data, args.group, args.limit, args.seed)
+    total_chars = sum(len(text) for _, text, _ in corpus)
+    print(f"共 {len(corpus)} 条模拟输出, {total_chars / 1e6:.2f}M 字符")
+
+    if args.dump:
+        with open(args.dump, "w", encoding="utf-8") as f:
+            for name, text, expected in corpus:
+                f.write(json.dumps({'variant': name, 'text': text, 'expected': expected}, ensure_ascii=False) + "\n")
+
+    for label, func in (("原正则", legacy_extract), ("单遍扫描", extract_json)):
+        stats, elapsed = run(func, corpus)
+        passed = sum(p for _, p in stats.values())
+        detail = ", ".join(f"{name} {p}/{t}" for name, (t, p) in stats.items())
+        print(f"{label}: {passed}/{len(corpus)} 正确, {elapsed:.3f}s, {total_chars / elapsed / 1e6:.2f}M 字符/s")
+        print(f"  {detail}")
+
+    # 无效候选的恢复不回头重新扫描，耗时应与输入长度成线性关系
+    # 失败的候选从开括号后重新扫描，每个字符最多处理两次
+    for name, unit, tail in (("未闭合对象", '{"k": "v", ', ']'), ("深层嵌套", '[', '}'),
+                             ("说明文字中的花括号", '{示例} ', '[{"k": "v"}]')):
+        for n in (2000, 20000):
+            text = unit * n + tail
+            start = time.perf_counter()
+            extract_json(text)
+            print(f"{name} {len(text)} 字符: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import time
+import difflib
+import argparse
+import numpy as np
+from main import PDFQAProcessor
+from crop_image import crop_image_numpy
+from page_buffer import PageBuffer, PageRegions
+from pdf_pages import iter_pdf_pages
+
+
+def collect_regions(processor: PDFQAProcessor, pdf_path: str, pages: int, dpi: int) -> tuple:
+    """渲染并检测前若干页，返回所有页的文本区域与对应的整页RGB数组（作为旧路径的对照）"""
+    page_boxes, page_rgb = [], []
+    for i, page in iter_pdf_pages(pdf_path, dpi=dpi, last_page=pages):
+        rgb = np.array(page)
+        item = processor._stage_detect({'page_num': i, 'output_dir': None, 'page': page})
+        page_boxes.append(item.get('boxes', []))
+        page_rgb.append(rgb)
+    return page_boxes, page_rgb
+
+
+def rgb_regions(page_boxes: list, page_rgb: list) -> list:
+    """旧路径：从整页RGB数组按同样的阅读顺序裁剪全分辨率区域"""
+    return [[crop_image_numpy(rgb, box) for box in boxes.boxes] if isinstance(boxes, PageRegions) else []
+            for boxes, rgb in zip(page_boxes, page_rgb)]
+
+
+def run(processor: PDFQAProcessor, page_boxes: list) -> tuple:
+    start = time.perf_counter()
+    texts = [processor.extract_text_from_boxes(boxes) for boxes in page_boxes]
+    return texts, time.perf_counter() - start
+
+
+def similarity(a: list, b: list) -> float:
+    return sum(difflib.SequenceMatcher(None, x, y).ratio() for x, y in zip(a, b)) / max(len(a), 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="文本框OCR吞吐量基准测试")
+    parser.add_argument("--pdf_path", type=str, required=True, help="PDF文件路径")
+    parser.add_argument("--pages", type=int, default=5, help="测试页数")
+    parser.add_argument("--dpi", type=int, default=300, help="渲染分辨率")
+    parser.add_argument("--ocr_processes", type=int, default=4, help="并行OCR进程数")
+    parser.add_argument("--ocr_x_height", type=float, default=20, help="文本区域缩放的目标x高度，0表示不缩放")
+    parser.add_argument("--gpu", action="store_true", help="是否使用GPU")
+    args = parser.parse_args()
+
+    processor = PDFQAProcessor({'gpu': args.gpu, 'ocr_processes': 0, 'ocr_x_height': args.ocr_x_height})
+    page_boxes, page_rgb = collect_regions(processor, args.pdf_path, args.pages, args.dpi)
+    n_regions = sum(len(boxes) for boxes in page_boxes)
+    print(f"共 {len(page_boxes)} 页, {n_regions} 个文本框")
+
+    rgb_bytes = sum(rgb.nbytes for rgb in page_rgb) / len(page_rgb)
+    gray_bytes = sum(b.buffer.nbytes for b in page_boxes if isinstance(b, PageRegions)) / len(page_rgb)
+    crop_bytes = sum(r.nbytes for boxes in page_boxes if isinstance(boxes, PageRegions)
+                     for r in boxes if not np.shares_memory(r, boxes.buffer.array)) / len(page_rgb)
+    print(f"每页内存: RGB整页 {rgb_bytes / 2 ** 20:.1f} MiB -> 灰度缓冲区 {gray_bytes / 2 ** 20:.1f} MiB"
+          f"（缩放生成的区域 {crop_bytes / 2 ** 20:.1f} MiB，其余区域为零拷贝视图）")
+
+    baseline_texts, baseline_time = run(processor, rgb_regions(page_boxes, page_rgb))
+    print(f"RGB全分辨率: {baseline_time:.2f}s, {n_regions / baseline_time:.2f} regions/s")
+    del page_rgb
+
+    serial_texts, serial_time = run(processor, page_boxes)
+    print(f"灰度+缩放:   {serial_time:.2f}s, {n_regions / serial_time:.2f} regions/s, "
+          f"加速比 {baseline_time / serial_time:.2f}x")
+    print(f"与RGB全分辨率输出一致: {serial_texts == baseline_texts}, 平均相似度 {similarity(serial_texts, baseline_texts):.4f}")
+
+    for shared in (False, True):
+        parallel = PDFQAProcessor({'gpu': args.gpu, 'ocr_processes': args.ocr_processes, 'shared_pages': shared,
+                                   'ocr_x_height': args.ocr_x_height})
+        regions = page_boxes
+        if shared:
+            regions = [PageRegions(PageBuffer(b.buffer.array, shared=True, gray=False), b.boxes, b.target_x_height)
+                       if isinstance(b, PageRegions) else b for b in page_boxes]
+        parallel.extract_text_from_boxes(page_boxes[0][:1])
+        parallel_texts, parallel_time = run(parallel, regions)
+        parallel.ocr_pool.close()
+        if shared:
+            for b in regions:
+                if isinstance(b, PageRegions):
+                    b.close()
+        label = "共享内存" if shared else "序列化区域"
+        print(f"并行({args.ocr_processes}进程, {label}): {parallel_time:.2f}s, {n_regions / parallel_time:.2f} regions/s, "
+              f"加速比 {serial_time / parallel_time:.2f}x, 输出一致: {serial_texts == parallel_texts}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import time
+import argparse
+import numpy as np
+import pymupdf
+from pdf_pages import iter_pdf_pages, iter_rendered_pages, render_page_region
+
+
+def text_boxes(page, dpi: int) -> list:
+    """用文本层的文本块近似版面检测得到的文本框（像素坐标）"""
+    scale = dpi / 72
+    return [[int(x0 * scale), int(y0 * scale), int(x1 * scale) + 1, int(y1 * scale) + 1]
+            for x0, y0, x1, y1, *_ in page.get_text("blocks")]
+
+
+def run_full(pdf_path: str, n_pages: int, dpi: int) -> tuple:
+    """旧路径：pdf2image 按OCR分辨率渲染整页，再转为RGB数组"""
+    start = time.perf_counter()
+    total = 0
+    for _, page in iter_pdf_pages(pdf_path, dpi=dpi, last_page=n_pages):
+        total += np.array(page).nbytes
+    return time.perf_counter() - start, total
+
+
+def run_adaptive(pdf_path: str, boxes: list, dpi: int, detect_dpi: int) -> tuple:
+    """新路径：低分辨率整页用于检测，文本框外接矩形按OCR分辨率渲染（RGB，与未开启 --ocr_x_height 时一致）"""
+    start = time.perf_counter()
+    page_bytes = region_bytes = 0
+    for i, page in iter_rendered_pages(pdf_path, range(len(boxes)), dpi=detect_dpi):
+        page_bytes += np.asarray(page).nbytes
+        if boxes[i]:
+            bounds = np.array(boxes[i])
+            union = [*bounds[:, :2].min(axis=0), *bounds[:, 2:].max(axis=0)]
+            region_bytes += render_page_region(pdf_path, i, union, detect_dpi, dpi, gray=False)[0].nbytes
+    return time.perf_counter() - start, page_bytes, region_bytes
+
+
+def compare_ocr(pdf_path: str, n_pages: int, dpi: int, detect_dpi: int, gpu: bool) -> tuple:
+    """
+    准确性检查：同一页的文本框分别从整页 dpi RGB 数组裁剪（原流程）与按 detect_dpi 坐标只渲染区域，
+    比较 EasyOCR 的识别结果；文本框取自文本层，分别按两种分辨率换算，包含低分辨率坐标取整与外扩的影响
+    """
+    from bench_ocr import similarity
+    from crop_image import crop_image_numpy
+    from main import PDFQAProcessor
+
+    processor = PDFQAProcessor({'gpu': gpu, 'ocr_processes': 0, 'dpi': dpi, 'detect_dpi': detect_dpi})
+    with pymupdf.open(pdf_path) as doc:
+        full_boxes = [text_boxes(doc[i], dpi) for i in range(n_pages)]
+        low_boxes = [text_boxes(doc[i], detect_dpi) for i in range(n_pages)]
+    full_texts, region_texts = [], []
+    for i, page in iter_pdf_pages(pdf_path, dpi=dpi, last_page=n_pages):
+        if not full_boxes[i]:
+            continue
+        rgb = np.array(page)
+        full_texts.append(processor.extract_text_from_boxes([crop_image_numpy(rgb, box) for box in full_boxes[i]]))
+        regions = processor.render_boxes({'pdf_path': pdf_path, 'page_num': i}, low_boxes[i])
+        region_texts.append(processor.extract_text_from_boxes(regions))
+    return similarity(region_texts, full_texts), region_texts == full_texts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="整页高分辨率渲染与“低分辨率检测+文本区域高分辨率渲染”的对比")
+    parser.add_argument("--pdf_path", type=str, required=True, help="PDF文件路径")
+    parser.add_argument("--pages", type=int, default=10, help="测试页数")
+    parser.add_argument("--dpi", type=int, default=300, help="OCR分辨率")
+    parser.add_argument("--detect_dpi", type=int, default=150, help="版面检测分辨率")
+    parser.add_argument("--ocr", action="store_true", help="同时比较两种路径的OCR识别结果（需要EasyOCR）")
+    parser.add_argument("--gpu", action="store_true", help="OCR是否使用GPU")
+    args = parser.parse_args()
+
+    with pymupdf.open(args.pdf_path) as doc:
+        n_pages = min(args.pages, len(doc))
+        boxes = [text_boxes(doc[i], args.detect_dpi) for i in range(n_pages)]
+    mib = n_pages * 2 ** 20
+    print(f"{n_pages} 页, {sum(map(len, boxes))} 个文本区域")
+
+    full_time, full_bytes = run_full(args.pdf_path, n_pages, args.dpi)
+    print(f"整页 {args.dpi}DPI RGB（pdf2image）: {full_time:.2f}s, {full_bytes / mib:.1f} MiB/页")
+
+    adaptive_time, page_bytes, region_bytes = run_adaptive(args.pdf_path, boxes, args.dpi, args.detect_dpi)
+    print(f"{args.detect_dpi}DPI 整页 + {args.dpi}DPI RGB文本区域: {adaptive_time:.2f}s, "
+          f"{(page_bytes + region_bytes) / mib:.1f} MiB/页（整页 {page_bytes / mib:.1f} + 区域 {region_bytes / mib:.1f}）")
+    print(f"渲染加速 {full_time / adaptive_time:.2f}x, 内存减少 {full_bytes / (page_bytes + region_bytes):.2f}x")
+
+    if args.ocr:
+        ratio, identical = compare_ocr(args.pdf_path, n_pages, args.dpi, args.detect_dpi, args.gpu)
+        print(f"OCR识别结果与整页路径一致: {identical}, 平均相似度 {ratio:.4f}")
+
+
+if __name__ == "__main__":
+    main()
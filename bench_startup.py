@@ -0,0 +1,36 @@
+import sys
+import time
+import argparse
+import subprocess
+
+
+SCENARIOS = {
+    'text_only': "from main import PDFQAProcessor; p = PDFQAProcessor({'llm_cache': None}); p.text_cleaner; p.qa_creator",
+    'full': "from main import PDFQAProcessor; p = PDFQAProcessor({'llm_cache': None, 'gpu': False}); p.text_cleaner; p.qa_creator; p.detector; p.reader",
+}
+
+
+def measure(code: str, repeat: int) -> list:
+    """在新进程中执行代码并记录冷启动耗时"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True, capture_output=True)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PDFQAProcessor 冷启动耗时基准测试")
+    parser.add_argument("--repeat", type=int, default=5, help="每个场景的重复次数")
+    parser.add_argument("--full", action="store_true", help="同时测试加载YOLO与EasyOCR的完整启动")
+    args = parser.parse_args()
+
+    scenarios = ['text_only', 'full'] if args.full else ['text_only']
+    for name in scenarios:
+        timings = measure(SCENARIOS[name], args.repeat)
+        print(f"{name:10s} 最短 {min(timings):.3f}s, 平均 {sum(timings) / len(timings):.3f}s")
+
+
+if __name__ == "__main__":
+    main()
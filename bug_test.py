@@ -1,42 +1,34 @@
-import json
-from typing import Union
+import argparse
 from pathlib import Path
+from dataset_io import validate_jsonl
+
+def debug_json_file(file_path, legacy=False, show=50):
 
-def debug_json_file(file_path):
-    
     file_path = Path(file_path)
-    
+
     if not file_path.exists():
         print(f"文件不存在: {file_path}")
         return
-    
+
     print(f"\n调试文件: {file_path}")
     print("=" * 50)
-    
-    with open(file_path, 'r', encoding='utf-8') as f:
-        for line_num, line in enumerate(f, 1):
-            line = line.strip()
-            if not line:
-                continue
-                
-            try:
-                data = json.loads(line)
-                print(f"第{line_num}行: ✓ 有效")
-                print(f"  内容: {data}")
-            except json.JSONDecodeError as e:
-                print(f"第{line_num}行: ✗ JSON解析错误")
-                print(f"  错误: {e}")
-                print(f"  原始内容: {line}")
-                print(f"  错误位置: 字符 {e.pos}")
-          
-                if e.pos and e.pos < len(line):
-                    start = max(0, e.pos - 20)
-                    end = min(len(line), e.pos + 20)
-                    context = line[start:end]
-                    pointer = " " * (e.pos - start) + "^"
-                    print(f"  上下文: ...{context}...")
-                    print(f"          ...{pointer}...")
-                break  
-
-
-debug_json_file('train.json')
+
+    report = validate_jsonl(str(file_path), legacy=legacy)
+    print(f"共 {report['lines']} 行: ✓ 有效 {report['valid']}，✗ 错误 {len(report['errors'])}，"
+          f"用时 {report['seconds']:.2f}s")
+
+    for error in report['errors'][:show]:
+        print(f"第{error.line_no + 1}行（字节偏移 {error.offset}）: ✗ {error.error}")
+        print(f"  原始内容: {error.text}")
+    if len(report['errors']) > show:
+        print(f"... 另有 {len(report['errors']) - show} 个错误行未显示")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="检查 JSON Lines 文件，列出所有格式错误的行")
+    parser.add_argument("file_path", type=str, nargs="?", default="train.json", help="JSON Lines 文件")
+    parser.add_argument("--legacy", action="store_true", help="兼容旧版 QA.txt 的 Python 字面量写法")
+    parser.add_argument("--show", type=int, default=50, help="最多显示的错误行数")
+    args = parser.parse_args()
+    debug_json_file(args.file_path, args.legacy, args.show)
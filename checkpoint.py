@@ -0,0 +1,80 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+from typing import Any, Dict, Optional
+
+
+def text_hash(text: str) -> str:
+    """计算文本内容的哈希"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def file_hash(path: str, block_size: int = 1 << 20) -> str:
+    """分块计算文件内容的哈希"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def atomic_write_text(path: str, text: str):
+    """
+    原子写入文本文件
+
+    先写入同目录下的临时文件并落盘，再通过 os.replace 替换目标文件，
+    进程中途退出时目标文件要么是旧内容，要么是完整的新内容。
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_", suffix=os.path.basename(path))
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def atomic_write_json(path: str, data: Any):
+    atomic_write_text(path, json.dumps(data, ensure_ascii=False, indent=2))
+
+
+class PageManifest:
+    """
+    页面级处理清单
+
+    每页一个 JSON 记录（output_dir/.manifest/page_{n}.json），记录该页已完成的阶段及其输入哈希。
+    每页单独成文件，多个进程并发处理同一文档的不同页面时不会互相覆盖。
+    """
+
+    def __init__(self, output_dir: str):
+        self.dir = os.path.join(output_dir, ".manifest")
+        os.makedirs(self.dir, exist_ok=True)
+
+    def _path(self, page_num: int) -> str:
+        return os.path.join(self.dir, f"page_{page_num}.json")
+
+    def load(self, page_num: int) -> Dict:
+        try:
+            with open(self._path(page_num), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {"page_num": page_num, "stages": {}}
+
+    def get_stage(self, page_num: int, stage: str) -> Optional[Dict]:
+        return self.load(page_num)["stages"].get(stage)
+
+    def is_done(self, page_num: int, stage: str, input_hash: str) -> bool:
+        record = self.get_stage(page_num, stage)
+        return record is not None and record.get("input_hash") == input_hash
+
+    def mark_done(self, page_num: int, stage: str, input_hash: str, **extra):
+        record = self.load(page_num)
+        record["stages"][stage] = dict(extra, input_hash=input_hash, finished_at=time.time())
+        atomic_write_json(self._path(page_num), record)
@@ -0,0 +1,201 @@
+import os
+import re
+import math
+import argparse
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+_CJK = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+_LATIN = re.compile(r"[A-Za-z]+")
+_DIGIT = re.compile(r"\d")
+_SPACE = re.compile(r"\s")
+_SENTENCE = re.compile(r"[^\n]*?(?:[。！？；!?;]+[”’\"'」）)]*|\.(?=\s)|\n+|$)")
+_SENTENCE_END = re.compile(r"(?:[。！？；!?;.:：]+[”’\"'」）)]*|\n)\s*$")
+_HEADING = re.compile(
+    r"^\s*(?:#{1,6}\s|第[一二三四五六七八九十百\d]+[章节部分篇]|[一二三四五六七八九十]+[、.．]"
+    r"|\d+(?:\.\d+){0,3}[\s、.．]\s*\S|[（(][一二三四五六七八九十\d]+[)）])"
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    估算文本的 token 数
+
+    按 Qwen 系列分词器的经验比例估算：中文字符约 0.75 token/字，英文单词约 4 字母/token，
+    数字逐位计数，其余非空白符号各计 1 个。用于决定分块大小与 num_predict，不需要精确值。
+    """
+    cjk = len(_CJK.findall(text))
+    latin = _LATIN.findall(text)
+    letters = sum(len(word) for word in latin)
+    digits = len(_DIGIT.findall(text))
+    other = len(text) - cjk - letters - digits - len(_SPACE.findall(text))
+    return math.ceil(cjk * 0.75 + sum(math.ceil(len(word) / 4) for word in latin) + digits + max(other, 0))
+
+
+def num_predict_for(text: str, ratio: float = 2.0, floor: int = 256, cap: int = 4000) -> int:
+    """按输入 token 数估算生成上限：ratio 倍输入 token 数，限制在 [floor, cap] 之间"""
+    return max(floor, min(cap, int(estimate_tokens(text) * ratio)))
+
+
+def is_heading(unit: str) -> bool:
+    """短行且以章节编号开头时视为标题"""
+    line = unit.strip()
+    return 0 < len(line) <= 40 and bool(_HEADING.match(line))
+
+
+def is_table_line(line: str) -> bool:
+    return line.count("|") >= 2 or line.count("\t") >= 2
+
+
+def split_units(text: str) -> List[str]:
+    """
+    把文本切分为不可再分的单元：句子、标题行或整张表格
+
+    连续的表格行（含两个以上 | 或制表符）合并为一个单元，避免表格被拆到两个分块中。
+    """
+    units = []
+    table = []
+    for line in text.splitlines(keepends=True):
+        if is_table_line(line):
+            table.append(line)
+            continue
+        if table:
+            units.append("".join(table))
+            table = []
+        units.extend(s for s in _SENTENCE.findall(line) if s)
+    if table:
+        units.append("".join(table))
+    return units
+
+
+class SemanticChunker:
+
+    def __init__(self, max_tokens: int = 1200, overlap_tokens: int = 100, min_tokens: Optional[int] = None):
+        """
+        按语义边界、以 token 预算打包文本的分块器
+
+        逐页输入清洗后的文本，在句子、标题与表格边界处切分，再把单元依次装入不超过 max_tokens 的分块。
+        遇到章节标题且当前分块已有 min_tokens 时提前结束分块；相邻分块之间重叠约 overlap_tokens 的
+        末尾句子以保留上下文（章节边界处不重叠）。页面末尾未结束的句子会与下一页开头拼接，
+        多个短页面会合并进同一个分块，从而减少模型调用次数。
+
+        Args:
+            max_tokens: 单个分块的 token 上限
+            overlap_tokens: 相邻分块重叠的 token 数
+            min_tokens: 遇到标题时提前切分所需的最少 token 数，默认 max_tokens 的一半
+        """
+        if overlap_tokens >= max_tokens:
+            raise ValueError("overlap_tokens 必须小于 max_tokens")
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.min_tokens = max_tokens // 2 if min_tokens is None else min_tokens
+        self._units: List[Tuple[str, int, Tuple[int, ...]]] = []
+        self._tokens = 0
+        self._fresh = 0
+        self._tail = ""
+        self._tail_pages: Tuple[int, ...] = ()
+
+    def feed(self, text: str, page_num: int) -> List[Dict]:
+        """
+        输入一页文本
+
+        Returns:
+            List[Dict]: 本次新完成的分块，每个包含 text、pages（来源页码）与 tokens
+        """
+        chunks = []
+        carried = self._tail_pages
+        units = split_units(self._tail + text)
+        unit_pages = [(page_num,)] * len(units)
+        if units and carried:
+            unit_pages[0] = tuple(sorted(set(carried + (page_num,))))
+        self._tail, self._tail_pages = "", ()
+        if units and not _SENTENCE_END.search(units[-1]) and not is_table_line(units[-1]) and not is_heading(units[-1]):
+            self._tail, self._tail_pages = units.pop(), unit_pages.pop()
+        for unit, pages in zip(units, unit_pages):
+            self._add(unit, pages, chunks)
+        return chunks
+
+    def flush(self) -> List[Dict]:
+        """结束输入，返回剩余的分块"""
+        chunks = []
+        if self._tail:
+            self._add(self._tail, self._tail_pages, chunks)
+            self._tail, self._tail_pages = "", ()
+        if self._fresh:
+            chunks.append(self._emit(overlap=False))
+        self._units, self._tokens, self._fresh = [], 0, 0
+        return chunks
+
+    def chunk_pages(self, pages: Iterable[Tuple[int, str]]) -> List[Dict]:
+        """对 (页码, 文本) 序列分块"""
+        chunks = []
+        for page_num, text in pages:
+            chunks.extend(self.feed(text, page_num))
+        chunks.extend(self.flush())
+        return chunks
+
+    def _add(self, unit: str, pages: Tuple[int, ...], chunks: List[Dict]):
+        tokens = estimate_tokens(unit)
+        if tokens > self.max_tokens - self.overlap_tokens:
+            for piece in self._split_long(unit, tokens):
+                self._add(piece, pages, chunks)
+            return
+        if self._fresh and is_heading(unit) and self._tokens >= self.min_tokens:
+            chunks.append(self._emit(overlap=False))
+        elif self._fresh and self._tokens + tokens > self.max_tokens:
+            chunks.append(self._emit(overlap=True))
+        self._units.append((unit, tokens, pages))
+        self._tokens += tokens
+        self._fresh += tokens
+
+    def _split_long(self, unit: str, tokens: int) -> List[str]:
+        """超长单元（如长表格或没有标点的段落）按行或按字符数切开"""
+        budget = self.max_tokens - self.overlap_tokens
+        lines = unit.splitlines(keepends=True)
+        if len(lines) > 1:
+            return lines
+        size = max(1, len(unit) * budget // tokens)
+        return [unit[i:i + size] for i in range(0, len(unit), size)]
+
+    def _emit(self, overlap: bool) -> Dict:
+        units = self._units
+        chunk = {
+            "text": "".join(unit for unit, _, _ in units).strip(),
+            "pages": sorted({page for _, _, pages in units for page in pages}),
+            "tokens": self._tokens,
+        }
+        kept, kept_tokens = [], 0
+        if overlap and self.overlap_tokens:
+            for unit in reversed(units[1:]):
+                if kept_tokens + unit[1] > self.overlap_tokens:
+                    break
+                kept.insert(0, unit)
+                kept_tokens += unit[1]
+        self._units, self._tokens, self._fresh = kept, kept_tokens, 0
+        return chunk
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对清洗后的页面文本分块并统计模型调用次数")
+    parser.add_argument("--output_dir", type=str, default="output", help="包含 page_{n}.txt 的输出目录")
+    parser.add_argument("--max_tokens", type=int, default=1200, help="单个分块的 token 上限")
+    parser.add_argument("--overlap_tokens", type=int, default=100, help="相邻分块重叠的 token 数")
+    args = parser.parse_args()
+
+    pattern = re.compile(r"^page_(\d+)\.txt$")
+    page_nums = sorted(int(m.group(1)) for m in map(pattern.match, os.listdir(args.output_dir)) if m)
+    pages = []
+    for page_num in page_nums:
+        with open(os.path.join(args.output_dir, f"page_{page_num}.txt"), "r", encoding="utf-8") as f:
+            pages.append((page_num, f.read()))
+
+    chunks = SemanticChunker(args.max_tokens, args.overlap_tokens).chunk_pages(pages)
+    page_tokens = [estimate_tokens(text) for _, text in pages]
+    print(f"{len(pages)} 页（共约 {sum(page_tokens)} tokens，单页最多 {max(page_tokens, default=0)}）"
+          f" -> {len(chunks)} 个分块，模型调用减少 {len(pages) - len(chunks)} 次")
+    for chunk in chunks:
+        print(f"  页 {chunk['pages']}: {chunk['tokens']} tokens, num_predict={num_predict_for(chunk['text'])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,395 @@
+import os
+import ast
+import mmap
+import json
+import time
+import argparse
+import tempfile
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+REQUIRED_FIELDS = ("human", "assistant")
+CHUNK_SIZE = 16 << 20
+
+
+class LineError(NamedTuple):
+    line_no: int
+    offset: int
+    error: str
+    text: str
+
+
+def dumps_line(record: Any) -> bytes:
+    """序列化为一行 JSON（UTF-8，不转义中文，以换行结尾）"""
+    if orjson is not None:
+        return orjson.dumps(record) + b"\n"
+    return (json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+def loads_line(raw: bytes, legacy: bool = False) -> Any:
+    """
+    解析一行 JSON
+
+    legacy 为 True 时，JSON 解析失败的行再按 Python 字面量解析（旧版 QA.txt 用 str(item) 写出）。
+    解析失败抛出 ValueError。
+    """
+    try:
+        return orjson.loads(raw) if orjson is not None else json.loads(raw)
+    except ValueError as e:
+        if not legacy:
+            raise
+        try:
+            return ast.literal_eval(raw.decode("utf-8"))
+        except (ValueError, SyntaxError, MemoryError, RecursionError, UnicodeDecodeError):
+            raise e from None
+
+
+def validate_pair(record: Any) -> Optional[str]:
+    """检查问答对的结构：对象且 human、assistant 均为字符串，不合法时返回原因"""
+    if not isinstance(record, dict):
+        return f"不是对象: {type(record).__name__}"
+    for field in REQUIRED_FIELDS:
+        if field not in record:
+            return f"缺少字段 {field}"
+        if not isinstance(record[field], str):
+            return f"字段 {field} 不是字符串: {type(record[field]).__name__}"
+    return None
+
+
+class JSONLWriter:
+
+    def __init__(self, path: str, append: bool = False, buffer_size: int = 1 << 20, fsync: bool = False):
+        """
+        JSON Lines 写入器
+
+        追加模式下记录先在内存中缓冲，每次刷新用一次 write 把若干整行追加到以 O_APPEND 打开的文件末尾，
+        文件中不会出现写了一半的行；打开时若上次写入中断留下了不完整的末行，先将其截掉。
+        覆盖模式下写入同目录的临时文件，close 时落盘并替换目标文件，中途失败时目标文件保持原样。
+
+        Args:
+            path: 输出文件路径
+            append: 是否追加到已有文件
+            buffer_size: 缓冲字节数，超过后写入文件
+            fsync: 每次刷新后是否落盘
+        """
+        self.path = path
+        self.append = append
+        self.buffer_size = buffer_size
+        self.fsync = fsync
+        self.count = 0
+        self._buffer: List[bytes] = []
+        self._buffered = 0
+        self._tmp_path = None
+        directory = os.path.dirname(os.path.abspath(path))
+        if append:
+            self._repair_tail(path)
+            self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        else:
+            self._fd, self._tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_", suffix=os.path.basename(path))
+
+    @staticmethod
+    def _repair_tail(path: str):
+        """截掉文件末尾没有换行符的不完整行"""
+        if not os.path.exists(path):
+            return
+        with open(path, "r+b") as f:
+            size = f.seek(0, os.SEEK_END)
+            end = size
+            while end > 0:
+                start = max(0, end - 65536)
+                f.seek(start)
+                block = f.read(end - start)
+                if end == size and block.endswith(b"\n"):
+                    return
+                newline = block.rfind(b"\n")
+                if newline >= 0:
+                    f.truncate(start + newline + 1)
+                    return
+                end = start
+            f.truncate(0)
+
+    def write(self, record: Any):
+        line = dumps_line(record)
+        self._buffer.append(line)
+        self._buffered += len(line)
+        self.count += 1
+        if self._buffered >= self.buffer_size:
+            self.flush()
+
+    def write_many(self, records: Iterable[Any]):
+        for record in records:
+            self.write(record)
+
+    def flush(self):
+        if not self._buffer:
+            return
+        data = b"".join(self._buffer)
+        self._buffer, self._buffered = [], 0
+        view = memoryview(data)
+        while view:
+            written = os.write(self._fd, view)
+            view = view[written:]
+        if self.fsync:
+            os.fsync(self._fd)
+
+    def close(self):
+        if self._fd is None:
+            return
+        try:
+            self.flush()
+            if self._tmp_path is not None:
+                os.fsync(self._fd)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+        if self._tmp_path is not None:
+            os.replace(self._tmp_path, self.path)
+            self._tmp_path = None
+
+    def abort(self):
+        """放弃覆盖模式下尚未替换的写入"""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        if self._tmp_path is not None and os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+        self._tmp_path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and self._tmp_path is not None:
+            self.abort()
+        else:
+            self.close()
+
+
+def write_jsonl(path: str, records: Iterable[Any]) -> int:
+    """原子地写出整个 JSON Lines 文件，返回记录数"""
+    with JSONLWriter(path) as writer:
+        writer.write_many(records)
+    return writer.count
+
+
+def append_jsonl(path: str, records: Iterable[Any], fsync: bool = False) -> int:
+    """把记录追加到 JSON Lines 文件末尾，返回记录数"""
+    with JSONLWriter(path, append=True, fsync=fsync) as writer:
+        writer.write_many(records)
+    return writer.count
+
+
+def _newlines(data, start: int = 0, end: Optional[int] = None, chunk_size: int = CHUNK_SIZE) -> np.ndarray:
+    """分块查找换行符的位置（numpy 向量化，不逐字节进入解释器）"""
+    end = len(data) if end is None else end
+    found = []
+    for chunk_start in range(start, end, chunk_size):
+        chunk_end = min(chunk_start + chunk_size, end)
+        chunk = np.frombuffer(data, dtype=np.uint8, count=chunk_end - chunk_start, offset=chunk_start)
+        found.append(np.flatnonzero(chunk == 10) + chunk_start)
+    return np.concatenate(found) if found else np.zeros(0, dtype=np.int64)
+
+
+def _has_invalid(records: List[Any]) -> bool:
+    """整块记录中是否有不符合问答对结构的记录（逐个调用 validate_pair 的快速版本）"""
+    return any(type(r) is not dict or type(r.get("human")) is not str or type(r.get("assistant")) is not str
+               for r in records)
+
+
+def _parse_block(block: bytes, starts: List[int], base: int, line_no: int, validate: bool, legacy: bool,
+                 errors: List[LineError]) -> Tuple[Iterable[int], List[Any]]:
+    """
+    解析一块完整的行
+
+    先把整块的换行替换为逗号，作为一个 JSON 数组一次解析；只有整块解析失败（存在坏行或空行）
+    或其中有不符合结构的记录时才逐行解析，定位每一个坏行。
+
+    Returns:
+        Tuple[Iterable[int], List[Any]]: 有效记录在块内的行序号与对应的记录
+    """
+    if not legacy:
+        try:
+            records = loads_line(b"[" + block.rstrip(b"\n").replace(b"\n", b",") + b"]")
+            if len(records) == len(starts) and not (validate and _has_invalid(records)):
+                return range(len(records)), records
+        except ValueError:
+            pass
+
+    positions, records = [], []
+    for i, start in enumerate(starts):
+        end = starts[i + 1] if i + 1 < len(starts) else base + len(block)
+        raw = block[start - base:end - base].strip()
+        if not raw:
+            continue
+        try:
+            record = loads_line(raw, legacy)
+        except ValueError as e:
+            errors.append(LineError(line_no + i, start, f"JSON解析错误: {e}", raw[:200].decode("utf-8", errors="replace")))
+            continue
+        problem = validate_pair(record) if validate else None
+        if problem is not None:
+            errors.append(LineError(line_no + i, start, problem, raw[:200].decode("utf-8", errors="replace")))
+            continue
+        positions.append(i)
+        records.append(record)
+    return positions, records
+
+
+def _iter_blocks(path: str, validate: bool, errors: List[LineError], legacy: bool,
+                 chunk_size: int) -> Iterator[Tuple[int, List[int], Iterable[int], List[Any]]]:
+    """按块读取并解析文件，产出（块首行号、块内每行起始偏移、有效记录的块内行序号、记录）"""
+    offset = line_no = 0
+    tail = b""
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data and not tail:
+                return
+            block = tail + data
+            cut = len(block) if not data else block.rfind(b"\n") + 1
+            if cut == 0:
+                tail = block
+                continue
+            block, tail = block[:cut], block[cut:]
+            newlines = _newlines(block)
+            if block.endswith(b"\n"):
+                newlines = newlines[:-1]
+            starts = np.concatenate(([0], newlines + 1)).astype(np.int64) + offset
+            starts = starts.tolist()
+            positions, records = _parse_block(block, starts, offset, line_no, validate, legacy, errors)
+            yield line_no, starts, positions, records
+            offset += len(block)
+            line_no += len(starts)
+            if not data:
+                return
+
+
+def iter_jsonl(path: str, validate: bool = True, errors: Optional[List[LineError]] = None, legacy: bool = False,
+               chunk_size: int = CHUNK_SIZE) -> Iterator[Tuple[int, int, Any]]:
+    """
+    流式读取 JSON Lines 文件
+
+    文件按 chunk_size 字节分块读取，每块在最后一个换行处截断、余下部分并入下一块；每块作为一个数组一次解析
+    （优先使用 orjson），内存占用与文件大小无关。坏行与不符合问答对结构的行不会中断读取，
+    而是连同行号与字节偏移追加到 errors。
+
+    Args:
+        path: 文件路径
+        validate: 是否检查问答对结构
+        errors: 收集坏行的列表
+        legacy: 是否兼容旧版 QA.txt 的 Python 字面量写法
+        chunk_size: 每次读取的字节数
+
+    Yields:
+        Tuple[int, int, Any]: 行号（从0开始）、行首字节偏移、记录
+    """
+    errors = [] if errors is None else errors
+    for line_no, starts, positions, records in _iter_blocks(path, validate, errors, legacy, chunk_size):
+        for i, record in zip(positions, records):
+            yield line_no + i, starts[i], record
+
+
+def read_jsonl(path: str, validate: bool = True, legacy: bool = False) -> Tuple[List[Any], List[LineError]]:
+    """读取整个 JSON Lines 文件，返回记录列表与坏行列表"""
+    errors: List[LineError] = []
+    records = [record for _, _, record in iter_jsonl(path, validate, errors, legacy)]
+    return records, errors
+
+
+def validate_jsonl(path: str, legacy: bool = False) -> Dict[str, Any]:
+    """
+    校验整个 JSON Lines 文件
+
+    Returns:
+        Dict[str, Any]: 行数、有效记录数、所有坏行（LineError）、耗时与吞吐量
+    """
+    start = time.perf_counter()
+    errors: List[LineError] = []
+    valid = lines = 0
+    for line_no, starts, _, records in _iter_blocks(path, True, errors, legacy, CHUNK_SIZE):
+        valid += len(records)
+        lines = line_no + len(starts)
+    elapsed = time.perf_counter() - start
+    size = os.path.getsize(path)
+    return {
+        "lines": lines,
+        "valid": valid,
+        "errors": errors,
+        "bytes": size,
+        "seconds": elapsed,
+        "mb_per_second": size / 2 ** 20 / elapsed if elapsed else 0.0,
+    }
+
+
+class LineIndex:
+
+    def __init__(self, path: str):
+        """
+        JSON Lines 文件的行偏移索引
+
+        文件以只读方式内存映射，换行符位置用 numpy 分块查找，得到每行起始偏移的 int64 数组，
+        之后可以按行号随机读取任意一行，无需把文件读入内存。
+        """
+        self.path = path
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        newlines = _newlines(self._mm)
+        starts = np.concatenate(([0], newlines + 1)).astype(np.int64)
+        if len(starts) and starts[-1] >= size:
+            starts = starts[:-1]
+        self.offsets = starts
+        self.size = size
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def line(self, i: int) -> bytes:
+        """第 i 行的原始字节（不含换行符）"""
+        start = int(self.offsets[i])
+        end = int(self.offsets[i + 1]) if i + 1 < len(self.offsets) else self.size
+        return bytes(self._mm[start:end]).rstrip(b"\r\n")
+
+    def __getitem__(self, i: int) -> Any:
+        return loads_line(self.line(i))
+
+    def close(self):
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="校验 JSON Lines 问答对数据集")
+    parser.add_argument("path", type=str, nargs="?", default="medical_qa.json", help="JSON Lines 文件")
+    parser.add_argument("--legacy", action="store_true", help="兼容旧版 QA.txt 的 Python 字面量写法")
+    parser.add_argument("--show", type=int, default=20, help="最多展示的坏行数")
+    args = parser.parse_args()
+
+    report = validate_jsonl(args.path, args.legacy)
+    print(f"{args.path}: {report['lines']} 行，有效 {report['valid']}，坏行 {len(report['errors'])}，"
+          f"用时 {report['seconds']:.3f}s（{report['mb_per_second']:.0f} MiB/s，解析器: {'orjson' if orjson else 'json'}）")
+    for error in report["errors"][:args.show]:
+        print(f"  第{error.line_no + 1}行（字节偏移 {error.offset}）: {error.error}\n    {error.text}")
+
+    start = time.perf_counter()
+    with LineIndex(args.path) as index:
+        build = time.perf_counter() - start
+        if len(index):
+            print(f"行偏移索引: {len(index)} 行，建立用时 {build * 1000:.1f} ms；最后一行: {index.line(len(index) - 1)[:80].decode('utf-8', errors='replace')}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+import re
+import sys
+import json
+import pickle
+import zlib
+import argparse
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from dataset_io import iter_jsonl
+
+
+_PRIME = np.uint64(4294967291)
+_NON_WORD = re.compile(r"[\s\W_]+", re.UNICODE)
+_FORBIDDEN = ("本指南", "本文")
+
+
+def normalize_text(text: str) -> str:
+    """统一全半角与大小写，去除空白和标点"""
+    return _NON_WORD.sub("", unicodedata.normalize("NFKC", text).lower())
+
+
+class MinHasher:
+    def __init__(self, num_perm: int = 128, ngram: int = 3, seed: int = 42):
+        """
+        基于字符 n-gram 的 MinHash 签名
+
+        Args:
+            num_perm: 哈希函数个数（签名长度）
+            ngram: 字符 n-gram 长度，中文文本取 2~3 较合适
+            seed: 随机种子，保证签名在不同运行之间可比较
+        """
+        self.num_perm = num_perm
+        self.ngram = ngram
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, 1 << 31, size=(num_perm, 1)).astype(np.uint64)
+        self.b = rng.randint(0, 1 << 31, size=(num_perm, 1)).astype(np.uint64)
+
+    def shingles(self, text: str) -> np.ndarray:
+        text = normalize_text(text)
+        n = self.ngram
+        if len(text) <= n:
+            grams = {text} if text else set()
+        else:
+            grams = {text[i:i + n] for i in range(len(text) - n + 1)}
+        return np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = self.shingles(text)
+        if hashes.size == 0:
+            return np.full(self.num_perm, _PRIME, dtype=np.uint64)
+        return ((self.a * hashes[None, :] + self.b) % _PRIME).min(axis=1)
+
+
+def qa_quality(pair: Dict) -> float:
+    """代表项打分：答案信息量越大越好，出现“本指南/本文”等禁用指代时大幅降分"""
+    question = pair.get("human", "") or ""
+    answer = pair.get("assistant", "") or ""
+    score = len(answer) + 0.2 * len(question)
+    if any(word in question or word in answer for word in _FORBIDDEN):
+        score -= 1000
+    return score
+
+
+class QADeduplicator:
+
+    def __init__(self, threshold: float = 0.7, num_perm: int = 128, bands: int = 16, ngram: int = 3):
+        """
+        QA对近似去重（MinHash + LSH）
+
+        对问题与答案拼接后的字符 n-gram 计算 MinHash 签名，按 LSH 分桶查找候选，
+        再用签名估计的 Jaccard 相似度确认。每个簇只与代表项比较，整体时间与数据量近似线性，
+        索引可以保存到磁盘并在新页面产生QA对时增量追加。
+
+        Args:
+            threshold: 判为重复的 Jaccard 相似度阈值
+            num_perm: MinHash 签名长度
+            bands: LSH 分段数，num_perm 必须能被 bands 整除
+            ngram: 字符 n-gram 长度
+        """
+        if num_perm % bands:
+            raise ValueError("num_perm 必须能被 bands 整除")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.hasher = MinHasher(num_perm, ngram)
+        self.buckets: Dict[Tuple[int, bytes], List[int]] = {}
+        self.clusters: List[Dict] = []
+
+    @staticmethod
+    def pair_text(pair: Dict) -> str:
+        return f"{pair.get('human', '')}\n{pair.get('assistant', '')}"
+
+    def _band_keys(self, signature: np.ndarray):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def _index(self, cluster_id: int, signature: np.ndarray):
+        for key in self._band_keys(signature):
+            ids = self.buckets.setdefault(key, [])
+            if cluster_id not in ids:
+                ids.append(cluster_id)
+
+    def find(self, signature: np.ndarray) -> Optional[int]:
+        """返回与签名最相似且超过阈值的簇编号"""
+        best_id, best_sim = None, self.threshold
+        seen = set()
+        for key in self._band_keys(signature):
+            for cluster_id in self.buckets.get(key, ()):
+                if cluster_id in seen:
+                    continue
+                seen.add(cluster_id)
+                sim = float(np.mean(self.clusters[cluster_id]["signature"] == signature))
+                if sim >= best_sim:
+                    best_id, best_sim = cluster_id, sim
+        return best_id
+
+    def add(self, pair: Dict) -> Tuple[int, bool]:
+        """
+        加入一个QA对
+
+        Returns:
+            Tuple[int, bool]: 所属簇编号，以及是否新建了簇
+        """
+        signature = self.hasher.signature(self.pair_text(pair))
+        cluster_id = self.find(signature)
+        score = qa_quality(pair)
+
+        if cluster_id is None:
+            cluster_id = len(self.clusters)
+            self.clusters.append({"pair": pair, "signature": signature, "score": score, "size": 1})
+            self._index(cluster_id, signature)
+            return cluster_id, True
+
+        cluster = self.clusters[cluster_id]
+        cluster["size"] += 1
+        if score > cluster["score"]:
+            cluster.update(pair=pair, signature=signature, score=score)
+            self._index(cluster_id, signature)
+        return cluster_id, False
+
+    def add_many(self, pairs: Iterable[Dict]) -> int:
+        """批量加入，返回新建簇的数量"""
+        return sum(1 for pair in pairs if self.add(pair)[1])
+
+    def representatives(self) -> List[Dict]:
+        """按簇创建顺序返回每个簇的代表QA对"""
+        return [cluster["pair"] for cluster in self.clusters]
+
+    def stats(self) -> Dict:
+        total = sum(cluster["size"] for cluster in self.clusters)
+        return {
+            "pairs": total,
+            "clusters": len(self.clusters),
+            "duplicates": total - len(self.clusters),
+            "largest_cluster": max((cluster["size"] for cluster in self.clusters), default=0),
+        }
+
+    def save(self, path: str):
+        with open(path, "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path: str) -> "QADeduplicator":
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+
+def dedup_pairs(pairs: List[Dict], threshold: float = 0.7) -> List[Dict]:
+    """对一组QA对去重，返回各簇代表项"""
+    deduplicator = QADeduplicator(threshold=threshold)
+    deduplicator.add_many(pairs)
+    return deduplicator.representatives()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="QA数据集近似去重")
+    parser.add_argument("input", type=str, help="JSONL格式的QA数据集，如 medical_qa.json")
+    parser.add_argument("--output", type=str, default=None, help="去重结果输出路径，默认 <input>.dedup.json")
+    parser.add_argument("--index", type=str, default=None, help="去重索引路径，存在时加载并增量追加")
+    parser.add_argument("--threshold", type=float, default=None, help="判为重复的相似度阈值，默认0.7；加载索引时覆盖索引中保存的阈值")
+    args = parser.parse_args()
+
+    deduplicator = None
+    if args.index:
+        try:
+            deduplicator = QADeduplicator.load(args.index)
+            print(f"已加载索引: {deduplicator.stats()['clusters']} 个簇, 阈值 {deduplicator.threshold}")
+            if args.threshold is not None and args.threshold != deduplicator.threshold:
+                print(f"阈值改为 {args.threshold}")
+                deduplicator.threshold = args.threshold
+        except FileNotFoundError:
+            pass
+    if deduplicator is None:
+        deduplicator = QADeduplicator(threshold=0.7 if args.threshold is None else args.threshold)
+
+    errors = []
+    new_clusters = deduplicator.add_many(record for _, _, record in iter_jsonl(args.input, errors=errors))
+    if errors:
+        print(f"跳过 {len(errors)} 个无效行（首个在第 {errors[0].line_no + 1} 行: {errors[0].error}）", file=sys.stderr)
+
+    output = args.output or f"{args.input}.dedup.json"
+    with open(output, "w", encoding="utf-8") as f:
+        for pair in deduplicator.representatives():
+            f.write(json.dumps(pair, ensure_ascii=False) + "\n")
+
+    if args.index:
+        deduplicator.save(args.index)
+
+    stats = deduplicator.stats()
+    print(f"新增簇 {new_clusters} 个；共 {stats['pairs']} 个QA对, {stats['clusters']} 个簇, "
+          f"重复 {stats['duplicates']} 个, 最大簇 {stats['largest_cluster']} 个")
+    print(f"结果保存在: {output}")
+
+
+if __name__ == "__main__":
+    main()
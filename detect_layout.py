@@ -1,4 +1,3 @@
-import supervision as sv
 import cv2
 from ultralytics import YOLO
 import numpy as np
@@ -20,33 +19,54 @@ class YOLODetector:
         Detect text bounding boxes in the input image
         
         Args:
-            image: Input image as numpy array
+            image: Input image as numpy array (BGR) or PIL image
             
         Returns:
             list: List of text bounding boxes in [x1, y1, x2, y2] format
         """
+        return self.detect_text_boxes_batch([image])[0]
+    
+    def detect_text_boxes_batch(self, images: list, batch_size: int = 8) -> list:
+        """
+        Detect text bounding boxes for several images in batched forward passes
         
-        results = self.model(image)
-        results = results[0]
+        Args:
+            images: List of input images as numpy arrays (BGR) or PIL images
+            batch_size: Number of images per forward pass
+            
+        Returns:
+            list: One list of text bounding boxes in [x1, y1, x2, y2] format per image
+        """
         
-
-        boxes = results.boxes.xyxy
+        results = []
+        for start in range(0, len(images), batch_size):
+            results.extend(self.model(images[start:start + batch_size]))
+        if not results:
+            return []
         
 
-        detections = sv.Detections.from_ultralytics(results)
-        
-        class_names = detections.data['class_name'].tolist()
-        text_indices = np.where(np.array(class_names) == 'Text')[0]
+        text_boxes = []
+        for result in results:
+            text_cls = next((cls_id for cls_id, name in result.names.items() if name == 'Text'), None)
+            boxes = result.boxes
+            if text_cls is None:
+                text_boxes.append(boxes.xyxy[:0])
+                continue
+            mask = boxes.cls == text_cls
+            text_boxes.append(boxes.xyxy[mask])
         
 
-        text_boxes = []
-        for idx in text_indices:
-            text_boxes.append(boxes[idx])
+        counts = [len(b) for b in text_boxes]
+        all_boxes = torch.cat(text_boxes).round().int().cpu().tolist()
         
 
-        boxes_list = [box.round().int().cpu().tolist() for box in text_boxes]
+        boxes_lists = []
+        offset = 0
+        for count in counts:
+            boxes_lists.append(all_boxes[offset:offset + count][1:])
+            offset += count
         
-        return boxes_list[1:]
+        return boxes_lists
 
 
 if __name__ == "__main__":
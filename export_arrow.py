@@ -0,0 +1,285 @@
+import os
+import time
+import argparse
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from dataset_io import iter_jsonl
+from grounding import GroundingIndex
+
+
+STAGES = ("detect", "ocr", "clean", "qa")
+
+SCHEMA = pa.schema([
+    ("document", pa.string()),
+    ("source_path", pa.string()),
+    ("page_num", pa.int32()),
+    ("page_end", pa.int32()),
+    ("pair_index", pa.int32()),
+    ("human", pa.string()),
+    ("assistant", pa.string()),
+    ("route", pa.string()),
+    *[(f"{stage}_seconds", pa.float32()) for stage in STAGES],
+    ("grounding_score", pa.float32()),
+])
+
+
+class ParquetQAWriter:
+
+    def __init__(self, path: str, row_group_size: int = 8192, compression: str = "zstd", grounding: bool = True):
+        """
+        QA对及其来源信息的 Parquet 写出器
+
+        每页（或每个文本块）完成后追加其QA对与来源列：文档、源文件、页码、页内序号、文本来源（文本层/OCR）、
+        各阶段耗时与答案溯源得分。行先在内存中缓冲，达到 row_group_size 行或一个文档结束时写出一个行组，
+        行组不跨文档，按文档、页码过滤时可以只凭行组统计信息跳过无关行组。
+        写入同目录的临时文件，close 时替换目标文件。
+
+        Args:
+            path: 输出文件路径
+            row_group_size: 每个行组的最大行数
+            compression: 压缩算法
+            grounding: 给出页面原文时是否计算答案溯源得分
+        """
+        self.path = path
+        self.row_group_size = max(1, row_group_size)
+        self.grounding = grounding
+        self.rows = 0
+        self.row_groups = 0
+        self._columns: Dict[str, list] = {name: [] for name in SCHEMA.names}
+        self._document = None
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._tmp_path = os.path.join(directory, f".tmp_{os.getpid()}_{os.path.basename(path)}")
+        self._writer = pq.ParquetWriter(self._tmp_path, SCHEMA, compression=compression)
+
+    def add_page(self, qa_pairs: Sequence[Dict], document: str, page_num: Optional[int] = None,
+                 page_end: Optional[int] = None, source_path: Optional[str] = None, route: Optional[str] = None,
+                 timings: Optional[Dict[str, float]] = None, source_text: Optional[str] = None,
+                 pair_indices: Optional[Sequence[int]] = None):
+        """
+        追加一页的QA对
+
+        Args:
+            qa_pairs: 该页的QA对
+            document: 文档名
+            page_num: 页码（从0开始），文本块为其首页
+            page_end: 文本块的末页，默认与 page_num 相同
+            source_path: 源文件路径
+            route: 页面文本来源，'text'（PDF文本层）或 'vision'（版面检测+OCR）
+            timings: 各阶段耗时（秒），键为 STAGES 中的阶段名
+            source_text: 生成QA对所用的原文，用于计算答案溯源得分
+            pair_indices: 各QA对在该页QA对中的位置，只写入其中一部分（如去重后的代表项）时传入，默认依次编号
+        """
+        if document != self._document:
+            self.flush()
+            self._document = document
+        if not qa_pairs:
+            return
+
+        scores = [None] * len(qa_pairs)
+        if self.grounding and source_text:
+            index = GroundingIndex()
+            index.add_page(source_text)
+            scores = [index.score(str(qa.get("assistant", "")))["score"] for qa in qa_pairs]
+
+        timings = timings or {}
+        n = len(qa_pairs)
+        columns = self._columns
+        columns["document"].extend([document] * n)
+        columns["source_path"].extend([source_path] * n)
+        columns["page_num"].extend([page_num] * n)
+        columns["page_end"].extend([page_num if page_end is None else page_end] * n)
+        columns["pair_index"].extend(range(n) if pair_indices is None else pair_indices)
+        columns["human"].extend(str(qa.get("human", "")) for qa in qa_pairs)
+        columns["assistant"].extend(str(qa.get("assistant", "")) for qa in qa_pairs)
+        columns["route"].extend([route] * n)
+        for stage in STAGES:
+            columns[f"{stage}_seconds"].extend([timings.get(stage)] * n)
+        columns["grounding_score"].extend(scores)
+        self.rows += n
+
+        if len(columns["human"]) >= self.row_group_size:
+            self.flush()
+
+    def add_table(self, table: pa.Table):
+        """追加已按 SCHEMA 组织好的行（格式转换使用）"""
+        self.flush()
+        self._writer.write_table(table.cast(SCHEMA), row_group_size=self.row_group_size)
+        self.rows += table.num_rows
+        self.row_groups += -(-table.num_rows // self.row_group_size)
+
+    def flush(self):
+        """把缓冲的行写成一个行组"""
+        if not self._columns["human"]:
+            return
+        table = pa.table({name: pa.array(values, type=SCHEMA.field(name).type)
+                          for name, values in self._columns.items()}, schema=SCHEMA)
+        self._writer.write_table(table, row_group_size=table.num_rows)
+        self.row_groups += 1
+        self._columns = {name: [] for name in SCHEMA.names}
+
+    def close(self):
+        if self._writer is None:
+            return
+        self.flush()
+        self._writer.close()
+        self._writer = None
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        if self._writer is None:
+            return
+        self._writer.close()
+        self._writer = None
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def build_filters(documents: Optional[Iterable[str]] = None,
+                  pages: Optional[Tuple[int, int]] = None,
+                  min_grounding: Optional[float] = None,
+                  route: Optional[str] = None) -> Optional[List[Tuple]]:
+    """
+    构造 pyarrow 过滤条件
+
+    Args:
+        documents: 文档名
+        pages: 页码闭区间 (起, 止)，从0开始
+        min_grounding: 答案溯源得分下限
+        route: 页面文本来源
+    """
+    filters = []
+    if documents is not None:
+        filters.append(("document", "in", list(documents)))
+    if pages is not None:
+        filters.append(("page_num", ">=", pages[0]))
+        filters.append(("page_num", "<=", pages[1]))
+    if min_grounding is not None:
+        filters.append(("grounding_score", ">=", min_grounding))
+    if route is not None:
+        filters.append(("route", "=", route))
+    return filters or None
+
+
+def scan(path: str, columns: Optional[List[str]] = None, **filter_kwargs) -> pa.Table:
+    """
+    按列读取 QA 数据集（单个文件或目录），过滤条件下推到行组统计信息，见 build_filters
+
+    Returns:
+        pa.Table: 满足条件的行
+    """
+    return pq.read_table(path, columns=columns, filters=build_filters(**filter_kwargs))
+
+
+def sample(table: pa.Table, n: Optional[int] = None, fraction: Optional[float] = None, seed: int = 0) -> pa.Table:
+    """从表中无放回随机抽取 n 行或 fraction 比例的行，保持原有顺序"""
+    total = table.num_rows
+    if n is None:
+        n = int(round(total * (fraction if fraction is not None else 1.0)))
+    n = min(n, total)
+    indices = np.sort(np.random.default_rng(seed).choice(total, size=n, replace=False))
+    return table.take(pa.array(indices))
+
+
+def convert_jsonl(src: str, dst: str, document: Optional[str] = None, row_group_size: int = 65536) -> Dict[str, Any]:
+    """
+    把 JSON Lines 格式的问答对数据集（如 medical_qa.json）转换为 Parquet
+
+    原数据没有来源信息，document 默认取文件名，页码、阶段耗时等列为空。坏行跳过并计入统计。
+
+    Returns:
+        Dict[str, Any]: 行数、坏行、行组数与耗时
+    """
+    start = time.perf_counter()
+    document = document or os.path.splitext(os.path.basename(src))[0]
+    errors = []
+    humans, answers = [], []
+
+    def table() -> pa.Table:
+        n = len(humans)
+        nulls = pa.nulls(n)
+        data = {name: nulls for name in SCHEMA.names}
+        data.update(document=pa.array([document] * n), source_path=pa.array([os.path.abspath(src)] * n),
+                    pair_index=pa.array(np.arange(n, dtype=np.int32)), human=pa.array(humans, pa.string()),
+                    assistant=pa.array(answers, pa.string()))
+        return pa.table({name: data[name] for name in SCHEMA.names})
+
+    with ParquetQAWriter(dst, row_group_size=row_group_size, grounding=False) as writer:
+        for _, _, record in iter_jsonl(src, errors=errors):
+            humans.append(record["human"])
+            answers.append(record["assistant"])
+            if len(humans) >= row_group_size:
+                writer.add_table(table())
+                humans, answers = [], []
+        if humans:
+            writer.add_table(table())
+    return {"rows": writer.rows, "errors": errors, "row_groups": writer.row_groups,
+            "seconds": time.perf_counter() - start}
+
+
+def parse_pages(text: Optional[str]) -> Optional[Tuple[int, int]]:
+    """解析命令行页码范围 '3-10' 或 '5'（从1开始），返回从0开始的闭区间"""
+    if not text:
+        return None
+    first, _, last = text.partition("-")
+    return int(first) - 1, int(last or first) - 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="QA数据集的 Parquet 导出与按列查询")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    convert = sub.add_parser("convert", help="把 JSON Lines 数据集转换为 Parquet")
+    convert.add_argument("src", type=str, nargs="?", default="medical_qa.json", help="JSON Lines 文件")
+    convert.add_argument("dst", type=str, nargs="?", default="medical_qa.parquet", help="输出 Parquet 文件")
+    convert.add_argument("--document", type=str, default=None, help="文档名，默认取文件名")
+    convert.add_argument("--row_group_size", type=int, default=65536, help="每个行组的行数")
+
+    query = sub.add_parser("scan", help="按文档、页码、文本来源过滤并抽样")
+    query.add_argument("path", type=str, help="Parquet 文件或目录")
+    query.add_argument("--document", type=str, action="append", default=None, help="文档名，可重复")
+    query.add_argument("--pages", type=str, default=None, help="页码范围（从1开始），如 3-10")
+    query.add_argument("--min_grounding", type=float, default=None, help="答案溯源得分下限")
+    query.add_argument("--route", type=str, default=None, choices=["text", "vision"],
+                       help="页面文本来源：text（PDF文本层）或 vision（版面检测+OCR）")
+    query.add_argument("--sample", type=float, default=None, help="抽样：不小于1为行数，小于1为比例")
+    query.add_argument("--seed", type=int, default=0, help="抽样随机种子")
+    query.add_argument("--output", type=str, default=None, help="把结果写为 Parquet 文件")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        stats = convert_jsonl(args.src, args.dst, args.document, args.row_group_size)
+        print(f"{args.src} -> {args.dst}: {stats['rows']} 行, {stats['row_groups']} 个行组, 坏行 {len(stats['errors'])}, "
+              f"用时 {stats['seconds']:.2f}s（{os.path.getsize(args.src) / 2 ** 20:.1f} MiB -> "
+              f"{os.path.getsize(args.dst) / 2 ** 20:.1f} MiB）")
+        return
+
+    start = time.perf_counter()
+    table = scan(args.path, documents=args.document, pages=parse_pages(args.pages),
+                 min_grounding=args.min_grounding, route=args.route)
+    if args.sample is not None:
+        table = sample(table, n=int(args.sample) if args.sample >= 1 else None,
+                       fraction=args.sample if args.sample < 1 else None, seed=args.seed)
+    elapsed = time.perf_counter() - start
+    print(f"{table.num_rows} 行，用时 {elapsed:.3f}s")
+    if args.output:
+        pq.write_table(table, args.output, compression="zstd")
+    else:
+        for row in table.slice(0, 5).to_pylist():
+            print(f"  [{row['document']} p{'' if row['page_num'] is None else row['page_num'] + 1}] "
+                  f"Q: {row['human'][:60]}  A: {row['assistant'][:60]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+import os
+import re
+import time
+import argparse
+from collections import Counter, OrderedDict
+from itertools import islice
+from typing import Dict, Hashable, List, Optional
+from dedup import normalize_text
+from dataset_io import read_jsonl
+
+
+_CJK = re.compile(r"[\u3400-\u9fff\uf900-\ufaff]")
+_LATIN = re.compile(r"[A-Za-z]")
+
+
+def dominant_script(text: str) -> Optional[str]:
+    """
+    文本中占多数的文字：'cjk' 或 'latin'，没有这两类字符时返回 None
+
+    字符 n-gram 与最长公共子串在两种文字之间几乎没有重叠，译文答案与原文的溯源得分接近0，
+    只有二者文字相同时得分才能用来判断答案是否有依据。
+    """
+    cjk = len(_CJK.findall(text))
+    latin = len(_LATIN.findall(text))
+    if not cjk and not latin:
+        return None
+    return 'cjk' if cjk >= latin else 'latin'
+
+class SuffixAutomaton:
+    """
+    后缀自动机
+
+    构建时间与文本长度线性相关，之后可在 O(len(query)) 时间内求出
+    查询串与原文的最长公共子串长度。
+    """
+
+    def __init__(self, text: str):
+        nxt = [{}]
+        link = [-1]
+        length = [0]
+        last = 0
+        for ch in text:
+            cur = len(length)
+            length.append(length[last] + 1)
+            link.append(-1)
+            nxt.append({})
+            p = last
+            while p != -1 and ch not in nxt[p]:
+                nxt[p][ch] = cur
+                p = link[p]
+            if p == -1:
+                link[cur] = 0
+            else:
+                q = nxt[p][ch]
+                if length[p] + 1 == length[q]:
+                    link[cur] = q
+                else:
+                    clone = len(length)
+                    length.append(length[p] + 1)
+                    link.append(link[q])
+                    nxt.append(dict(nxt[q]))
+                    while p != -1 and nxt[p].get(ch) == q:
+                        nxt[p][ch] = clone
+                        p = link[p]
+                    link[q] = clone
+                    link[cur] = clone
+            last = cur
+        self.nxt = nxt
+        self.link = link
+        self.length = length
+
+    def longest_common_substring(self, query: str) -> int:
+        nxt, link, length = self.nxt, self.link, self.length
+        state, matched, best = 0, 0, 0
+        for ch in query:
+            while state and ch not in nxt[state]:
+                state = link[state]
+                matched = length[state]
+            if ch in nxt[state]:
+                state = nxt[state][ch]
+                matched += 1
+                if matched > best:
+                    best = matched
+            else:
+                state, matched = 0, 0
+        return best
+
+
+class GroundingIndex:
+
+    def __init__(self, ngram: int = 3, candidate_pages: int = 3, automaton_cache: int = 64,
+                 max_gram_pages: int = 32):
+        """
+        答案溯源索引
+
+        对原文建立字符 n-gram 倒排索引（n-gram -> 所在页面），答案的 n-gram 覆盖率在整篇文档上计算；
+        再按命中数选出最相关的若干页，用各页的后缀自动机求最长公共子串。
+        出现在超过 max_gram_pages 页的高频 n-gram 只计入覆盖率，不参与候选页面计数（区分度低），
+        因此每个答案的评分与其长度线性相关，与文档页数无关。
+
+        Args:
+            ngram: 字符 n-gram 长度
+            candidate_pages: 计算最长公共子串时考察的候选页面数
+            automaton_cache: 内存中保留的页面后缀自动机数量
+            max_gram_pages: 参与候选页面计数的 n-gram 最多出现的页数
+        """
+        self.ngram = ngram
+        self.candidate_pages = candidate_pages
+        self.max_gram_pages = max_gram_pages
+        self.automaton_cache = automaton_cache
+        self.pages: Dict[Hashable, str] = {}
+        self.postings: Dict[str, set] = {}
+        self._automata: "OrderedDict[Hashable, SuffixAutomaton]" = OrderedDict()
+
+    def _grams(self, text: str) -> List[str]:
+        n = self.ngram
+        if len(text) < n:
+            return [text] if text else []
+        return [text[i:i + n] for i in range(len(text) - n + 1)]
+
+    def add_page(self, text: str, page_id: Optional[Hashable] = None) -> Hashable:
+        """加入一页原文，返回页面编号"""
+        if page_id is None:
+            page_id = len(self.pages)
+        if page_id in self.pages:
+            self.remove_page(page_id)
+        normalized = normalize_text(text)
+        self.pages[page_id] = normalized
+        for gram in set(self._grams(normalized)):
+            self.postings.setdefault(gram, set()).add(page_id)
+        return page_id
+
+    def remove_page(self, page_id: Hashable):
+        """删除一页原文及其倒排记录"""
+        text = self.pages.pop(page_id)
+        self._automata.pop(page_id, None)
+        for gram in set(self._grams(text)):
+            pages = self.postings.get(gram)
+            if pages is not None:
+                pages.discard(page_id)
+                if not pages:
+                    del self.postings[gram]
+
+    def _automaton(self, page_id: Hashable) -> SuffixAutomaton:
+        automaton = self._automata.get(page_id)
+        if automaton is None:
+            automaton = SuffixAutomaton(self.pages[page_id])
+            self._automata[page_id] = automaton
+            if len(self._automata) > self.automaton_cache:
+                self._automata.popitem(last=False)
+        else:
+            self._automata.move_to_end(page_id)
+        return automaton
+
+    def score(self, answer: str) -> Dict:
+        """
+        计算单个答案的溯源得分
+
+        Returns:
+            Dict: score（综合得分，0~1）、lcs（最长公共子串长度）、lcs_ratio、coverage（n-gram覆盖率）、page（最匹配页面）
+        """
+        normalized = normalize_text(answer)
+        grams = self._grams(normalized)
+        if not grams:
+            return {'score': 0.0, 'lcs': 0, 'lcs_ratio': 0.0, 'coverage': 0.0, 'page': None}
+
+        hits = Counter()
+        covered = 0
+        rarest = None
+        for gram in grams:
+            pages = self.postings.get(gram)
+            if pages:
+                covered += 1
+                if len(pages) <= self.max_gram_pages:
+                    hits.update(pages)
+                elif rarest is None or len(pages) < len(rarest):
+                    rarest = pages
+        coverage = covered / len(grams)
+
+        candidates = [page_id for page_id, _ in hits.most_common(self.candidate_pages)]
+        if not candidates and rarest is not None:
+            # 答案只由高频 n-gram 组成时，从其中最少见的一个所在的页面里取候选
+            candidates = list(islice(rarest, self.candidate_pages))
+
+        lcs, best_page = 0, None
+        for page_id in candidates:
+            length = self._automaton(page_id).longest_common_substring(normalized)
+            if length > lcs:
+                lcs, best_page = length, page_id
+        lcs_ratio = lcs / len(normalized)
+
+        return {
+            'score': 0.5 * lcs_ratio + 0.5 * coverage,
+            'lcs': lcs,
+            'lcs_ratio': lcs_ratio,
+            'coverage': coverage,
+            'page': best_page,
+        }
+
+    def score_pairs(self, qa_pairs: List[Dict], threshold: float = 0.5) -> List[Dict]:
+        """
+        为每个QA对的答案评分
+
+        Returns:
+            List[Dict]: 每个QA对一条结果，包含 index、valid（字段是否完整）、grounded（是否达到阈值）及各项得分
+        """
+        results = []
+        for i, qa in enumerate(qa_pairs):
+            if not isinstance(qa, dict) or not qa.get('human') or not qa.get('assistant'):
+                results.append({'index': i, 'valid': False, 'grounded': False, 'score': 0.0,
+                                'lcs': 0, 'lcs_ratio': 0.0, 'coverage': 0.0, 'page': None})
+                continue
+            result = self.score(str(qa['assistant']))
+            result.update(index=i, valid=True, grounded=result['score'] >= threshold)
+            results.append(result)
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="QA对答案溯源评分")
+    parser.add_argument("--output_dir", type=str, default="output", help="包含 page_{n}.txt 与 QA.txt 的输出目录")
+    parser.add_argument("--threshold", type=float, default=0.5, help="判定答案有依据的得分阈值")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index = GroundingIndex()
+    pattern = re.compile(r"^page_(\d+)\.txt$")
+    for name in os.listdir(args.output_dir):
+        m = pattern.match(name)
+        if m:
+            with open(os.path.join(args.output_dir, name), "r", encoding="utf-8") as f:
+                index.add_page(f.read(), int(m.group(1)))
+    build_time = time.perf_counter() - start
+
+    qa_pairs, errors = read_jsonl(os.path.join(args.output_dir, "QA.txt"), legacy=True)
+    for error in errors:
+        print(f"跳过 QA.txt 第{error.line_no + 1}行: {error.error}")
+
+    start = time.perf_counter()
+    results = index.score_pairs(qa_pairs, args.threshold)
+    score_time = time.perf_counter() - start
+
+    grounded = sum(r['grounded'] for r in results)
+    source = '\n'.join(index.pages.values())
+    exact = sum(normalize_text(str(qa.get('assistant', ''))) in source for qa in qa_pairs)
+    print(f"索引 {len(index.pages)} 页用时 {build_time:.3f}s；评分 {len(results)} 个QA对用时 {score_time:.3f}s")
+    print(f"达到阈值 {args.threshold}: {grounded}/{len(results)}；精确子串匹配仅 {exact}/{len(results)}")
+
+
+if __name__ == "__main__":
+    main()
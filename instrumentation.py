@@ -0,0 +1,375 @@
+import time
+import bisect
+import threading
+import contextvars
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from checkpoint import atomic_write_json
+
+
+# 阶段耗时直方图的桶上界（秒），与 Prometheus 默认桶相近，向上延伸到模型调用的量级
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+_active: contextvars.ContextVar = contextvars.ContextVar("instrumentation_spans", default=())
+
+
+class Histogram:
+    """固定桶直方图，记录次数、总和、最值与各桶计数"""
+
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """按桶内线性插值估计分位数"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                lower, upper = max(lower, self.min), min(upper, self.max)
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return self.max
+
+    def snapshot(self) -> Dict:
+        return {"counts": list(self.counts), "count": self.count, "sum": self.sum, "min": self.min, "max": self.max}
+
+    def merge(self, snapshot: Dict):
+        if not snapshot["count"]:
+            return
+        self.counts = [a + b for a, b in zip(self.counts, snapshot["counts"])]
+        self.count += snapshot["count"]
+        self.sum += snapshot["sum"]
+        self.min = snapshot["min"] if self.min is None else min(self.min, snapshot["min"])
+        self.max = snapshot["max"] if self.max is None else max(self.max, snapshot["max"])
+
+
+class Span:
+    """一次阶段执行：退出时把墙钟时间、线程CPU时间与累加的计数汇总到所属的 Instrumentation"""
+
+    __slots__ = ("owner", "name", "counters", "_start", "_cpu_start", "_token")
+
+    def __init__(self, owner: "Instrumentation", name: str, counters: Dict[str, float]):
+        self.owner = owner
+        self.name = name
+        self.counters = counters
+
+    def __enter__(self) -> "Span":
+        self._token = _active.set(_active.get() + (self,))
+        self._cpu_start = time.thread_time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self._start
+        cpu = time.thread_time() - self._cpu_start
+        _active.reset(self._token)
+        if exc_type is not None:
+            self.counters["errors"] = self.counters.get("errors", 0) + 1
+        self.owner._finish(self.name, wall, cpu, self.counters)
+
+    def add(self, **counters: float):
+        for key, value in counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+
+
+class _NoopSpan:
+    """关闭时返回的空 span，所有操作都不做任何事"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return None
+
+    def add(self, **counters: float):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class Instrumentation:
+
+    def __init__(self, enabled: bool = False):
+        """
+        按阶段汇总的轻量计时与计数
+
+        每个 span 记录一次阶段执行的墙钟时间、线程CPU时间，以及执行期间通过 add 累加的计数
+        （字节数、文本区域数、模型的 prompt/eval token 数与 eval 耗时等）。span 退出时汇总到
+        以阶段名为键的直方图与计数器，不保存单次记录，内存占用与运行时长无关。
+        add 会累加到当前上下文中所有活动的 span 上（按 contextvars 区分线程与协程），
+        模型调用的 token 数因此同时计入模型调用自身与所在的流水线阶段。
+
+        关闭时 span() 返回共享的空对象，add() 直接返回，开销只有一次属性判断。
+
+        Args:
+            enabled: 是否记录
+        """
+        self.enabled = enabled
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._wall: Dict[str, Histogram] = {}
+        self._cpu: Dict[str, float] = {}
+        self._counters: Dict[str, Dict[str, float]] = {}
+        self._server = None
+
+    def span(self, name: str, **counters: float):
+        if not self.enabled:
+            return _NOOP
+        return Span(self, name, counters)
+
+    def add(self, **counters: float):
+        """累加到当前所有活动的 span"""
+        if not self.enabled:
+            return
+        for span in _active.get():
+            span.add(**counters)
+
+    def _finish(self, name: str, wall: float, cpu: float, counters: Dict[str, float]):
+        with self._lock:
+            histogram = self._wall.get(name)
+            if histogram is None:
+                histogram = self._wall[name] = Histogram()
+                self._cpu[name] = 0.0
+                self._counters[name] = {}
+            histogram.observe(wall)
+            self._cpu[name] += cpu
+            totals = self._counters[name]
+            for key, value in counters.items():
+                totals[key] = totals.get(key, 0) + value
+
+    def snapshot(self, reset: bool = False) -> Dict:
+        """可序列化的原始汇总数据，用于跨进程合并"""
+        with self._lock:
+            data = {name: {"wall": h.snapshot(), "cpu": self._cpu[name], "counters": dict(self._counters[name])}
+                    for name, h in self._wall.items()}
+            if reset:
+                self._wall, self._cpu, self._counters = {}, {}, {}
+        return data
+
+    def drain(self) -> Dict:
+        """取出并清空汇总数据（worker 进程把本进程的记录交给主进程合并）"""
+        return self.snapshot(reset=True) if self.enabled else {}
+
+    def merge(self, snapshot: Optional[Dict]):
+        """合并其他进程的 snapshot"""
+        if not snapshot:
+            return
+        with self._lock:
+            for name, data in snapshot.items():
+                if name not in self._wall:
+                    self._wall[name] = Histogram()
+                    self._cpu[name] = 0.0
+                    self._counters[name] = {}
+                self._wall[name].merge(data["wall"])
+                self._cpu[name] += data["cpu"]
+                totals = self._counters[name]
+                for key, value in data["counters"].items():
+                    totals[key] = totals.get(key, 0) + value
+
+    def report(self) -> Dict:
+        """
+        本次运行的汇总报告
+
+        Returns:
+            Dict: 每个阶段的次数、墙钟时间（总和、均值、p50、p95、最大值）、CPU 时间、各计数的总和，
+            以及有 token 计数时的生成速度（eval token/秒）
+        """
+        stages = {}
+        for name, data in sorted(self.snapshot().items()):
+            histogram = Histogram()
+            histogram.merge(data["wall"])
+            counters = data["counters"]
+            stage = {
+                "count": histogram.count,
+                "wall_seconds": {
+                    "sum": histogram.sum,
+                    "mean": histogram.sum / histogram.count if histogram.count else 0.0,
+                    "p50": histogram.quantile(0.5),
+                    "p95": histogram.quantile(0.95),
+                    "max": histogram.max,
+                },
+                "cpu_seconds": data["cpu"],
+                "counters": counters,
+            }
+            if counters.get("eval_seconds"):
+                stage["eval_tokens_per_second"] = counters.get("eval_tokens", 0) / counters["eval_seconds"]
+            stages[name] = stage
+        total = sum(s["wall_seconds"]["sum"] for name, s in stages.items() if "." not in name)
+        for name, stage in stages.items():
+            if "." not in name and total:
+                stage["share"] = stage["wall_seconds"]["sum"] / total
+        return {"started_at": self.started_at, "elapsed_seconds": time.time() - self.started_at, "stages": stages}
+
+    def write_report(self, path: str) -> Dict:
+        report = self.report()
+        atomic_write_json(path, report)
+        return report
+
+    def prometheus_text(self, prefix: str = "qa_pipeline") -> str:
+        """Prometheus 文本格式：阶段耗时直方图、CPU 时间与各计数的累计值"""
+        lines = [f"# TYPE {prefix}_stage_seconds histogram"]
+        snapshot = self.snapshot()
+        for name, data in sorted(snapshot.items()):
+            wall = data["wall"]
+            cumulative = 0
+            for bound, n in zip(BUCKETS + (float("inf"),), wall["counts"]):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{name}",le="{le}"}} {cumulative}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {wall["sum"]}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {wall["count"]}')
+        lines.append(f"# TYPE {prefix}_stage_cpu_seconds_total counter")
+        for name, data in sorted(snapshot.items()):
+            lines.append(f'{prefix}_stage_cpu_seconds_total{{stage="{name}"}} {data["cpu"]}')
+        keys = sorted({key for data in snapshot.values() for key in data["counters"]})
+        for key in keys:
+            lines.append(f"# TYPE {prefix}_stage_{key}_total counter")
+            for name, data in sorted(snapshot.items()):
+                if key in data["counters"]:
+                    lines.append(f'{prefix}_stage_{key}_total{{stage="{name}"}} {data["counters"][key]}')
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """
+        在后台线程中提供 Prometheus 文本格式的 /metrics
+
+        指标中带有文档名与各页耗时，默认只监听本机；需要远程抓取时显式传入 host（如 "0.0.0.0"）。
+        """
+        owner = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body = owner.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self._server
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def record_llm_usage(result: Optional[Dict], cached: bool = False):
+    """
+    把 Ollama 响应中的用量字段累加到当前的 span
+
+    prompt_eval_count / eval_count 为 prompt 与生成的 token 数，*_duration 单位为纳秒。
+    缓存命中的响应只计一次缓存命中，不重复计入 token。
+    """
+    if not metrics.enabled:
+        return
+    if cached:
+        metrics.add(llm_calls=1, cache_hits=1)
+        return
+    result = result or {}
+    metrics.add(
+        llm_calls=1,
+        prompt_tokens=result.get("prompt_eval_count", 0) or 0,
+        eval_tokens=result.get("eval_count", 0) or 0,
+        prompt_eval_seconds=(result.get("prompt_eval_duration", 0) or 0) / 1e9,
+        eval_seconds=(result.get("eval_duration", 0) or 0) / 1e9,
+    )
+
+
+def format_summary(report: Dict) -> List[str]:
+    """报告的逐阶段摘要，用于日志"""
+    lines = []
+    for name, stage in report["stages"].items():
+        wall = stage["wall_seconds"]
+        line = (f"{name}: {stage['count']} 次, 共 {wall['sum']:.2f}s, 均值 {wall['mean']:.3f}s, "
+                f"p95 {wall['p95']:.3f}s, CPU {stage['cpu_seconds']:.2f}s")
+        if "share" in stage:
+            line += f", 占比 {stage['share']:.0%}"
+        if "eval_tokens_per_second" in stage:
+            line += f", 生成 {stage['eval_tokens_per_second']:.1f} token/s"
+        lines.append(line)
+    return lines
+
+
+# 进程内共享的实例，默认关闭；PDFQAProcessor 按配置开启
+metrics = Instrumentation()
+
+
+def configure(enabled: bool = True, port: Optional[int] = None, host: str = "127.0.0.1") -> Instrumentation:
+    """开启或关闭进程内共享的实例，给出 port 时同时在 host 上提供 /metrics"""
+    metrics.enabled = enabled
+    if enabled and port and metrics._server is None:
+        metrics.serve(port, host)
+    return metrics
+
+
+def test_instrumentation():
+    import timeit
+
+    disabled = Instrumentation(enabled=False)
+
+    def noop_span():
+        with disabled.span("x"):
+            disabled.add(bytes=1)
+
+    n = 200000
+    per_call = timeit.timeit(noop_span, number=n) / n
+    print(f"关闭时每个 span 的开销: {per_call * 1e9:.0f} ns")
+
+    inst = Instrumentation(enabled=True)
+    for i in range(50):
+        with inst.span("ocr", regions=3) as span:
+            time.sleep(0.001)
+            span.add(bytes=1000)
+        with inst.span("qa"):
+            with inst.span("llm.qa_create"):
+                inst.add(llm_calls=1, prompt_tokens=100, eval_tokens=50, eval_seconds=0.5)
+    worker = Instrumentation(enabled=True)
+    with worker.span("ocr", regions=2):
+        pass
+    inst.merge(worker.drain())
+
+    report = inst.report()
+    assert report["stages"]["ocr"]["count"] == 51
+    assert report["stages"]["ocr"]["counters"]["regions"] == 152
+    assert report["stages"]["qa"]["counters"]["eval_tokens"] == 2500
+    assert report["stages"]["llm.qa_create"]["eval_tokens_per_second"] == 100
+    assert worker.report()["stages"] == {}
+    for line in format_summary(report):
+        print(line)
+    text = inst.prometheus_text()
+    assert 'qa_pipeline_stage_seconds_count{stage="ocr"} 51' in text
+    print(text.splitlines()[0], "...", len(text.splitlines()), "行")
+
+
+if __name__ == "__main__":
+    test_instrumentation()
@@ -0,0 +1,543 @@
+import asyncio
+import json
+import random
+import threading
+import time
+from typing import Dict, Iterator, Optional
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from llm_cache import ResponseCache
+from instrumentation import record_llm_usage
+
+
+class LLMClientError(requests.exceptions.RequestException):
+    """模型服务调用失败（重试耗尽、超过截止时间或不可重试的错误）"""
+
+
+class CircuitOpenError(LLMClientError):
+    """熔断器处于打开状态，请求被直接拒绝"""
+
+
+class CircuitBreaker:
+    """
+    简单的熔断器
+
+    连续失败的调用达到 failure_threshold 次后打开，打开期间所有请求直接失败；
+    经过 reset_timeout 秒后进入半开状态，放行一个探测请求，成功则关闭，失败则重新打开。
+    每次调用只在最终结果确定后记录一次（重试耗尽才算一次失败），不按单次HTTP尝试计数。
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half_open"
+            return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+
+class LLMClient:
+
+    RETRY_STATUS = {500, 502, 503, 504}
+
+    def __init__(self, base_url: str = 'http://localhost:11434', pool_size: int = 10,
+                 max_retries: int = 3, backoff_factor: float = 0.5, backoff_max: float = 8.0,
+                 timeout: float = 60, deadline: Optional[float] = None,
+                 failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 cache: Optional[ResponseCache] = None):
+        """
+        共享的 Ollama HTTP 客户端
+
+        使用连接池复用 TCP 连接，对连接错误、超时和 5xx 响应做指数退避重试，
+        支持单次调用截止时间，并通过熔断器在服务持续不可用时快速失败。
+
+        Args:
+            base_url: Ollama 服务地址
+            pool_size: 连接池大小，应不小于并发调用数
+            max_retries: 最大重试次数（不含首次请求）
+            backoff_factor: 退避基数，第 n 次重试前等待 backoff_factor * 2**n 秒（带随机抖动）
+            backoff_max: 单次退避等待上限
+            timeout: 单次 HTTP 请求超时
+            deadline: 单次调用（含所有重试）的总时长上限，None 表示不限制
+            failure_threshold: 熔断器打开前允许的连续失败次数
+            reset_timeout: 熔断器打开后到允许探测请求的间隔
+            cache: 模型响应缓存，None 表示不缓存
+        """
+        self.base_url = base_url.rstrip('/')
+        self.pool_size = pool_size
+        self.cache = cache
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.deadline = deadline
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"Content-Type": "application/json"})
+
+    def _backoff(self, attempt: int) -> float:
+        delay = min(self.backoff_factor * (2 ** attempt), self.backoff_max)
+        return delay * (0.5 + random.random() / 2)
+
+    def generate(self, payload: Dict, timeout: Optional[float] = None,
+                 deadline: Optional[float] = None, use_cache: bool = True) -> Dict:
+        """
+        调用 /api/generate
+
+        Args:
+            payload: 请求体
+            timeout: 单次 HTTP 请求超时，默认使用客户端配置
+            deadline: 本次调用的总时长上限，默认使用客户端配置
+            use_cache: 是否使用响应缓存
+
+        Returns:
+            Dict: 模型返回的 JSON
+
+        Raises:
+            CircuitOpenError: 熔断器打开
+            LLMClientError: 重试耗尽或超过截止时间
+            requests.exceptions.HTTPError: 不可重试的 HTTP 错误（如 4xx）
+        """
+        cache_key = None
+        if self.cache is not None and use_cache:
+            cache_key = self.cache.make_key(payload)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                record_llm_usage(cached, cached=True)
+                return cached
+
+        url = f"{self.base_url}/api/generate"
+        timeout = timeout or self.timeout
+        deadline = deadline if deadline is not None else self.deadline
+        expires = time.monotonic() + deadline if deadline else None
+        last_error = None
+
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"熔断器已打开，拒绝请求: {url}")
+        for attempt in range(self.max_retries + 1):
+            if attempt and self.breaker.state == "open":
+                # 重试期间其他调用的失败已使熔断器打开，不再继续重试
+                raise CircuitOpenError(f"熔断器已打开，拒绝请求: {url}")
+
+            attempt_timeout = timeout
+            if expires is not None:
+                remaining = expires - time.monotonic()
+                if remaining <= 0:
+                    break
+                attempt_timeout = min(timeout, remaining)
+
+            try:
+                response = self.session.post(url, json=payload, timeout=attempt_timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                last_error = e
+            except requests.exceptions.RequestException:
+                self.breaker.record_failure()
+                raise
+            else:
+                if response.status_code in self.RETRY_STATUS:
+                    last_error = requests.exceptions.HTTPError(
+                        f"{response.status_code} Server Error for url: {url}", response=response
+                    )
+                else:
+                    self.breaker.record_success()
+                    response.raise_for_status()
+                    result = response.json()
+                    record_llm_usage(result)
+                    if cache_key is not None:
+                        self.cache.put(cache_key, result)
+                    return result
+
+            if attempt < self.max_retries:
+                delay = self._backoff(attempt)
+                if expires is not None:
+                    delay = min(delay, max(0.0, expires - time.monotonic()))
+                time.sleep(delay)
+
+        self.breaker.record_failure()
+        raise LLMClientError(f"模型调用失败（已重试 {self.max_retries} 次）: {last_error}")
+
+    def stream_generate(self, payload: Dict, timeout: Optional[float] = None,
+                        deadline: Optional[float] = None, use_cache: bool = True) -> Iterator[str]:
+        """
+        以流式方式调用 /api/generate，逐段返回生成的文本
+
+        Ollama 以 NDJSON 逐行返回 token，每行的 response 字段即新生成的文本。
+        调用方提前关闭生成器（如已取得足够的结果）时连接随之关闭，服务端停止生成。
+        只有完整生成（收到 done 行）的响应才写入缓存；缓存命中时一次性返回全部文本。
+        只在收到第一行之前重试，开始输出后的连接错误直接抛出。
+
+        Args:
+            payload: 请求体，stream 字段会被置为 True
+            timeout: 单次 HTTP 请求超时（连接及相邻两行之间的等待），默认使用客户端配置
+            deadline: 建立连接阶段（含所有重试）的总时长上限，默认使用客户端配置
+            use_cache: 是否使用响应缓存
+
+        Yields:
+            str: 新生成的文本片段
+
+        Raises:
+            CircuitOpenError: 熔断器打开
+            LLMClientError: 重试耗尽、超过截止时间或输出中途断开
+            requests.exceptions.HTTPError: 不可重试的 HTTP 错误（如 4xx）
+        """
+        cache_key = None
+        if self.cache is not None and use_cache:
+            cache_key = self.cache.make_key(payload)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                record_llm_usage(cached, cached=True)
+                yield cached.get('response', '')
+                return
+
+        url = f"{self.base_url}/api/generate"
+        payload = dict(payload, stream=True)
+        timeout = timeout or self.timeout
+        deadline = deadline if deadline is not None else self.deadline
+        expires = time.monotonic() + deadline if deadline else None
+        last_error = None
+        response = None
+
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"熔断器已打开，拒绝请求: {url}")
+        for attempt in range(self.max_retries + 1):
+            if attempt and self.breaker.state == "open":
+                # 重试期间其他调用的失败已使熔断器打开，不再继续重试
+                raise CircuitOpenError(f"熔断器已打开，拒绝请求: {url}")
+
+            attempt_timeout = timeout
+            if expires is not None:
+                remaining = expires - time.monotonic()
+                if remaining <= 0:
+                    break
+                attempt_timeout = min(timeout, remaining)
+
+            try:
+                response = self.session.post(url, json=payload, timeout=attempt_timeout, stream=True)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                last_error = e
+            except requests.exceptions.RequestException:
+                self.breaker.record_failure()
+                raise
+            else:
+                if response.status_code in self.RETRY_STATUS:
+                    last_error = requests.exceptions.HTTPError(
+                        f"{response.status_code} Server Error for url: {url}", response=response
+                    )
+                    response.close()
+                    response = None
+                else:
+                    break
+
+            if attempt < self.max_retries:
+                delay = self._backoff(attempt)
+                if expires is not None:
+                    delay = min(delay, max(0.0, expires - time.monotonic()))
+                time.sleep(delay)
+
+        if response is None:
+            self.breaker.record_failure()
+            raise LLMClientError(f"模型调用失败（已重试 {self.max_retries} 次）: {last_error}")
+
+        with response:
+            if not response.ok:
+                # 与 generate 一致，4xx 是请求本身的问题，服务可用
+                self.breaker.record_success()
+                response.raise_for_status()
+            parts = []
+            # 整个流式调用只记一次结果：完整生成或调用方提前关闭算成功，中途断开、错误行等算失败
+            succeeded = False
+            try:
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get('error'):
+                        raise LLMClientError(f"模型生成失败: {chunk['error']}")
+                    text = chunk.get('response', '')
+                    if text:
+                        parts.append(text)
+                        yield text
+                    if chunk.get('done'):
+                        succeeded = True
+                        record_llm_usage(chunk)
+                        if cache_key is not None:
+                            self.cache.put(cache_key, dict(chunk, response=''.join(parts)))
+                        return
+            except GeneratorExit:
+                succeeded = True
+                raise
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError) as e:
+                raise LLMClientError(f"模型输出中途断开: {e}") from e
+            finally:
+                if succeeded:
+                    self.breaker.record_success()
+                else:
+                    self.breaker.record_failure()
+            raise LLMClientError("模型输出在完成前结束")
+
+    def async_client(self, pool_size: Optional[int] = None) -> "AsyncLLMClient":
+        """创建与本客户端配置一致、共享熔断器的异步客户端"""
+        return AsyncLLMClient(
+            self.base_url,
+            pool_size=pool_size or self.pool_size,
+            max_retries=self.max_retries,
+            backoff_factor=self.backoff_factor,
+            backoff_max=self.backoff_max,
+            timeout=self.timeout,
+            deadline=self.deadline,
+            breaker=self.breaker,
+            cache=self.cache
+        )
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncLLMClient:
+
+    RETRY_STATUS = LLMClient.RETRY_STATUS
+
+    def __init__(self, base_url: str = 'http://localhost:11434', pool_size: int = 10,
+                 max_retries: int = 3, backoff_factor: float = 0.5, backoff_max: float = 8.0,
+                 timeout: float = 60, deadline: Optional[float] = None,
+                 breaker: Optional[CircuitBreaker] = None, cache: Optional[ResponseCache] = None):
+        """
+        基于 httpx 的异步 Ollama 客户端，重试、截止时间与熔断语义与 LLMClient 一致
+
+        客户端绑定到创建它的事件循环，推荐以 `async with` 方式在单次批处理内使用。
+
+        Args:
+            base_url: Ollama 服务地址
+            pool_size: 最大连接数，应不小于并发数
+            max_retries: 最大重试次数（不含首次请求）
+            backoff_factor: 退避基数
+            backoff_max: 单次退避等待上限
+            timeout: 单次 HTTP 请求超时
+            deadline: 单次调用（含所有重试）的总时长上限
+            breaker: 熔断器，传入同步客户端的熔断器即可共享服务健康状态
+            cache: 模型响应缓存，None 表示不缓存
+        """
+        self.base_url = base_url.rstrip('/')
+        self.cache = cache
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.deadline = deadline
+        self.breaker = breaker or CircuitBreaker()
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=timeout
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    def _backoff(self, attempt: int) -> float:
+        delay = min(self.backoff_factor * (2 ** attempt), self.backoff_max)
+        return delay * (0.5 + random.random() / 2)
+
+    async def generate(self, payload: Dict, timeout: Optional[float] = None,
+                       deadline: Optional[float] = None, use_cache: bool = True) -> Dict:
+        """
+        异步调用 /api/generate
+
+        Raises:
+            CircuitOpenError: 熔断器打开
+            LLMClientError: 重试耗尽、超过截止时间或不可重试的 HTTP 错误
+        """
+        cache_key = None
+        if self.cache is not None and use_cache:
+            cache_key = self.cache.make_key(payload)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                record_llm_usage(cached, cached=True)
+                return cached
+
+        url = f"{self.base_url}/api/generate"
+        timeout = timeout or self.timeout
+        deadline = deadline if deadline is not None else self.deadline
+        expires = time.monotonic() + deadline if deadline else None
+        last_error = None
+
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"熔断器已打开，拒绝请求: {url}")
+        for attempt in range(self.max_retries + 1):
+            if attempt and self.breaker.state == "open":
+                # 重试期间其他调用的失败已使熔断器打开，不再继续重试
+                raise CircuitOpenError(f"熔断器已打开，拒绝请求: {url}")
+
+            attempt_timeout = timeout
+            if expires is not None:
+                remaining = expires - time.monotonic()
+                if remaining <= 0:
+                    break
+                attempt_timeout = min(timeout, remaining)
+
+            try:
+                response = await self.client.post(url, json=payload, timeout=attempt_timeout)
+            except httpx.TransportError as e:
+                last_error = e
+            except httpx.HTTPError as e:
+                self.breaker.record_failure()
+                raise LLMClientError(f"模型调用失败: {e}") from e
+            else:
+                if response.status_code in self.RETRY_STATUS:
+                    last_error = f"{response.status_code} Server Error for url: {url}"
+                else:
+                    self.breaker.record_success()
+                    if response.is_error:
+                        raise LLMClientError(f"{response.status_code} Client Error for url: {url}")
+                    result = response.json()
+                    record_llm_usage(result)
+                    if cache_key is not None:
+                        self.cache.put(cache_key, result)
+                    return result
+
+            if attempt < self.max_retries:
+                delay = self._backoff(attempt)
+                if expires is not None:
+                    delay = min(delay, max(0.0, expires - time.monotonic()))
+                await asyncio.sleep(delay)
+
+        self.breaker.record_failure()
+        raise LLMClientError(f"模型调用失败（已重试 {self.max_retries} 次）: {last_error}")
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+_shared_clients = {}
+_shared_lock = threading.Lock()
+
+
+def get_shared_client(base_url: str = 'http://localhost:11434', **kwargs) -> LLMClient:
+    """
+    获取按服务地址共享的客户端实例
+
+    同一进程内调用同一地址的所有引擎共用一个连接池与熔断器。
+    首次创建时使用 kwargs 中的配置，之后的调用直接返回已有实例。
+    """
+    key = base_url.rstrip('/')
+    with _shared_lock:
+        client = _shared_clients.get(key)
+        if client is None:
+            client = LLMClient(key, **kwargs)
+            _shared_clients[key] = client
+        return client
+
+
+def main():
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class StubOllamaHandler(BaseHTTPRequestHandler):
+        calls = 0
+        cancelled = 0
+
+        def do_POST(self):
+            StubOllamaHandler.calls += 1
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            if StubOllamaHandler.calls <= 2:
+                self.send_response(503)
+                self.end_headers()
+                return
+            if body.get("stream"):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.end_headers()
+                text = json.dumps([{"human": f"问题{i}", "assistant": f"答案{i}"} for i in range(20)], ensure_ascii=False)
+                try:
+                    for i in range(0, len(text), 8):
+                        self.wfile.write(json.dumps({"response": text[i:i + 8], "done": False}).encode() + b"\n")
+                        self.wfile.flush()
+                        time.sleep(0.01)
+                    self.wfile.write(json.dumps({"response": "", "done": True, "eval_count": len(text) // 8}).encode() + b"\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    StubOllamaHandler.cancelled += 1
+                return
+            data = json.dumps({"model": body["model"], "response": f"echo: {body['prompt']}", "done": True}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubOllamaHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    client = LLMClient(f"http://127.0.0.1:{server.server_port}", backoff_factor=0.05)
+    result = client.generate({"model": "stub", "prompt": "你好", "stream": False})
+    print(f"响应: {result['response']}，服务端收到 {StubOllamaHandler.calls} 次请求")
+    print(f"熔断器状态: {client.breaker.state}")
+
+    from match import JSONStreamExtractor
+    extractor = JSONStreamExtractor()
+    start = time.perf_counter()
+    first_item, items = None, []
+    stream = client.stream_generate({"model": "stub", "prompt": "生成问答对"})
+    for piece in stream:
+        items.extend(extractor.feed(piece))
+        if items and first_item is None:
+            first_item = time.perf_counter() - start
+        if len(items) >= 5:
+            stream.close()
+            break
+    print(f"流式输出: 首个QA对 {first_item:.2f}s, 取得 {len(items)} 个后提前停止, 共 {time.perf_counter() - start:.2f}s")
+    server.shutdown()
+
+    # 熔断器按调用计数：每次调用重试耗尽才算一次失败
+    down = LLMClient(f"http://127.0.0.1:{server.server_port}", backoff_factor=0.001)
+    server.server_close()
+    for _ in range(2):
+        try:
+            down.generate({"model": "stub", "prompt": "你好"})
+        except LLMClientError:
+            pass
+    print(f"服务不可用时 2 次调用（各重试 {down.max_retries} 次）后熔断器状态: {down.breaker.state}")
+
+
+if __name__ == "__main__":
+    main()
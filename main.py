@@ -1,21 +1,58 @@
 import os
+import json
+import re
 import logging
 import argparse
-from typing import List, Dict, Any
+import threading
+import time
+from contextlib import contextmanager
+from functools import partial
+from typing import List, Dict, Any, Iterator, Optional
 import numpy as np
-from pdf2image import convert_from_path
-import easyocr
+from pdf_pages import pymupdf_available, get_page_count, iter_rendered_pages, iter_selected_pages, render_page_region
 from match import extract_qa_pairs_enhanced
-from Layout_pic_Order import Layout_Order
-from detect_layout import YOLODetector
 from optimization import TextCleaningEngine
 from QA_create import QAcreate_Engine
-from crop_image import crop_image_numpy
+from llm_client import get_shared_client
+from llm_cache import ResponseCache
+from page_buffer import PageBuffer, PageRegions
+from Layout_pic_Order import Layout_Order
+from ocr_batch import ParallelOCR
+from pipeline import Stage, StagedPipeline, StageFailure
+from dedup import QADeduplicator
+from chunker import SemanticChunker
+from text_layer import iter_text_layer
+from checkpoint import PageManifest, atomic_write_json, file_hash, text_hash
+from dataset_io import write_jsonl
+from instrumentation import configure, format_summary, metrics
+
+
+_worker_processor = None
+
+
+def _init_worker(config: Dict[str, Any]):
+    """进程池 worker 初始化：每个进程只加载一次模型"""
+    global _worker_processor
+    _worker_processor = PDFQAProcessor(dict(config, ocr_processes=0))
+    # fork 出的进程继承了父进程已有的计时记录，清空后只上报本进程的记录
+    metrics.drain()
+
+
+def _run_worker_stage(method: str, item):
+    """在 worker 进程中执行 PDFQAProcessor 的某个流水线阶段（批处理阶段的输入输出为列表），开启 metrics 时附带本进程的计时记录"""
+    result = getattr(_worker_processor, method)(item)
+    if metrics.enabled:
+        carrier = next((r for r in (result if isinstance(result, list) else [result]) if isinstance(r, dict)), None)
+        if carrier is not None:
+            carrier.setdefault('_metrics', []).append(metrics.drain())
+    return result
 
 
 class PDFQAProcessor:
     """PDF文档QA对处理主类"""
     
+    STAGE_KEYS = ('boxes', 'context', 'cleaned_text', 'qa_pairs')
+    
     def __init__(self, config: Dict[str, Any] = None):
         self.config = config or {}
         self.setup_logging()
@@ -30,16 +67,91 @@ class PDFQAProcessor:
         self.logger = logging.getLogger(__name__)
     
     def setup_components(self):
-        """初始化各个组件"""
-        try:
-            self.detector = YOLODetector("yolov11x_best.pt")
-            self.reader = easyocr.Reader(['ch_sim', 'en'], gpu=self.config.get('gpu', True))
-            self.text_cleaner = TextCleaningEngine()
-            self.qa_creator = QAcreate_Engine()
-            self.logger.info("所有组件初始化成功")
-        except Exception as e:
-            self.logger.error(f"组件初始化失败: {e}")
-            raise
+        """
+        准备各个组件
+        
+        模型与重量级依赖（ultralytics、torch、easyocr）在首次使用时才加载，
+        只运行LLM阶段的任务（如从已有页面文本重新清洗或生成QA）不会加载视觉模型。
+        """
+        self._components = {}
+        self._component_lock = threading.RLock()
+        self.exporter = None
+        self.deduplicator = None
+        configure(bool(self.config.get('metrics')))
+        self.llm_cache = None
+        if self.config.get('llm_cache'):
+            self.llm_cache = ResponseCache(
+                self.config['llm_cache'],
+                max_bytes=self.config.get('llm_cache_max_bytes', 1 << 30),
+                bypass=self.config.get('llm_cache_bypass', False)
+            )
+    
+    def _component(self, name: str, factory):
+        """获取组件，首次访问时创建"""
+        if name in self._components:
+            return self._components[name]
+        with self._component_lock:
+            if name not in self._components:
+                try:
+                    self._components[name] = factory()
+                    self.logger.info(f"组件 {name} 初始化成功")
+                except Exception as e:
+                    self.logger.error(f"组件 {name} 初始化失败: {e}")
+                    raise
+            return self._components[name]
+    
+    @property
+    def detector(self):
+        def create():
+            from detect_layout import YOLODetector
+            return YOLODetector(self.config.get('yolo_model', "yolov11x_best.pt"))
+        return self._component('detector', create)
+    
+    @property
+    def reader(self):
+        def create():
+            import easyocr
+            return easyocr.Reader(['ch_sim', 'en'], gpu=self.config.get('gpu', True))
+        return self._component('reader', create)
+    
+    @property
+    def ocr_pool(self):
+        def create():
+            if self.config.get('ocr_processes', 0) <= 1:
+                return None
+            return ParallelOCR(
+                ['ch_sim', 'en'],
+                gpu=self.config.get('gpu', True),
+                workers=self.config['ocr_processes']
+            )
+        return self._component('ocr_pool', create)
+    
+    @property
+    def llm_client(self):
+        return self._component('llm_client', lambda: get_shared_client(
+            self.config.get('llm_base_url', 'http://localhost:11434'),
+            pool_size=self.config.get('llm_pool_size', 10),
+            max_retries=self.config.get('llm_max_retries', 3),
+            timeout=self.config.get('llm_timeout', 60),
+            deadline=self.config.get('llm_deadline'),
+            cache=self.llm_cache
+        ))
+    
+    @property
+    def text_cleaner(self):
+        return self._component('text_cleaner', lambda: TextCleaningEngine(
+            self.llm_client.base_url,
+            client=self.llm_client,
+            mode=self.config.get('clean_mode', 'two_pass'),
+            skip_threshold=self.config.get('clean_skip_threshold')
+        ))
+    
+    @property
+    def qa_creator(self):
+        return self._component('qa_creator', lambda: QAcreate_Engine(
+            self.llm_client.base_url, client=self.llm_client,
+            grounding_threshold=self.config.get('grounding_threshold', 0.0)
+        ))
     
     def process_pdf(self, pdf_path: str, output_dir: str = "output") -> List[Dict]:
         """
@@ -56,81 +168,576 @@ class PDFQAProcessor:
         
         try:
             self.logger.info(f"开始处理PDF: {pdf_path}")
-            pages = convert_from_path(pdf_path, 300)
-            all_qa_pairs = []
-            
-            for i, page in enumerate(pages):
-                self.logger.info(f"处理第 {i+1} 页")
-                page_qa_pairs = self.process_page(page, i, output_dir)
-                all_qa_pairs.extend(page_qa_pairs)
-            
-            self.save_final_qa(all_qa_pairs, output_dir)
-            self.logger.info(f"处理完成，共提取 {len(all_qa_pairs)} 个QA对")
-            return all_qa_pairs
+            with self.exporting(output_dir, pdf_path):
+                items = self.batch_detect(self.iter_page_items(pdf_path, output_dir))
+                if self.config.get('chunk_qa'):
+                    return self.finalize_qa(self.process_items_chunked(items, output_dir), output_dir)
+                
+                all_qa_pairs = []
+                for item in items:
+                    self.logger.info(f"处理第 {item['page_num']+1} 页")
+                    page_qa_pairs = self.process_item(item)
+                    self.collect_qa(all_qa_pairs, page_qa_pairs)
+                    self.export_page(item)
+                    del item
+                
+                return self.finalize_qa(all_qa_pairs, output_dir)
             
         except Exception as e:
             self.logger.error(f"处理PDF失败: {e}")
             raise
     
+    def process_text_dir(self, output_dir: str = "output", from_stage: str = "clean") -> List[Dict]:
+        """
+        从已有的页面文本文件继续处理，只运行LLM阶段
+        
+        Args:
+            output_dir: 包含 pageo_{n}.txt / page_{n}.txt 的输出目录
+            from_stage: 'clean' 从原始OCR文本重新清洗并生成QA；'qa' 从清洗后文本重新生成QA
+            
+        Returns:
+            List[Dict]: 提取的QA对列表
+        """
+        prefix, key = {'clean': ('pageo_', 'context'), 'qa': ('page_', 'cleaned_text')}[from_stage]
+        pattern = re.compile(rf"^{prefix}(\d+)\.txt$")
+        page_nums = sorted(
+            int(m.group(1)) for m in map(pattern.match, os.listdir(output_dir)) if m
+        )
+        self.logger.info(f"从 {output_dir} 读取 {len(page_nums)} 个页面文本，从 {from_stage} 阶段开始处理")
+        
+        items = (
+            {'page_num': page_num, 'output_dir': output_dir, key: self._read_output(output_dir, f"{prefix}{page_num}.txt")}
+            for page_num in page_nums
+        )
+        with self.exporting(output_dir):
+            if self.config.get('chunk_qa'):
+                return self.finalize_qa(self.process_items_chunked(items, output_dir), output_dir)
+            
+            all_qa_pairs = []
+            for item in items:
+                self.logger.info(f"处理第 {item['page_num']+1} 页")
+                self.collect_qa(all_qa_pairs, self.process_item(item))
+                self.export_page(item)
+            
+            return self.finalize_qa(all_qa_pairs, output_dir)
+    
+    def iter_page_items(self, pdf_path: str, output_dir: str, page_nums: List[int] = None,
+                        pdf_hash: Optional[str] = None):
+        """
+        按页码顺序生成待处理的页面条目
+        
+        开启 resume 时，根据清单恢复每页已完成阶段的结果；有可用文本层的页面直接提取文本，
+        只渲染仍需OCR的页面。
+        
+        Args:
+            pdf_path: PDF文件路径
+            output_dir: 输出目录
+            page_nums: 需要处理的页码（从0开始），默认处理全部页面
+            pdf_hash: 已算好的 file_hash(pdf_path)，分片处理同一文档时避免重复读取整个文件
+        """
+        dpi = self.config.get('dpi', 300)
+        detect_dpi = self.detect_dpi()
+        pdf_hash = pdf_hash or file_hash(pdf_path)
+        source_hash = text_hash(f"{pdf_hash}:{dpi}" + (f":{detect_dpi}" if detect_dpi else ""))
+        if page_nums is None:
+            page_nums = list(range(get_page_count(pdf_path)))
+        
+        items = []
+        for page_num in page_nums:
+            item = {'page_num': page_num, 'output_dir': output_dir, 'source_hash': source_hash}
+            if detect_dpi:
+                item['pdf_path'] = pdf_path
+            if self.config.get('resume'):
+                self.restore_item(item)
+            items.append(item)
+        
+        pending = [item for item in items if not self._stage_done(item, 'context')]
+        restored = len(items) - len(pending)
+        if restored:
+            self.logger.info(f"从检查点恢复 {restored} 页，其余 {len(pending)} 页需要处理")
+        routed = iter(pending)
+        if pending and self.config.get('text_layer', True) and pymupdf_available():
+            routed = self.route_text_layer(pdf_path, pending)
+        
+        # 按窗口分流与渲染，首页输出不必等整份文档的文本层都提取完
+        window = max(1, self.config.get('page_window', 4))
+        for first in range(0, len(items), window):
+            batch = items[first:first + window]
+            for item in batch:
+                if not self._stage_done(item, 'context'):
+                    next(routed)
+            to_render = [item['page_num'] for item in batch if not self._stage_done(item, 'context')]
+            if detect_dpi:
+                pages = iter_rendered_pages(pdf_path, to_render, dpi=detect_dpi)
+            else:
+                pages = iter_selected_pages(pdf_path, to_render, dpi=dpi, window=window)
+            
+            for item in batch:
+                if not self._stage_done(item, 'context'):
+                    with metrics.span('render', pages=1) as span:
+                        _, item['page'] = next(pages)
+                        span.add(bytes=item['page'].width * item['page'].height * len(item['page'].getbands()))
+                yield item
+        for _ in routed:
+            pass
+    
+    def route_text_layer(self, pdf_path: str, items: List[Dict]) -> Iterator[Dict]:
+        """
+        PDF自带可用文本层的页面直接按阅读顺序提取文本，跳过版面检测与OCR
+        
+        逐页分流并生成条目，调用方按需推进；文本层为空、被图像覆盖（扫描页）或字体编码损坏的页面
+        保留给视觉识别路径，每页的分流结果与原因写入日志，全部分流完后汇总。
+        """
+        elapsed = 0.0
+        routes = {'text': 0, 'empty': 0, 'vision': 0}
+        layer = iter_text_layer(pdf_path, [item['page_num'] for item in items],
+                                drop_margins=self.config.get('drop_margins', False))
+        for item in items:
+            start = time.perf_counter()
+            with metrics.span('text_layer', pages=1) as span:
+                page_num, text, reason = next(layer)
+                if text is None:
+                    routes['vision'] += 1
+                    self.logger.info(f"第 {page_num+1} 页需要OCR：{reason}")
+                elif not text:
+                    routes['empty'] += 1
+                    item['qa_pairs'] = []
+                    item['route'] = 'text'
+                    self._checkpoint(item, 'ocr', item['source_hash'], empty=True, route='text')
+                else:
+                    routes['text'] += 1
+                    span.add(chars=len(text), text_pages=1)
+                    self.save_page_text(text, page_num, item['output_dir'])
+                    self._checkpoint(item, 'ocr', item['source_hash'], route='text')
+                    item['route'] = 'text'
+                    item['context'] = text
+            elapsed += time.perf_counter() - start
+            yield item
+        
+        self.logger.info(f"PDF文本层分流: {routes['text']} 页直接提取文本，{routes['empty']} 页为空白页，"
+                         f"{routes['vision']} 页走OCR（耗时 {elapsed:.2f}s）")
+    
+    def detect_dpi(self) -> Optional[int]:
+        """
+        版面检测使用的低分辨率渲染DPI
+        
+        YOLO 会把输入缩放到自身的输入尺寸，整页按OCR分辨率渲染只是浪费；
+        开启后整页只按 detect_dpi 渲染用于检测，文本区域再按 dpi 单独渲染。
+        低分辨率下检测到的文本框可能与原流程不同，因此默认关闭：
+        未配置（默认0）、不低于 dpi 或未安装 PyMuPDF 时返回 None，整页按 dpi 渲染，与原流程一致。
+        """
+        detect_dpi = self.config.get('detect_dpi', 0)
+        if not detect_dpi or detect_dpi >= self.config.get('dpi', 300):
+            return None
+        if not pymupdf_available():
+            if not getattr(self, '_warned_clip', False):
+                self._warned_clip = True
+                self.logger.warning("未安装 PyMuPDF，无法只渲染文本区域，整页按OCR分辨率渲染")
+            return None
+        return detect_dpi
+    
+    def restore_item(self, item: Dict):
+        """根据清单与已有输出文件恢复页面已完成的阶段"""
+        page_num, output_dir = item['page_num'], item['output_dir']
+        manifest = PageManifest(output_dir)
+        
+        ocr = manifest.get_stage(page_num, 'ocr')
+        if ocr is None or ocr['input_hash'] != item['source_hash']:
+            return
+        if ocr.get('route'):
+            item['route'] = ocr['route']
+        if ocr.get('empty'):
+            item['qa_pairs'] = []
+            return
+        context = self._read_output(output_dir, f"pageo_{page_num}.txt")
+        if context is None:
+            return
+        
+        cleaned_text = None
+        if manifest.is_done(page_num, 'clean', text_hash(context)):
+            cleaned_text = self._read_output(output_dir, f"page_{page_num}.txt")
+        if cleaned_text is None:
+            item['context'] = context
+            return
+        
+        qa_json = None
+        if manifest.is_done(page_num, 'qa', text_hash(cleaned_text)):
+            qa_json = self._read_output(output_dir, f"qa_{page_num}.json")
+        if qa_json is None:
+            item['cleaned_text'] = cleaned_text
+            return
+        item['qa_pairs'] = json.loads(qa_json)
+    
+    def _read_output(self, output_dir: str, name: str):
+        try:
+            with open(os.path.join(output_dir, name), "r", encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+    
+    def _stage_done(self, item: Dict, key: str) -> bool:
+        """条目中是否已有 key 或其后续阶段的结果"""
+        return any(k in item for k in self.STAGE_KEYS[self.STAGE_KEYS.index(key):])
+    
     def process_page(self, page, page_num: int, output_dir: str) -> List[Dict]:
         """处理单个页面"""
+        return self.process_item({'page_num': page_num, 'output_dir': output_dir, 'page': page})
+    
+    def process_item(self, item: Dict) -> List[Dict]:
+        """依次执行各阶段处理一个页面条目"""
         try:
-            img_np = np.array(page)
-            ssz = img_np.shape[1]
+            for stage in (self._stage_detect, self._stage_ocr, self._stage_clean, self._stage_qa):
+                item = stage(item)
+            return item['qa_pairs']
             
-            b_list = self.detector.detect_text_boxes(img_np)
-            if not b_list:
-                self.logger.warning(f"第 {page_num} 页未检测到文本区域")
-                return []
+        except Exception as e:
+            self.logger.error(f"处理第 {item['page_num']} 页失败: {e}")
+            return []
+    
+    def process_items_chunked(self, items, output_dir: str) -> List[Dict]:
+        """
+        逐页完成OCR与清洗后，对整篇清洗文本按语义边界与 token 预算分块生成QA对
+        
+        跨页的句子与表格不再被截断，多个短页面合并为一次模型调用。
+        
+        Args:
+            items: 页面条目序列
+            output_dir: 输出目录
+            
+        Returns:
+            List[Dict]: 提取的QA对列表
+        """
+        chunker = SemanticChunker(self.config.get('chunk_tokens', 1200), self.config.get('chunk_overlap', 100))
+        all_qa_pairs = []
+        n_pages = n_chunks = 0
+        
+        for item in items:
+            self.logger.info(f"处理第 {item['page_num']+1} 页")
+            cleaned_text = self.clean_item(item)
+            if not cleaned_text:
+                continue
+            n_pages += 1
+            for chunk in chunker.feed(cleaned_text, item['page_num']):
+                self.collect_qa(all_qa_pairs, self.process_chunk(chunk, output_dir))
+                n_chunks += 1
+        for chunk in chunker.flush():
+            self.collect_qa(all_qa_pairs, self.process_chunk(chunk, output_dir))
+            n_chunks += 1
+        
+        self.logger.info(f"{n_pages} 页文本合并为 {n_chunks} 个文本块生成QA对")
+        return all_qa_pairs
+    
+    def clean_item(self, item: Dict) -> str:
+        """执行到清洗阶段为止，返回页面清洗后的文本；页面无文本或处理失败时返回空字符串"""
+        try:
+            for stage in (self._stage_detect, self._stage_ocr, self._stage_clean):
+                item = stage(item)
+        except Exception as e:
+            self.logger.error(f"处理第 {item['page_num']} 页失败: {e}")
+            return ""
+        return self.page_text(item) or ""
+    
+    def page_text(self, item: Dict) -> Optional[str]:
+        """页面清洗后的文本：优先取本次处理的结果，断点续跑跳过清洗阶段时读回 page_{n}.txt"""
+        if 'cleaned_text' in item:
+            return item['cleaned_text']
+        return self._read_output(item['output_dir'], f"page_{item['page_num']}.txt")
+    
+    def process_chunk(self, chunk: Dict, output_dir: str) -> List[Dict]:
+        """为一个文本块生成QA对，结果按文本哈希保存，开启 resume 时直接复用"""
+        chunk_dir = os.path.join(output_dir, ".chunks")
+        os.makedirs(chunk_dir, exist_ok=True)
+        path = os.path.join(chunk_dir, f"qa_{text_hash(chunk['text'])[:16]}.json")
+        timings = {}
+        if self.config.get('resume') and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                qa_pairs = json.load(f)
+        else:
+            pages = f"{chunk['pages'][0]+1}-{chunk['pages'][-1]+1}" if chunk['pages'] else "?"
+            self.logger.info(f"为第 {pages} 页的文本块生成QA对（约 {chunk['tokens']} tokens）")
+            start = time.perf_counter()
+            with metrics.span('qa', chars=len(chunk['text'])) as span:
+                qa_pairs = self.extract_qa_pairs(chunk['text'])
+                span.add(pairs=len(qa_pairs))
+            timings['qa'] = time.perf_counter() - start
+            atomic_write_json(path, qa_pairs)
+        if self.exporter is not None and chunk['pages']:
+            self.exporter.add_page(qa_pairs, self._export_document, chunk['pages'][0], chunk['pages'][-1],
+                                   source_path=self._export_source, timings=timings, source_text=chunk['text'])
+        return qa_pairs
+    
+    def _stage_detect(self, item: Dict) -> Dict:
+        """流水线阶段：版面检测并裁剪文本区域"""
+        if self._stage_done(item, 'boxes'):
+            return item
+        start = time.perf_counter()
+        with metrics.span('detect') as span:
+            page = self.page_input(item.pop('page'))
+            height, ssz = page.shape[:2]
             
-            processed_boxes = self.process_boxes(b_list, img_np, ssz)
-            context = self.extract_text_from_boxes(processed_boxes)
+            b_list = item.pop('text_boxes', None)
+            if b_list is None:
+                b_list = self.detector.detect_text_boxes(page)
+            span.add(regions=len(b_list))
+            if not b_list:
+                self.logger.warning(f"第 {item['page_num']} 页未检测到文本区域")
+                item['qa_pairs'] = []
+                self._checkpoint(item, 'ocr', item.get('source_hash'), empty=True)
+                return self._timed(item, 'detect', start)
             
-            self.save_page_text(context, page_num, output_dir)
+            if 'pdf_path' in item:
+                # 检测用的是低分辨率渲染，只按OCR分辨率渲染文本区域
+                ordered = self.order_boxes(b_list, ssz, height)
+                del page
+                item['boxes'] = self.render_boxes(item, ordered)
+                return self._timed(item, 'detect', start)
             
+            # 整页只转换一次为缓冲区（开启 --ocr_x_height 时为单通道灰度），文本框都是它的视图；多进程OCR时放入共享内存
+            buffer = PageBuffer(page, shared=bool(self.config.get('shared_pages')) and self.ocr_pool is not None,
+                                gray=bool(self.config.get('ocr_x_height')))
+            del page
+            item['boxes'] = self.process_boxes(b_list, buffer, ssz)
+            return self._timed(item, 'detect', start)
+    
+    def _stage_ocr(self, item: Dict) -> Dict:
+        """流水线阶段：文本区域OCR"""
+        if self._stage_done(item, 'context'):
+            return item
+        start = time.perf_counter()
+        boxes = item.pop('boxes')
+        with metrics.span('ocr', regions=len(boxes)) as span:
+            try:
+                context = self.extract_text_from_boxes(boxes)
+            finally:
+                if isinstance(boxes, PageRegions):
+                    boxes.close()
+            span.add(chars=len(context))
+        self.save_page_text(context, item['page_num'], item['output_dir'])
+        self._checkpoint(item, 'ocr', item.get('source_hash'), route='vision')
+        item['route'] = 'vision'
+        item['context'] = context
+        return self._timed(item, 'ocr', start)
+    
+    def _stage_clean(self, item: Dict) -> Dict:
+        """流水线阶段：LLM文本清洗"""
+        if self._stage_done(item, 'cleaned_text'):
+            return item
+        start = time.perf_counter()
+        context = item.pop('context')
+        with metrics.span('clean', chars=len(context)):
             cleaned_text = self.text_cleaner.clean_text_chunk(context)
-            self.save_cleaned_text(cleaned_text, page_num, output_dir)
+        self.save_cleaned_text(cleaned_text, item['page_num'], item['output_dir'])
+        self._checkpoint(item, 'clean', text_hash(context))
+        item['cleaned_text'] = cleaned_text
+        return self._timed(item, 'clean', start)
+    
+    def _stage_qa(self, item: Dict) -> Dict:
+        """流水线阶段：LLM生成QA对"""
+        if self._stage_done(item, 'qa_pairs'):
+            return item
+        start = time.perf_counter()
+        cleaned_text = item.pop('cleaned_text')
+        with metrics.span('qa', chars=len(cleaned_text)) as span:
+            item['qa_pairs'] = self.extract_qa_pairs(cleaned_text)
+            span.add(pairs=len(item['qa_pairs']))
+        self.save_page_qa(item['qa_pairs'], item['page_num'], item['output_dir'])
+        self._checkpoint(item, 'qa', text_hash(cleaned_text))
+        return self._timed(item, 'qa', start)
+    
+    def batch_detect(self, items):
+        """
+        按 detect_batch 把连续的待检测页面分组，每组一次前向推理完成版面检测后再逐页交给后续阶段
+        
+        只有需要检测的页面计入分组大小，其余页面按原顺序随组输出。
+        """
+        size = self.config.get('detect_batch', 4)
+        if not size or size <= 1:
+            yield from items
+            return
+        window, pending = [], 0
+        for item in items:
+            window.append(item)
+            pending += 'page' in item and not self._stage_done(item, 'boxes')
+            if pending >= size:
+                self.detect_window(window)
+                yield from window
+                window, pending = [], 0
+        if window:
+            self.detect_window(window)
+            yield from window
+    
+    def detect_window(self, items: List[Dict]):
+        """对一组页面做一次批量版面检测，检测结果存入条目的 text_boxes，由 _stage_detect 继续处理"""
+        todo = [item for item in items if 'page' in item and not self._stage_done(item, 'boxes')]
+        if len(todo) < 2:
+            return
+        start = time.perf_counter()
+        for item in todo:
+            item['page'] = self.page_input(item['page'])
+        try:
+            with metrics.span('detect_batch', pages=len(todo)):
+                results = self.detector.detect_text_boxes_batch([item['page'] for item in todo], batch_size=len(todo))
+        except Exception as e:
+            self.logger.warning(f"批量版面检测失败，改为逐页检测: {e}")
+            return
+        share = (time.perf_counter() - start) / len(todo)
+        for item, boxes in zip(todo, results):
+            item['text_boxes'] = boxes
+            item.setdefault('timings', {})['detect'] = share
+    
+    def _stage_detect_batch(self, items: List[Dict]) -> List:
+        """流水线批处理阶段：批量版面检测后逐页裁剪文本区域，单页失败时在对应位置返回异常"""
+        self.detect_window(items)
+        results = []
+        for item in items:
+            try:
+                results.append(self._stage_detect(item))
+            except Exception as e:
+                results.append(e)
+        return results
+    
+    def page_input(self, page):
+        """
+        检测与OCR使用的页面：与原流程一致，整页转为一个RGB数组交给检测，不受OCR相关参数影响；
+        开启 --ocr_x_height 时只有OCR缓冲区（PageBuffer）再转为灰度
+        """
+        if isinstance(page, np.ndarray):
+            return page
+        return np.array(page)
+    
+    @staticmethod
+    def _timed(item: Dict, stage: str, start: float) -> Dict:
+        """记录页面某阶段的耗时（累加批量检测分摊的时间），作为导出数据集的来源信息"""
+        timings = item.setdefault('timings', {})
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+        return item
+    
+    def _checkpoint(self, item: Dict, stage: str, input_hash: str, **extra):
+        """在清单中记录页面某阶段已完成"""
+        if input_hash is None:
+            return
+        PageManifest(item['output_dir']).mark_done(item['page_num'], stage, input_hash, **extra)
+    
+    def process_pdf_pipelined(self, pdf_path: str, output_dir: str = "output") -> List[Dict]:
+        """
+        以多阶段流水线方式处理PDF
+        
+        渲染、版面检测、OCR、文本清洗和QA生成各自运行在独立的 worker 池中，
+        阶段之间通过有界队列连接。版面检测与OCR默认使用进程池，两个LLM阶段使用线程池。
+        
+        Args:
+            pdf_path: PDF文件路径
+            output_dir: 输出目录
             
-            qa_pairs = self.extract_qa_pairs(cleaned_text)
-            return qa_pairs
+        Returns:
+            List[Dict]: 提取的QA对列表，按页码顺序排列
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        self.logger.info(f"开始流水线处理PDF: {pdf_path}")
+        if self.config.get('chunk_qa'):
+            self.logger.warning("流水线模式不支持 chunk_qa，仍按页生成QA对")
+        
+        items = self.iter_page_items(pdf_path, output_dir)
+        
+        pipeline = StagedPipeline(self.build_pipeline_stages(), queue_size=self.config.get('queue_size', 4))
+        all_qa_pairs = []
+        with self.exporting(output_dir, pdf_path):
+            for seq, result in pipeline.run(items):
+                if isinstance(result, dict):
+                    for snapshot in result.pop('_metrics', ()):
+                        metrics.merge(snapshot)
+                if isinstance(result, StageFailure):
+                    self.logger.error(f"处理第 {seq} 页失败（{result.stage} 阶段）: {result.error}")
+                    continue
+                self.logger.info(f"第 {result['page_num'] + 1} 页处理完成")
+                self.collect_qa(all_qa_pairs, result['qa_pairs'])
+                self.export_page(result)
             
-        except Exception as e:
-            self.logger.error(f"处理第 {page_num} 页失败: {e}")
-            return []
+            return self.finalize_qa(all_qa_pairs, output_dir)
     
-    def process_boxes(self, b_list: List, img_np: np.ndarray, ssz: int) -> List:
-        """处理检测到的文本框"""
+    def build_pipeline_stages(self) -> List[Stage]:
+        """根据配置构建流水线各阶段"""
+        vision_executor = self.config.get('vision_executor', 'process')
+        
+        def vision_stage(name: str, method: str, workers: int, batch_size: int = 1) -> Stage:
+            if vision_executor == 'process':
+                return Stage(name, partial(_run_worker_stage, method), workers, 'process',
+                             initializer=_init_worker, initargs=(self.config,), batch_size=batch_size)
+            return Stage(name, getattr(self, method), workers, 'thread', batch_size=batch_size)
+        
+        detect_batch = self.config.get('detect_batch', 4) or 1
+        return [
+            vision_stage('detect', '_stage_detect_batch' if detect_batch > 1 else '_stage_detect',
+                         self.config.get('detect_workers', 1), detect_batch),
+            vision_stage('ocr', '_stage_ocr', self.config.get('ocr_workers', 2)),
+            Stage('clean', self._stage_clean, self.config.get('clean_workers', 4), 'thread'),
+            Stage('qa', self._stage_qa, self.config.get('qa_workers', 4), 'thread'),
+        ]
+    
+    def order_boxes(self, b_list: List, ssz: int, page_height: int) -> List[List[int]]:
+        """按阅读顺序排列检测到的文本框"""
         pppd = []
         for b in b_list:
             left, right, top, bott = b[0], b[2], b[1], b[3]
             pppd.append([left, top, (right - left), ssz / 2, right, bott])
         
-        ld = Layout_Order(pppd)
-        boxes_to_reg = []
+        return Layout_Order(pppd, page_height=page_height, drop_margins=self.config.get('drop_margins', False))
+    
+    def process_boxes(self, b_list: List, buffer: PageBuffer, ssz: int) -> PageRegions:
+        """处理检测到的文本框，按阅读顺序返回页面缓冲区上的文本区域"""
+        ld = self.order_boxes(b_list, ssz, buffer.shape[0])
+        return PageRegions(buffer, ld, self.config.get('ocr_x_height') or None)
+    
+    def render_boxes(self, item: Dict, boxes: List[List[int]]) -> PageRegions:
+        """
+        只按OCR分辨率渲染页面上被文本框覆盖的矩形，文本框坐标换算到该缓冲区中
         
-        for b in ld:
-            left, top, right, bott = b[0], b[1], b[2], b[3]
-            bp = crop_image_numpy(img_np, b)
-            pppd.append([left, top, (right - left), ssz / 2, right, bott])
-            boxes_to_reg.append(bp)
+        逐个文本框裁剪渲染时每次都要重新遍历整页内容，渲染一次外接矩形再取视图更快。
+        与整页路径一致，未开启 --ocr_x_height 时渲染为RGB，开启时直接渲染灰度。
+        """
+        detect_dpi, dpi = self.config.get('detect_dpi', 0), self.config.get('dpi', 300)
+        scale = dpi / detect_dpi
+        gray = bool(self.config.get('ocr_x_height'))
+        # 低分辨率坐标取整的误差约为 scale 个像素，各边外扩一个低分辨率像素
+        bounds = np.array(boxes, dtype=np.float64) + [-1, -1, 1, 1]
+        union = [*bounds[:, :2].min(axis=0), *bounds[:, 2:].max(axis=0)]
+        with metrics.span('render_regions', regions=len(boxes)) as span:
+            region, (x0, y0) = render_page_region(item['pdf_path'], item['page_num'], union, detect_dpi, dpi, gray=gray)
+            span.add(bytes=region.nbytes)
         
-        return boxes_to_reg
+        boxes = (np.round(bounds * scale) - [x0, y0, x0, y0]).astype(int).tolist()
+        buffer = PageBuffer(region, shared=bool(self.config.get('shared_pages')) and self.ocr_pool is not None,
+                            gray=gray)
+        return PageRegions(buffer, boxes, self.config.get('ocr_x_height') or None)
     
-    def extract_text_from_boxes(self, boxes: List) -> str:
-        """从图片框中提取文本"""
-        context = ""
-        for box in boxes:
-            try:
-                result = self.reader.readtext(box, detail=0)
-                context += ''.join(result) + "\n"
-            except Exception as e:
-                self.logger.warning(f"文本提取失败: {e}")
+    def extract_text_from_boxes(self, boxes) -> str:
+        """从图片框（区域数组列表或 PageRegions）中提取文本"""
+        if self.ocr_pool is not None:
+            results = self.ocr_pool.readtext_regions(boxes)
+        else:
+            results = [self._readtext_region(box) for box in boxes]
+        
+        lines = []
+        for text, error in results:
+            if error is not None:
+                self.logger.warning(f"文本提取失败: {error}")
                 continue
-        return context
+            lines.append(text)
+            lines.append("\n")
+        return ''.join(lines)
+    
+    def _readtext_region(self, box) -> tuple:
+        """识别单个文本框，返回 (文本, 错误信息)"""
+        try:
+            return ''.join(self.reader.readtext(box, detail=0)), None
+        except Exception as e:
+            return '', str(e)
     
     def extract_qa_pairs(self, text: str) -> List[Dict]:
         """从文本中提取QA对"""
         try:
+            if self.config.get('stream_qa'):
+                return list(self.qa_creator.stream_qa_pairs(text, self.config.get('qa_max_pairs')))
             qa_pairs = self.qa_creator.create_qa_pairs(text)
             enhanced_pairs = extract_qa_pairs_enhanced(qa_pairs)
             return enhanced_pairs if enhanced_pairs else []
@@ -138,6 +745,109 @@ class PDFQAProcessor:
             self.logger.error(f"QA对提取失败: {e}")
             return []
     
+    @contextmanager
+    def exporting(self, output_dir: str, pdf_path: Optional[str] = None):
+        """
+        开启 parquet 时，处理期间每页完成后把QA对与来源信息追加到 output_dir/QA.parquet
+        
+        正常结束时替换目标文件，出错时丢弃未完成的文件。
+        """
+        if not self.config.get('parquet'):
+            yield
+            return
+        from export_arrow import ParquetQAWriter
+        self.exporter = ParquetQAWriter(os.path.join(output_dir, "QA.parquet"),
+                                        grounding=self.config.get('parquet_grounding', True))
+        self._export_source = os.path.abspath(pdf_path) if pdf_path else None
+        self._export_document = os.path.splitext(os.path.basename(pdf_path or os.path.abspath(output_dir)))[0]
+        try:
+            yield
+        except BaseException:
+            self.exporter.abort()
+            raise
+        else:
+            self.exporter.close()
+            self.logger.info(f"导出 {self.exporter.rows} 个QA对到 {self.exporter.path}（{self.exporter.row_groups} 个行组）")
+        finally:
+            self.exporter = None
+    
+    def export_page(self, item: Dict):
+        """把一页的QA对连同页码、文本来源、各阶段耗时与答案溯源得分追加到导出文件"""
+        if self.exporter is None or not item.get('qa_pairs'):
+            return
+        self.exporter.add_page(item['qa_pairs'], self._export_document, item['page_num'],
+                               source_path=self._export_source, route=item.get('route'),
+                               timings=item.get('timings'), source_text=self.page_text(item))
+    
+    def collect_qa(self, all_qa_pairs: List[Dict], qa_pairs: List[Dict]):
+        """收集一页（或一个文本块）的QA对，开启 dedup 时同时增量加入去重索引"""
+        all_qa_pairs.extend(qa_pairs)
+        if self.config.get('dedup'):
+            self.dedup_index().add_many(qa_pairs)
+    
+    def dedup_index(self) -> QADeduplicator:
+        """
+        本次运行的去重索引，首次使用时创建
+        
+        配置了 dedup_index 时从该文件加载已有索引（此前处理过的文档的QA对），与其中的簇重复的QA对不再输出。
+        """
+        if self.deduplicator is None:
+            threshold = self.config.get('dedup_threshold', 0.7)
+            path = self.config.get('dedup_index')
+            if path and os.path.exists(path):
+                self.deduplicator = QADeduplicator.load(path)
+                self.deduplicator.threshold = threshold
+                self.logger.info(f"已加载去重索引 {path}: {len(self.deduplicator.clusters)} 个簇")
+            else:
+                self.deduplicator = QADeduplicator(threshold=threshold)
+            self._dedup_start = len(self.deduplicator.clusters)
+        return self.deduplicator
+    
+    def finalize_qa(self, all_qa_pairs: List[Dict], output_dir: str) -> List[Dict]:
+        """可选的近似去重后保存最终QA对"""
+        if self.config.get('dedup'):
+            deduplicator = self.dedup_index()
+            deduped = [cluster['pair'] for cluster in deduplicator.clusters[self._dedup_start:]]
+            self.logger.info(f"近似去重: {len(all_qa_pairs)} -> {len(deduped)} 个QA对")
+            all_qa_pairs = deduped
+            if self.config.get('dedup_index'):
+                deduplicator.save(self.config['dedup_index'])
+            self.deduplicator = None
+        self.save_final_qa(all_qa_pairs, output_dir)
+        self.logger.info(f"处理完成，共提取 {len(all_qa_pairs)} 个QA对")
+        self.log_clean_stats()
+        self.log_cache_stats()
+        self.write_metrics(output_dir)
+        return all_qa_pairs
+    
+    def log_clean_stats(self):
+        """输出文本清洗的调用统计"""
+        if 'text_cleaner' not in self._components:
+            return
+        stats = self.text_cleaner.stats()
+        self.logger.info(
+            f"文本清洗({self.text_cleaner.mode}): {stats['chunks']} 页, 跳过 {stats['skipped']} 页, "
+            f"模型调用 {stats['calls']} 次, 较两遍清洗节省 {stats['calls_saved']} 次"
+        )
+    
+    def log_cache_stats(self):
+        """输出模型响应缓存的命中统计"""
+        if self.llm_cache is None:
+            return
+        stats = self.llm_cache.stats()
+        self.logger.info(
+            f"模型响应缓存: 命中 {stats['hits']} 次, 未命中 {stats['misses']} 次, "
+            f"命中率 {stats['hit_rate']:.1%}, 共 {stats['entries']} 条"
+        )
+    
+    def write_metrics(self, output_dir: str):
+        """开启 metrics 时写出各阶段的耗时、CPU时间、字节数、token 数与生成速度汇总"""
+        if not metrics.enabled:
+            return
+        report = metrics.write_report(os.path.join(output_dir, "metrics.json"))
+        for line in format_summary(report):
+            self.logger.info(f"阶段统计 {line}")
+    
     def save_page_text(self, text: str, page_num: int, output_dir: str):
         """保存原始页面文本"""
         file_path = os.path.join(output_dir, f"pageo_{page_num}.txt")
@@ -150,13 +860,14 @@ class PDFQAProcessor:
         with open(file_path, "w", encoding="utf-8") as f:
             f.write(text)
     
-    def save_final_qa(self, qa_pairs: List[Dict], output_dir: str):
-        """保存最终的QA对"""
-        file_path = os.path.join(output_dir, "QA.txt")
-        with open(file_path, "w", encoding="utf-8") as f:
-            for item in qa_pairs:
-                f.write(str(item))
-                f.write("\n")
+    def save_page_qa(self, qa_pairs: List[Dict], page_num: int, output_dir: str):
+        """原子写入单页的QA对，供断点续跑使用"""
+        atomic_write_json(os.path.join(output_dir, f"qa_{page_num}.json"), qa_pairs)
+    
+    @staticmethod
+    def save_final_qa(qa_pairs: List[Dict], output_dir: str):
+        """原子写入最终的QA对（JSON Lines，每行一个QA对）"""
+        write_jsonl(os.path.join(output_dir, "QA.txt"), qa_pairs)
 
 
 def main():
@@ -165,15 +876,98 @@ def main():
     parser.add_argument("--pdf_path", type=str, default="/keeson/code/lwd/Medical_QA/pdf-convert-markdown/医学指南/1_指南——PDF/失眠/2023 BSA指南：成人失眠的诊断与治疗.pdf", help="PDF文件路径")
     parser.add_argument("--output_dir", type=str, default="output", help="输出目录")
     parser.add_argument("--gpu", type=bool, default=True, help="是否使用GPU")
+    parser.add_argument("--dpi", type=int, default=300, help="页面渲染分辨率")
+    parser.add_argument("--no_text_layer", action="store_true", help="忽略PDF自带文本层，所有页面都走版面检测与OCR")
+    parser.add_argument("--detect_dpi", type=int, default=0, help="版面检测的整页渲染分辨率（如150），文本区域再按 --dpi 单独渲染（需要PyMuPDF）；默认0表示整页按 --dpi 渲染，与原流程一致，开启前先用 bench_render.py --ocr 比较识别结果")
+    parser.add_argument("--page_window", type=int, default=4, help="每次渲染的页数，决定内存峰值")
+    parser.add_argument("--drop_margins", action="store_true", help="丢弃页眉页脚区域的文本框")
+    parser.add_argument("--ocr_processes", type=int, default=0, help="单页内文本框OCR的进程数，0表示串行")
+    parser.add_argument("--ocr_x_height", type=float, default=0, help="OCR前把页面转为灰度并把文本区域缩放到的目标x高度（像素，建议20），只缩小不放大，0表示关闭")
+    parser.add_argument("--shared_pages", action="store_true", help="多进程OCR时通过共享内存传递页面，而不是逐个序列化文本区域")
+    parser.add_argument("--llm_base_url", type=str, default="http://localhost:11434", help="Ollama服务地址")
+    parser.add_argument("--llm_pool_size", type=int, default=10, help="模型服务HTTP连接池大小")
+    parser.add_argument("--llm_max_retries", type=int, default=3, help="模型调用失败时的最大重试次数")
+    parser.add_argument("--llm_deadline", type=float, default=None, help="单次模型调用（含重试）的总时长上限（秒）")
+    parser.add_argument("--llm_cache", type=str, default="llm_cache.sqlite", help="模型响应缓存文件路径，为空则不使用缓存")
+    parser.add_argument("--llm_cache_bypass", action="store_true", help="忽略已有缓存强制重新调用模型（新结果仍写入缓存）")
+    parser.add_argument("--clean_mode", type=str, default="two_pass", choices=["two_pass", "fused", "repair_only", "reconstruct_only"], help="文本清洗模式，fused 将两步清洗合并为一次调用")
+    parser.add_argument("--clean_skip_threshold", type=float, default=None, help="本地质量得分不低于该值的页面跳过LLM清洗（建议 0.75）")
+    parser.add_argument("--grounding_threshold", type=float, default=0.0, help="大于0时丢弃与原文文字相同且溯源得分低于该值的QA对；默认0只检查字段是否完整，得分记录在 QA.parquet")
+    parser.add_argument("--stream_qa", action="store_true", help="流式生成QA对，逐个解析并可提前停止")
+    parser.add_argument("--qa_max_pairs", type=int, default=None, help="流式生成时每页最多的QA对数，达到后停止生成")
+    parser.add_argument("--chunk_qa", action="store_true", help="对整篇清洗后文本按语义与token预算分块生成QA，而不是逐页生成")
+    parser.add_argument("--chunk_tokens", type=int, default=1200, help="分块生成QA时单个文本块的token上限")
+    parser.add_argument("--chunk_overlap", type=int, default=100, help="相邻文本块重叠的token数")
+    parser.add_argument("--from_text", type=str, default=None, choices=["clean", "qa"], help="从输出目录中已有的页面文本继续处理，只运行LLM阶段")
+    parser.add_argument("--dedup", action="store_true", help="每页完成时把QA对增量加入近似去重索引，保存去重后的QA对")
+    parser.add_argument("--dedup_threshold", type=float, default=0.7, help="判为重复的相似度阈值")
+    parser.add_argument("--dedup_index", type=str, default=None, help="去重索引文件，存在时加载并追加，与此前文档重复的QA对不再输出")
+    parser.add_argument("--parquet", action="store_true", help="同时把QA对与来源信息（文档、页码、文本来源、阶段耗时、溯源得分）写入 QA.parquet")
+    parser.add_argument("--no_parquet_grounding", action="store_true", help="写入 QA.parquet 时不计算答案溯源得分")
+    parser.add_argument("--metrics", action="store_true", help="记录各阶段耗时、CPU时间、字节数与模型 token 用量，写入 metrics.json")
+    parser.add_argument("--metrics_port", type=int, default=None, help="在该端口以 Prometheus 文本格式提供 /metrics（隐含 --metrics）")
+    parser.add_argument("--metrics_host", type=str, default="127.0.0.1", help="/metrics 监听的地址，默认只允许本机访问；供其他机器抓取时设为 0.0.0.0")
+    parser.add_argument("--resume", action="store_true", help="跳过检查点中已完成的页面与阶段")
+    parser.add_argument("--pipeline", action="store_true", help="使用多阶段流水线并行处理")
+    parser.add_argument("--vision_executor", type=str, default="process", choices=["process", "thread"], help="版面检测与OCR阶段的执行器类型")
+    parser.add_argument("--detect_workers", type=int, default=1, help="版面检测阶段的worker数")
+    parser.add_argument("--detect_batch", type=int, default=4, help="版面检测每次前向推理的页数，1表示逐页检测")
+    parser.add_argument("--ocr_workers", type=int, default=2, help="OCR阶段的worker数")
+    parser.add_argument("--clean_workers", type=int, default=4, help="文本清洗阶段的并发数")
+    parser.add_argument("--qa_workers", type=int, default=4, help="QA生成阶段的并发数")
     
     args = parser.parse_args()
+    if args.chunk_qa and args.pipeline and not args.from_text:
+        parser.error("--chunk_qa 不能与 --pipeline 同时使用：流水线按页生成QA对")
     
     config = {
-        'gpu': args.gpu
+        'gpu': args.gpu,
+        'dpi': args.dpi,
+        'detect_dpi': args.detect_dpi,
+        'text_layer': not args.no_text_layer,
+        'page_window': args.page_window,
+        'resume': args.resume,
+        'dedup': args.dedup,
+        'dedup_threshold': args.dedup_threshold,
+        'dedup_index': args.dedup_index,
+        'parquet': args.parquet,
+        'parquet_grounding': not args.no_parquet_grounding,
+        'metrics': args.metrics or bool(args.metrics_port),
+        'drop_margins': args.drop_margins,
+        'ocr_processes': args.ocr_processes,
+        'ocr_x_height': args.ocr_x_height,
+        'shared_pages': args.shared_pages,
+        'llm_base_url': args.llm_base_url,
+        'llm_pool_size': args.llm_pool_size,
+        'llm_max_retries': args.llm_max_retries,
+        'llm_deadline': args.llm_deadline,
+        'llm_cache': args.llm_cache,
+        'llm_cache_bypass': args.llm_cache_bypass,
+        'clean_mode': args.clean_mode,
+        'clean_skip_threshold': args.clean_skip_threshold,
+        'grounding_threshold': args.grounding_threshold,
+        'stream_qa': args.stream_qa,
+        'qa_max_pairs': args.qa_max_pairs,
+        'chunk_qa': args.chunk_qa,
+        'chunk_tokens': args.chunk_tokens,
+        'chunk_overlap': args.chunk_overlap,
+        'vision_executor': args.vision_executor,
+        'detect_workers': args.detect_workers,
+        'detect_batch': args.detect_batch,
+        'ocr_workers': args.ocr_workers,
+        'clean_workers': args.clean_workers,
+        'qa_workers': args.qa_workers
     }
     
     processor = PDFQAProcessor(config)
-    qa_pairs = processor.process_pdf(args.pdf_path, args.output_dir)
+    if args.metrics_port:
+        configure(True, args.metrics_port, args.metrics_host)
+    if args.from_text:
+        qa_pairs = processor.process_text_dir(args.output_dir, args.from_text)
+    elif args.pipeline:
+        qa_pairs = processor.process_pdf_pipelined(args.pdf_path, args.output_dir)
+    else:
+        qa_pairs = processor.process_pdf(args.pdf_path, args.output_dir)
     
     print(f"处理完成！共提取 {len(qa_pairs)} 个QA对")
     print(f"结果保存在: {args.output_dir}/QA.txt")
@@ -1,5 +1,273 @@
 import json
 import re
+from operator import length_hint
+
+
+_CLOSERS = {'[': ']', '{': '}'}
+_DECODER = json.JSONDecoder()
+_ESCAPES = {'\n': '\\n', '\r': '\\r', '\t': '\\t'}
+
+
+class JSONStreamExtractor:
+    """
+    单遍、括号感知的 JSON 提取器
+
+    逐字符扫描输入，跳过 JSON 之前的说明文字与代码块标记，找到第一个完整的 JSON 数组或对象。
+    扫描过程中顺带修复模型输出中常见的问题：末尾多余逗号、连续逗号、未加引号的键、
+    单引号字符串、字符串中未转义的换行以及未转义的引号（引号后不是 , : ] } 时视为正文）。
+    输入可以分块调用 feed()，适合消费流式输出；顶层数组中每个元素闭合时立即返回该元素。
+    输出被截断时，close() 返回截断点之前所有完整的元素。
+
+    候选 JSON 无效（或到 close() 时仍未闭合且无法补全）时，从候选开括号的下一个字符重新扫描，
+    以免说明文字中的 {示例} 之类把真正的 JSON 当作自己的值吞掉。重新扫描的区间内开始的候选失败后不再重新扫描，
+    因此每个字符最多处理两次，耗时与输入长度仍是线性关系。已返回过元素的数组候选失败时不重新扫描，
+    从出错的位置继续，已返回的元素不会重复返回；其中已经完整的元素保留下来，之后没有完整的候选时由 close() 返回。
+    顶层数组到 close() 时仍未闭合视为输出被截断，不重新扫描。
+    """
+
+    def __init__(self):
+        self.result = None
+        self.done = False
+        self._salvaged = []
+        self._reset()
+
+    def _reset(self):
+        self._raw = None
+        self._raw_start = 0
+        self._out = []
+        self._stack = []
+        self._items = []
+        self._in_string = False
+        self._quote = None
+        self._escape = False
+        self._bare_key = False
+        self._expect_key = False
+        self._pending_quote = None
+        self._elem_start = None
+
+    def _last_significant(self):
+        out = self._out
+        i = len(out) - 1
+        while i >= 0 and out[i] in ' \t\r\n':
+            i -= 1
+        return i
+
+    def _strip_trailing_comma(self):
+        i = self._last_significant()
+        if i >= 0 and self._out[i] == ',':
+            del self._out[i:]
+
+    def feed(self, chunk: str) -> list:
+        """
+        输入一段文本
+
+        Returns:
+            list: 本次输入中新闭合的顶层数组元素（顶层为对象时，为闭合后的整个对象）
+        """
+        emitted = []
+        if self._raw is not None:
+            self._raw.append(chunk)
+        self._scan(chunk, emitted)
+        return emitted
+
+    def _scan(self, text: str, emitted: list, replay: bool = False):
+        # 只在候选开始与失败时需要位置，由字符串迭代器剩余的长度换算，逐字符循环中不维护下标
+        segments = [(text, iter(text), replay)]
+        while segments and not self.done:
+            text, chars, replay = segments.pop()
+            for ch in chars:
+                if self.done:
+                    break
+                if not self._stack:
+                    if ch in _CLOSERS:
+                        self._reset()
+                        self._open(ch)
+                        if not replay:
+                            self._raw, self._raw_start = [text], len(text) - length_hint(chars)
+                    continue
+                if self._step(ch, emitted) is False:
+                    rescan = self._restart(len(text) - length_hint(chars) - 1)
+                    if rescan:
+                        segments.append((text, chars, replay))
+                        segments.append((rescan, iter(rescan), True))
+                        break
+
+    def _restart(self, end: int) -> str:
+        """
+        丢弃失败的候选，返回需要重新扫描的文本：候选开括号之后、最后一段输入的 end 位置之前
+
+        重新扫描的文本中开始的候选、已返回过元素的候选不重新扫描，返回空字符串，从出错的下一个字符继续
+        （出错的字符总是闭合括号，不可能是新候选的开头）。
+        """
+        rescan = ''
+        if self._raw is not None and not self._items:
+            parts = self._raw
+            parts[-1] = parts[-1][:end]
+            parts[0] = parts[0][self._raw_start:]
+            rescan = ''.join(parts)
+        self._salvaged.extend(self._items)
+        self._reset()
+        return rescan
+
+    def _open(self, ch: str):
+        if len(self._stack) == 1 and self._stack[0] == '[':
+            self._elem_start = len(self._out)
+        self._out.append(ch)
+        self._stack.append(ch)
+        self._expect_key = ch == '{'
+
+    def _step(self, ch: str, emitted: list):
+        """处理候选 JSON 内部的一个字符，候选无效时返回 False"""
+        out = self._out
+
+        if self._bare_key:
+            if ch not in ':,}' and ch not in ' \t\r\n':
+                out.append('\\"' if ch == '"' else ch)
+                return None
+            out.append('"')
+            self._bare_key = False
+            if ch == ':' or ch in ' \t\r\n':
+                out.append(ch)
+                return None
+
+        if self._pending_quote is not None:
+            if ch in ' \t\r\n':
+                out.append(ch)
+                return None
+            pos = self._pending_quote
+            self._pending_quote = None
+            if ch not in ',:]}':
+                out[pos] = '\\"'
+                out[pos + 1:] = [_ESCAPES.get(c, c) for c in out[pos + 1:]]
+                self._in_string = True
+
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+                if ch == "'" and self._quote == "'":
+                    del out[-1]
+                out.append(ch)
+            elif ch == '\\':
+                self._escape = True
+                out.append(ch)
+            elif ch == self._quote:
+                self._in_string = False
+                out.append('"')
+                self._pending_quote = len(out) - 1
+            elif ch == '"':
+                out.append('\\"')
+            elif ch in _ESCAPES:
+                out.append(_ESCAPES[ch])
+            else:
+                out.append(ch)
+            return None
+
+        if ch == '"' or ch == "'":
+            self._in_string = True
+            self._quote = ch
+            self._expect_key = False
+            out.append('"')
+        elif ch in _CLOSERS:
+            self._open(ch)
+        elif ch == ']' or ch == '}':
+            if _CLOSERS[self._stack[-1]] != ch:
+                return False
+            self._strip_trailing_comma()
+            out.append(ch)
+            self._stack.pop()
+            self._expect_key = False
+            return self._closed(emitted)
+        elif ch == ',':
+            i = self._last_significant()
+            if i >= 0 and out[i] in ',[{':
+                return None
+            out.append(ch)
+            self._expect_key = self._stack[-1] == '{'
+        elif ch in ' \t\r\n':
+            out.append(ch)
+        elif self._expect_key and ch != '`':
+            out.append('"')
+            out.append(ch)
+            self._bare_key = True
+            self._expect_key = False
+        else:
+            out.append(ch)
+        return None
+
+    def _closed(self, emitted: list):
+        """处理一个容器闭合：元素完成或整个候选完成"""
+        if len(self._stack) == 1 and self._stack[0] == '[' and self._elem_start is not None:
+            try:
+                item = json.loads(''.join(self._out[self._elem_start:]))
+            except (ValueError, RecursionError):
+                return False
+            self._items.append(item)
+            emitted.append(item)
+            self._elem_start = None
+            return None
+        if self._stack:
+            return None
+
+        try:
+            value = json.loads(''.join(self._out))
+        except (ValueError, RecursionError):
+            return False
+        if isinstance(value, list) and value and not any(isinstance(v, (dict, list)) for v in value):
+            return False
+        self.result = value
+        self.done = True
+        if isinstance(value, dict):
+            emitted.append(value)
+        return None
+
+    def close(self):
+        """
+        结束输入并返回结果
+
+        Returns:
+            完整的 JSON 值；输出被截断时返回截断前已完成的数组元素或补全后的对象；
+            没有完整的候选时返回无效候选中已完成的数组元素；未找到时返回 None
+        """
+        if self.done:
+            return self.result
+        if not self._stack:
+            return list(self._salvaged) if self._salvaged else None
+        if self._stack[0] == '[':
+            return self._salvaged + self._items
+
+        out = list(self._out)
+        if self._in_string or self._bare_key:
+            out.append('"')
+        text = ''.join(out).rstrip()
+        while text and text[-1] in ',:':
+            text = text[:-1].rstrip()
+        text += ''.join(_CLOSERS[c] for c in reversed(self._stack))
+        try:
+            return json.loads(text)
+        except (ValueError, RecursionError):
+            pass
+        rescan = self._restart(len(self._raw[-1]) if self._raw is not None else 0)
+        if rescan:
+            self._scan(rescan, [], replay=True)
+            return self.close()
+        return list(self._salvaged) if self._salvaged else None
+
+
+def extract_json(data_text: str):
+    """返回文本中第一个完整（或可修复）的 JSON 数组/对象，未找到时返回 None"""
+    # 快速路径：第一个 [ 或 { 处本身就是合法 JSON 时直接交给 C 实现的解码器
+    starts = [i for i in (data_text.find('['), data_text.find('{')) if i >= 0]
+    if starts:
+        try:
+            data, _ = _DECODER.raw_decode(data_text, min(starts))
+            if not isinstance(data, list) or not data or any(isinstance(v, (dict, list)) for v in data):
+                return data
+        except (ValueError, RecursionError):
+            pass
+    extractor = JSONStreamExtractor()
+    extractor.feed(data_text)
+    return extractor.close()
+
 
 def extract_qa_pairs(data_text):
     """
@@ -15,53 +283,14 @@ def extract_qa_pairs(data_text):
         print("错误：输入数据为空或不是字符串")
         return []
     
-    # 多种JSON格式匹配模式
-    json_patterns = [
-        r'```json\s*(\[.*?\])\s*```',  # 标准 ```json [...] ```
-        r'```\s*(\[.*?\])\s*```',      # 简写 ``` [...] ```
-        r'(\[.*\])',                    # 直接匹配数组
-        r'(\{.*\})'                     # 直接匹配对象
-    ]
-    
-    json_str = None
-    used_pattern = None
-    
-    # 尝试不同的匹配模式
-    for pattern in json_patterns:
-        match = re.search(pattern, data_text, re.DOTALL)
-        if match:
-            json_str = match.group(1).strip()
-            used_pattern = pattern
-            break
-    
-    if not json_str:
+    data = extract_json(data_text)
+    if data is None:
         print("未找到JSON数据")
         print(f"输入文本前500字符: {data_text[:500]}...")
         return []
     
-    print(f"找到JSON数据，使用模式: {used_pattern}")
-    print(f"JSON字符串长度: {len(json_str)}")
-    
-    try:
-        # 直接解析JSON
-        data = json.loads(json_str)
-        print(f"成功解析JSON，数据类型: {type(data)}")
-        return data
-        
-    except json.JSONDecodeError as e:
-        print(f"JSON解析错误: {e}")
-        print("尝试清理和修复JSON格式...")
-        
-        # 尝试修复常见的JSON格式问题
-        try:
-            fixed_json = clean_json_string(json_str)
-            data = json.loads(fixed_json)
-            print("修复后成功解析JSON")
-            return data
-        except json.JSONDecodeError as e2:
-            print(f"修复后仍然解析失败: {e2}")
-            print(f"有问题的JSON片段: {json_str[:200]}...")
-            return []
+    print(f"成功解析JSON，数据类型: {type(data)}")
+    return data
 
 def clean_json_string(json_str):
     """
@@ -71,33 +300,15 @@ def clean_json_string(json_str):
         json_str (str): 原始JSON字符串
         
     Returns:
-        str: 修复后的JSON字符串
+        str: 修复后的JSON字符串，无法修复时原样返回
     """
     if not json_str:
         return json_str
     
-    # 移除BOM字符和其他不可见字符
-    json_str = json_str.strip().replace('\ufeff', '')
-    
-    # 修复常见的JSON格式问题
-    fixes = [
-        # 修复没有引号的属性名
-        (r'(\s*)(\w+)(\s*):', r'\1"\2"\3:'),
-        # 修复单引号
-        (r"'", '"'),
-        # 修复末尾逗号
-        (r',\s*}', '}'),
-        (r',\s*]', ']'),
-        # 修复多余的逗号
-        (r',,', ','),
-        # 修复没有转义的双引号
-        (r'([^\\])"', r'\1\\"')
-    ]
-    
-    for pattern, replacement in fixes:
-        json_str = re.sub(pattern, replacement, json_str)
-    
-    return json_str
+    data = extract_json(json_str.replace('\ufeff', ''))
+    if data is None:
+        return json_str
+    return json.dumps(data, ensure_ascii=False)
 
 # 可选：增强版本，支持更多格式
 def extract_qa_pairs_enhanced(data_text):
@@ -162,3 +373,8 @@ if __name__ == "__main__":
     
     result = extract_qa_pairs(test_text)
     print(f"提取结果: {result}")
+    
+    # 说明文字中的 {示例} 不能把后面真正的数组当作自己的值吞掉
+    result = extract_qa_pairs('注意 {示例} 如下:\n[{"human":"a","assistant":"b"}]')
+    assert result == [{"human": "a", "assistant": "b"}], result
+    print(f"提取结果: {result}")
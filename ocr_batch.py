@@ -0,0 +1,93 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Sequence, Tuple, Union
+import numpy as np
+from page_buffer import PageBuffer, PageRegions
+
+
+_worker_reader = None
+_worker_pages = {}
+
+
+def _init_ocr_worker(langs: Sequence[str], gpu: bool):
+    """Load one EasyOCR reader per worker process"""
+    import easyocr
+
+    global _worker_reader
+    _worker_reader = easyocr.Reader(list(langs), gpu=gpu)
+
+
+def _ocr_region(box: np.ndarray) -> Tuple[str, Optional[str]]:
+    """Recognize one region in a worker process, returning (text, error)"""
+    try:
+        return ''.join(_worker_reader.readtext(box, detail=0)), None
+    except Exception as e:
+        return '', str(e)
+
+
+def _ocr_shared_region(name: str, shape: Tuple[int, ...], box: List[int],
+                       target_x_height: Optional[float]) -> Tuple[str, Optional[str]]:
+    """Recognize one region of a shared page buffer, attaching to the page on first use"""
+    try:
+        page = _worker_pages.get(name)
+        if page is None:
+            # only the current page stays mapped; its owner unlinks it once the page is done
+            for stale in _worker_pages.values():
+                stale.close()
+            _worker_pages.clear()
+            page = _worker_pages[name] = PageBuffer.attach(name, shape)
+        region = page.region(box, target_x_height)
+    except Exception as e:
+        return '', str(e)
+    return _ocr_region(region)
+
+
+class ParallelOCR:
+    def __init__(self, langs: Sequence[str] = ('ch_sim', 'en'), gpu: bool = False, workers: int = 4):
+        """
+        Spread text-region OCR across a pool of processes
+
+        Each worker runs exactly the same `readtext(box, detail=0)` call as the
+        serial path, so the recognized text is identical; only the scheduling
+        changes.
+
+        Args:
+            langs: EasyOCR language list
+            gpu: Whether the worker readers use the GPU
+            workers: Number of worker processes
+        """
+        self.workers = workers
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_ocr_worker,
+            initargs=(tuple(langs), gpu)
+        )
+
+    def readtext_regions(self, boxes: Union[List[np.ndarray], PageRegions]) -> List[Tuple[str, Optional[str]]]:
+        """
+        Recognize a list of cropped regions
+
+        Regions are submitted largest first so that tall, dense blocks do not
+        end up as the last task on an otherwise idle pool. Results are returned
+        in input order. Regions over a shared-memory page buffer are sent as
+        (page name, box) only; the workers crop and rescale them themselves.
+
+        Args:
+            boxes: Cropped region images, or the regions of one page
+
+        Returns:
+            list: One (text, error) tuple per region; error is None on success
+        """
+        if isinstance(boxes, PageRegions) and boxes.buffer.shared:
+            name, shape = boxes.buffer.descriptor()
+            order = sorted(range(len(boxes)), key=boxes.area, reverse=True)
+            futures = {i: self.executor.submit(_ocr_shared_region, name, shape, boxes.boxes[i], boxes.target_x_height)
+                       for i in order}
+            return [futures[i].result() for i in range(len(boxes))]
+
+        boxes = list(boxes)
+        order = sorted(range(len(boxes)), key=lambda i: boxes[i].shape[0] * boxes[i].shape[1], reverse=True)
+        futures = {i: self.executor.submit(_ocr_region, boxes[i]) for i in order}
+        return [futures[i].result() for i in range(len(boxes))]
+
+    def close(self):
+        self.executor.shutdown(wait=True)
@@ -1,13 +1,45 @@
+import asyncio
 import json
-from typing import List
+import threading
+from typing import Dict, List, Optional
 import requests
+from llm_client import AsyncLLMClient, LLMClient, get_shared_client
+from instrumentation import metrics
+from text_quality import needs_cleaning
 
 
 class TextCleaningEngine:
     
-    def __init__(self, base_url: str = 'http://localhost:11434', model: str = 'qwen2.5:7b'):
+    # 各清洗模式依次执行的步骤（系统提示词）
+    MODES = {
+        'two_pass': ('sentence_repair', 'paragraph_reconstruction'),
+        'fused': ('fused',),
+        'repair_only': ('sentence_repair',),
+        'reconstruct_only': ('paragraph_reconstruction',),
+    }
+    
+    def __init__(self, base_url: str = 'http://localhost:11434', model: str = 'qwen2.5:7b',
+                 client: LLMClient = None, mode: str = 'two_pass', skip_threshold: Optional[float] = None):
+        """
+        文本清洗引擎
+        
+        Args:
+            base_url: Ollama 服务地址
+            model: 模型名称
+            client: 共享的模型客户端
+            mode: 清洗模式，two_pass（先修复句子再重构段落，两次调用）、fused（合并为一次调用）、
+                repair_only、reconstruct_only
+            skip_threshold: 本地质量得分（text_quality.score_text）不低于该值的文本直接跳过清洗，None 表示从不跳过
+        """
+        if mode not in self.MODES:
+            raise ValueError(f"未知的清洗模式: {mode}，可选 {list(self.MODES)}")
         self.base_url = base_url.rstrip('/')
         self.model = model
+        self.client = client or get_shared_client(self.base_url)
+        self.mode = mode
+        self.skip_threshold = skip_threshold
+        self._stats = {'chunks': 0, 'skipped': 0, 'calls': 0}
+        self._stats_lock = threading.Lock()
         self._setup_system_prompts()
     
     def _setup_system_prompts(self) -> None:
@@ -42,13 +74,23 @@ class TextCleaningEngine:
             - 保持原文风格不变
             - 修复并不重写内容
             - 确保技术准确性
+            - 不要添加任何解释或标记""",
+
+                        "fused": """你是一个专业的文本修复与重构专家。请对OCR识别出的文本一次性完成以下处理：
+
+            1. **删除噪声** - 移除无意义的断句、不连续的短句碎片和小标题、干扰符号
+            2. **修复错误** - 修正OCR造成的错字、粘连的单词、错误断行和语法错误
+            3. **重建段落** - 合并语义相关的短句，重建逻辑连接关系，确保文本自然通顺
+            4. **删除背景信息** - 删除与作者信息相关的内容、关键词，以及指南名称、发布机构等背景信息
+            5. **保持原意** - 保留专业术语和关键信息，修复并不重写内容，不改变原文的核心含义
+
+            输出要求：
+            - 直接返回处理后的完整正文文本
             - 不要添加任何解释或标记"""
         }
     
-    def _call_model_api(self, prompt: str, text_chunk: str, system_prompt_key: str) -> str:
-        url = f"{self.base_url}/api/generate"
-        
-        payload = {
+    def _build_payload(self, prompt: str, text_chunk: str, system_prompt_key: str) -> dict:
+        return {
             "model": self.model,
             "prompt": prompt,
             "system": self.cleaning_prompts[system_prompt_key],
@@ -60,17 +102,32 @@ class TextCleaningEngine:
                 "repeat_penalty": 1.2
             }
         }
+    
+    def _call_model_api(self, prompt: str, text_chunk: str, system_prompt_key: str) -> str:
+        payload = self._build_payload(prompt, text_chunk, system_prompt_key)
         
         try:
-            response = requests.post(
-                url,
-                json=payload,
-                headers={"Content-Type": "application/json"},
-                timeout=60
-            )
-            response.raise_for_status()
+            with metrics.span(f"llm.{system_prompt_key}", chars=len(text_chunk)):
+                result = self.client.generate(payload)
+            return result.get('response', '').strip()
             
-            result = response.json()
+        except requests.exceptions.RequestException as e:
+            print(f"API调用失败: {e}")
+            return text_chunk
+        except json.JSONDecodeError as e:
+            print(f"JSON解析失败: {e}")
+            return text_chunk
+        except Exception as e:
+            print(f"未知错误: {e}")
+            return text_chunk
+    
+    async def _acall_model_api(self, prompt: str, text_chunk: str, system_prompt_key: str,
+                               client: AsyncLLMClient) -> str:
+        payload = self._build_payload(prompt, text_chunk, system_prompt_key)
+        
+        try:
+            with metrics.span(f"llm.{system_prompt_key}", chars=len(text_chunk)):
+                result = await client.generate(payload)
             return result.get('response', '').strip()
             
         except requests.exceptions.RequestException as e:
@@ -89,21 +146,74 @@ class TextCleaningEngine:
     def _create_reconstruction_prompt(self, text_chunk: str) -> str:
         return f"需要处理的文本：\n{text_chunk}\n\n请返回重构后的文本："
     
+    def _create_prompt(self, system_prompt_key: str, text_chunk: str) -> str:
+        if system_prompt_key == "paragraph_reconstruction":
+            return self._create_reconstruction_prompt(text_chunk)
+        return self._create_cleaning_prompt(text_chunk)
+    
+    def _plan(self, text_chunk: str) -> tuple:
+        """返回该文本需要执行的清洗步骤，并更新统计；质量足够好的文本返回空元组"""
+        steps = self.MODES[self.mode]
+        if self.skip_threshold is not None and not needs_cleaning(text_chunk, self.skip_threshold):
+            steps = ()
+        with self._stats_lock:
+            self._stats['chunks'] += 1
+            self._stats['skipped'] += not steps
+            self._stats['calls'] += len(steps)
+        return steps
+    
+    def stats(self) -> Dict:
+        """清洗统计：calls_saved 为相对两遍清洗（每块两次调用）节省的模型调用次数"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['calls_saved'] = 2 * stats['chunks'] - stats['calls']
+        return stats
+    
     def clean_text_chunk(self, text_chunk: str) -> str:
         if not text_chunk or not text_chunk.strip():
             return text_chunk
-            
-        cleaning_prompt = self._create_cleaning_prompt(text_chunk)
-        cleaned_text = self._call_model_api(cleaning_prompt, text_chunk, "sentence_repair")
         
-        reconstruction_prompt = self._create_reconstruction_prompt(cleaned_text)
-        final_text = self._call_model_api(reconstruction_prompt, cleaned_text, "paragraph_reconstruction")
+        text = text_chunk
+        for key in self._plan(text_chunk):
+            text = self._call_model_api(self._create_prompt(key, text), text, key)
+        return text
+
+    async def aclean_text_chunk(self, text_chunk: str, client: AsyncLLMClient = None) -> str:
+        if not text_chunk or not text_chunk.strip():
+            return text_chunk
         
-        return final_text
+        if client is None:
+            async with self.client.async_client() as client:
+                return await self.aclean_text_chunk(text_chunk, client)
+        
+        text = text_chunk
+        for key in self._plan(text_chunk):
+            text = await self._acall_model_api(self._create_prompt(key, text), text, key, client)
+        return text
 
     def batch_clean_text(self, text_chunks: List[str]) -> List[str]:
         return [self.clean_text_chunk(chunk) for chunk in text_chunks]
 
+    async def abatch_clean_text(self, text_chunks: List[str], concurrency: int = 4) -> List[str]:
+        """
+        并发清洗多个文本块
+
+        最多同时处理 concurrency 个文本块，结果按输入顺序返回。
+        单个文本块失败时打印错误并返回原文，不影响其余文本块。
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async with self.client.async_client(pool_size=concurrency) as client:
+            async def run(index: int, chunk: str) -> str:
+                async with semaphore:
+                    try:
+                        return await self.aclean_text_chunk(chunk, client)
+                    except Exception as e:
+                        print(f"第 {index} 个文本块清洗失败: {e}")
+                        return chunk
+            
+            return list(await asyncio.gather(*(run(i, chunk) for i, chunk in enumerate(text_chunks))))
+
 
 def main():
     engine = TextCleaningEngine()
@@ -121,6 +231,8 @@ def main():
         
         cleaned_text = engine.clean_text_chunk(text)
         print(f"清洗后: {cleaned_text}")
+    
+    print(f"\n清洗统计: {engine.stats()}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,258 @@
+import time
+from multiprocessing import shared_memory
+from typing import Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+from crop_image import crop_image_numpy
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """Attach to an existing block without registering it with this process's resource tracker"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 has no `track`; the owner still unlinks the block
+        return shared_memory.SharedMemory(name=name)
+
+
+class PageBuffer:
+    def __init__(self, page=None, shared: bool = False, gray: bool = True,
+                 _shm: Optional[shared_memory.SharedMemory] = None, _shape: Optional[Tuple[int, ...]] = None):
+        """
+        A page converted once into a single 8-bit grayscale buffer
+
+        EasyOCR recognizes on grayscale anyway, so keeping one channel instead
+        of three cuts the per-page footprint to a third, and every region is
+        then handed out as a view into this buffer instead of a copy. With
+        `shared=True` the buffer lives in a shared-memory block that OCR
+        worker processes attach to by name, so regions are never pickled.
+
+        Args:
+            page: PIL image or numpy array (H, W) / (H, W, 3) in RGB order
+            shared: Place the buffer in shared memory; the creating buffer
+                owns the block and unlinks it in `close()`
+            gray: Convert to grayscale; False keeps the page's own channels,
+                so regions are exactly the crops of the full RGB page
+        """
+        self._shm = _shm
+        self.owner = False
+        if _shm is not None:
+            self.array = np.ndarray(_shape, dtype=np.uint8, buffer=_shm.buf)
+            return
+
+        image = to_gray(page) if gray else np.ascontiguousarray(page, dtype=np.uint8)
+        if not shared:
+            self.array = image
+            return
+        self._shm = shared_memory.SharedMemory(create=True, size=max(image.nbytes, 1))
+        self.owner = True
+        self.array = np.ndarray(image.shape, dtype=np.uint8, buffer=self._shm.buf)
+        self.array[:] = image
+
+    @classmethod
+    def attach(cls, name: str, shape: Tuple[int, ...]) -> "PageBuffer":
+        """Open a shared buffer created in another process (read-only use)"""
+        return cls(_shm=_attach(name), _shape=tuple(shape))
+
+    @property
+    def shared(self) -> bool:
+        return self._shm is not None
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self.array.shape
+
+    @property
+    def nbytes(self) -> int:
+        return self.array.nbytes
+
+    def descriptor(self) -> Tuple[str, Tuple[int, ...]]:
+        """(shared-memory name, shape) for `PageBuffer.attach` in another process"""
+        if self._shm is None:
+            raise ValueError("PageBuffer is not in shared memory")
+        return self._shm.name, self.array.shape
+
+    def crop(self, box: Sequence[int]) -> np.ndarray:
+        """Zero-copy view of a [left, top, right, bottom] region"""
+        return crop_image_numpy(self.array, [int(v) for v in box])
+
+    def region(self, box: Sequence[int], target_x_height: Optional[float] = None) -> np.ndarray:
+        """Region ready for recognition: a view, or a downscaled copy when its text is larger than needed"""
+        return prepare_region(self.crop(box), target_x_height)
+
+    def close(self):
+        """Release the buffer; the owner of a shared block also unlinks it"""
+        if self._shm is None:
+            return
+        self.array = None
+        self._shm.close()
+        if self.owner:
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
+        self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class PageRegions:
+    def __init__(self, buffer: PageBuffer, boxes: List[List[int]], target_x_height: Optional[float] = None):
+        """
+        The text regions of one page, in reading order, over a shared page buffer
+
+        Iterating yields regions prepared for recognition one at a time, so at
+        most one rescaled region exists besides the page buffer. When the
+        object is pickled to another process (the process-based pipeline
+        stages) only the prepared regions are sent, never the whole page, and
+        it arrives as a plain list of arrays.
+
+        Args:
+            buffer: Page buffer the boxes refer to
+            boxes: Boxes in [left, top, right, bottom] format, in reading order
+            target_x_height: Text x-height in pixels to rescale regions to, None keeps full resolution
+        """
+        self.buffer = buffer
+        self.boxes = boxes
+        self.target_x_height = target_x_height
+
+    def __len__(self) -> int:
+        return len(self.boxes)
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        for box in self.boxes:
+            yield self.buffer.region(box, self.target_x_height)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return PageRegions(self.buffer, self.boxes[index], self.target_x_height)
+        return self.buffer.region(self.boxes[index], self.target_x_height)
+
+    def area(self, index: int) -> int:
+        l, t, r, b = self.boxes[index]
+        return max(r - l, 0) * max(b - t, 0)
+
+    def __reduce__(self):
+        return list, (list(self),)
+
+    def close(self):
+        self.buffer.close()
+
+
+def to_gray(page) -> np.ndarray:
+    """Convert a PIL image or RGB/gray numpy array to a contiguous uint8 (H, W) array"""
+    if hasattr(page, 'convert'):
+        return np.asarray(page if page.mode == 'L' else page.convert('L'))
+    image = np.asarray(page)
+    if image.ndim == 2:
+        return np.ascontiguousarray(image, dtype=np.uint8)
+    # ITU-R 601 luma, the same weights PIL uses for convert('L')
+    weights = np.array([299, 587, 114], dtype=np.uint32)
+    return ((image[..., :3] @ weights + 500) // 1000).astype(np.uint8)
+
+
+def estimate_x_height(gray: np.ndarray, min_rows: int = 3) -> Optional[float]:
+    """
+    Estimate the x-height of the text in a grayscale region
+
+    Ink pixels are those darker than the midpoint between the paper and ink
+    levels, measured on a column subsample. Each run of rows containing ink is a text line; within a line the
+    x-height band is where row ink density is at least half of its peak,
+    which excludes the sparse ascender and descender rows.
+
+    Returns:
+        float: Median x-height in pixels over all lines, None when no text line is found
+    """
+    if gray.size == 0:
+        return None
+    # row profiles only need a few hundred columns; a strided view keeps this cheap on wide regions
+    sample = gray[:, ::max(1, gray.shape[1] // 256)]
+    lo, hi = np.percentile(sample[::4], (2, 98))
+    if hi - lo < 32:
+        return None
+    density = (sample < (lo + hi) / 2).sum(axis=1)
+    rows = density > max(1, sample.shape[1] // 200)
+
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], rows.view(np.int8), [0]))))
+    heights = []
+    for start, stop in zip(edges[::2], edges[1::2]):
+        if stop - start < min_rows:
+            continue
+        line = density[start:stop]
+        heights.append(int((line >= line.max() / 2).sum()))
+    if not heights:
+        return None
+    return float(np.median(heights))
+
+
+def prepare_region(region: np.ndarray, target_x_height: Optional[float] = None,
+                   min_scale: float = 0.4, max_scale: float = 1.0) -> np.ndarray:
+    """
+    Rescale a region so that its text has roughly `target_x_height` pixels
+
+    Recognition accuracy stops improving once the x-height is around 20
+    pixels, while detection and recognition cost grow with the pixel count,
+    so regions with larger text (titles, or any text at high DPI) are
+    downscaled. By default regions are never upscaled.
+
+    Returns:
+        np.ndarray: The region itself (a view) when no rescaling applies, otherwise a resized copy
+    """
+    if not target_x_height:
+        return region
+    x_height = estimate_x_height(region)
+    if not x_height:
+        return region
+    scale = min(max(target_x_height / x_height, min_scale), max_scale)
+    if 0.95 < scale < 1.05:
+        return region
+    height, width = region.shape[:2]
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    import cv2
+    return cv2.resize(region, size, interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC)
+
+
+def test_page_buffer():
+    rng = np.random.RandomState(0)
+    page = np.full((3508, 2480, 3), 255, dtype=np.uint8)
+    for top in range(300, 3300, 60):
+        # lines of "text": a dense 20 px x-height band with sparse ascenders above it
+        page[top + 10:top + 30, 200:2280] = np.where(rng.rand(20, 2080, 1) < 0.5, 0, 255)
+        page[top:top + 10, 200:2280:7] = 0
+
+    buffer = PageBuffer(page)
+    assert buffer.shape == page.shape[:2] and buffer.nbytes * 3 == page.nbytes
+    view = buffer.crop([200, 300, 2280, 900])
+    assert np.shares_memory(view, buffer.array), "crop must not copy"
+    print(f"✓ 灰度页面 {buffer.nbytes / 2 ** 20:.1f} MiB（RGB {page.nbytes / 2 ** 20:.1f} MiB），裁剪为零拷贝视图")
+
+    x_height = estimate_x_height(view)
+    assert x_height == 20, x_height
+    assert prepare_region(view, 20) is view and prepare_region(view, 24) is view
+    print(f"✓ x-height 估计 {x_height:.0f} px")
+
+    with PageBuffer(page, shared=True) as shared:
+        name, shape = shared.descriptor()
+        other = PageBuffer.attach(name, shape)
+        assert np.array_equal(other.crop([200, 300, 2280, 900]), view)
+        other.close()
+    print("✓ 共享内存页面可按名称附加")
+
+    regions = PageRegions(buffer, [[200, 300, 2280, 900], [200, 900, 2280, 1500]])
+    import pickle
+    restored = pickle.loads(pickle.dumps(regions))
+    assert isinstance(restored, list) and all(np.array_equal(a, b) for a, b in zip(restored, regions))
+    print("✓ 跨进程时只传输裁剪后的区域")
+
+    runs = 100
+    start = time.perf_counter()
+    for _ in range(runs):
+        estimate_x_height(view)
+    print(f"x-height 估计耗时 {(time.perf_counter() - start) / runs * 1e3:.2f} ms/区域 ({view.shape[1]}x{view.shape[0]})")
+
+
+if __name__ == "__main__":
+    test_page_buffer()
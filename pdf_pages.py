@@ -0,0 +1,155 @@
+from typing import Iterable, Iterator, List, Sequence, Tuple, Optional
+import numpy as np
+from pdf2image import convert_from_path, pdfinfo_from_path
+
+
+def get_page_count(pdf_path: str) -> int:
+    """
+    Return the number of pages in a PDF without rasterizing it
+
+    Args:
+        pdf_path: Path to the PDF file
+
+    Returns:
+        int: Page count
+    """
+    info = pdfinfo_from_path(pdf_path)
+    return int(info["Pages"])
+
+
+def iter_pdf_pages(pdf_path: str, dpi: int = 300, window: int = 4,
+                   first_page: int = 1, last_page: Optional[int] = None) -> Iterator[Tuple[int, object]]:
+    """
+    Lazily render PDF pages in bounded windows
+
+    Only `window` pages are rendered at a time and the generator drops its own
+    reference to each page once yielded, so a page is freed as soon as the
+    consumer releases it. Peak memory does not grow with the page count and the
+    first page is available as soon as its window has been rendered.
+
+    Args:
+        pdf_path: Path to the PDF file
+        dpi: Render resolution
+        window: Number of pages rendered per pdftoppm call
+        first_page: First page to render (1-based, inclusive)
+        last_page: Last page to render (1-based, inclusive), defaults to the last page
+
+    Yields:
+        Tuple[int, PIL.Image.Image]: 0-based page index and the rendered page
+    """
+    if last_page is None:
+        last_page = get_page_count(pdf_path)
+    window = max(1, window)
+
+    for start in range(first_page, last_page + 1, window):
+        end = min(start + window - 1, last_page)
+        pages = convert_from_path(pdf_path, dpi, first_page=start, last_page=end)
+        for offset in range(len(pages)):
+            page = pages[offset]
+            pages[offset] = None
+            yield start + offset - 1, page
+            del page
+        del pages
+
+
+def _contiguous_runs(page_nums: List[int]) -> List[Tuple[int, int]]:
+    runs = []
+    for n in page_nums:
+        if runs and n == runs[-1][1] + 1:
+            runs[-1] = (runs[-1][0], n)
+        else:
+            runs.append((n, n))
+    return runs
+
+
+def iter_selected_pages(pdf_path: str, page_nums: Iterable[int], dpi: int = 300,
+                        window: int = 4) -> Iterator[Tuple[int, object]]:
+    """
+    Lazily render only the given pages, in ascending order
+
+    Consecutive page numbers are grouped so that each pdftoppm call still
+    renders up to `window` pages.
+
+    Args:
+        pdf_path: Path to the PDF file
+        page_nums: 0-based page indices to render
+        dpi: Render resolution
+        window: Number of pages rendered per pdftoppm call
+
+    Yields:
+        Tuple[int, PIL.Image.Image]: 0-based page index and the rendered page
+    """
+    for first, last in _contiguous_runs(sorted(set(page_nums))):
+        yield from iter_pdf_pages(pdf_path, dpi, window, first_page=first + 1, last_page=last + 1)
+
+
+def pymupdf_available() -> bool:
+    """Whether PyMuPDF is installed, which in-process and region rendering need"""
+    try:
+        import pymupdf  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def iter_rendered_pages(pdf_path: str, page_nums: Iterable[int], dpi: int = 150) -> Iterator[Tuple[int, object]]:
+    """
+    Render the given pages in-process with PyMuPDF, in ascending order
+
+    Pages are rendered one at a time from a single open document, without
+    the temporary image files pdftoppm goes through, and in the same page
+    coordinates as `render_page_region`.
+
+    Args:
+        pdf_path: Path to the PDF file
+        page_nums: 0-based page indices to render
+        dpi: Render resolution
+
+    Yields:
+        Tuple[int, PIL.Image.Image]: 0-based page index and the rendered RGB page
+    """
+    import pymupdf
+    from PIL import Image
+
+    with pymupdf.open(pdf_path) as doc:
+        for page_num in sorted(set(page_nums)):
+            pix = doc[page_num].get_pixmap(dpi=dpi, alpha=False)
+            yield page_num, Image.frombuffer("RGB", (pix.width, pix.height), pix.samples, "raw", "RGB", pix.stride, 1)
+            del pix
+
+
+def render_page_region(pdf_path: str, page_index: int, box: Sequence[float], box_dpi: float,
+                       dpi: int = 300, gray: bool = True) -> Tuple[np.ndarray, Tuple[int, int]]:
+    """
+    Render one rectangle of a page at `dpi`
+
+    Used to render only the part of a page covered by text regions at OCR
+    resolution after layout detection ran on a low-resolution render, so a
+    full high-resolution page is never allocated.
+
+    Args:
+        pdf_path: Path to the PDF file
+        page_index: 0-based page index
+        box: Rectangle in [left, top, right, bottom] pixel coordinates at `box_dpi`
+        box_dpi: Resolution the rectangle was measured at
+        dpi: Resolution to render at
+        gray: Render a single grayscale channel; False renders RGB
+
+    Returns:
+        Tuple[np.ndarray, Tuple[int, int]]: uint8 (H, W) or (H, W, 3) array of
+        the rectangle clipped to the page, and the (x, y) pixel position of
+        its top-left corner on the page at `dpi`
+    """
+    import pymupdf
+
+    to_points = 72 / box_dpi
+    with pymupdf.open(pdf_path) as doc:
+        page = doc[page_index]
+        clip = pymupdf.Rect(*(v * to_points for v in box)) & page.rect
+        pix = page.get_pixmap(matrix=pymupdf.Matrix(dpi / 72, dpi / 72),
+                              colorspace=pymupdf.csGRAY if gray else pymupdf.csRGB, alpha=False, clip=clip)
+    samples = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.stride)
+    samples = samples[:, :pix.width * pix.n]
+    if pix.n > 1:
+        samples = samples.reshape(pix.height, pix.width, pix.n)
+    return samples, (pix.x, pix.y)
@@ -0,0 +1,237 @@
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Tuple
+
+
+_END = object()
+
+
+class StageFailure:
+    """某个阶段处理失败的占位结果，沿流水线向下游传递"""
+
+    def __init__(self, stage: str, seq: int, error: BaseException):
+        self.stage = stage
+        self.seq = seq
+        self.error = error
+
+    def __repr__(self):
+        return f"StageFailure(stage={self.stage!r}, seq={self.seq}, error={self.error!r})"
+
+
+class Stage:
+    """
+    流水线中的一个阶段
+
+    Args:
+        name: 阶段名称
+        func: 处理函数，接收上一阶段的输出并返回本阶段的输出。
+              executor 为 'process' 时必须可被 pickle（模块级函数或 functools.partial）
+        workers: 并发 worker 数量
+        executor: 'thread'（适合 HTTP 等 IO 密集阶段）或 'process'（适合 CPU 密集阶段）
+        initializer: 进程池 worker 的初始化函数，用于在每个进程中加载一次模型
+        initargs: initializer 的参数
+        batch_size: 大于1时，把输入队列中已就绪的至多 batch_size 个条目作为列表一次交给 func，
+              func 返回等长的结果列表，其中的异常实例表示对应条目失败。不会为凑满一批而等待
+    """
+
+    def __init__(self, name: str, func: Callable[[Any], Any], workers: int = 1,
+                 executor: str = 'thread', initializer: Optional[Callable] = None,
+                 initargs: Tuple = (), batch_size: int = 1):
+        if executor not in ('thread', 'process'):
+            raise ValueError(f"未知的执行器类型: {executor}")
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.executor = executor
+        self.initializer = initializer
+        self.initargs = initargs
+        self.batch_size = max(1, batch_size)
+
+    def create_executor(self):
+        if self.executor == 'process':
+            return ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=self.initializer,
+                initargs=self.initargs
+            )
+        return ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"stage-{self.name}")
+
+
+class StagedPipeline:
+    """
+    多阶段流水线执行引擎
+
+    每个阶段拥有独立的 worker 池，阶段之间通过有界队列连接，因此各阶段可以
+    同时处理不同的条目，整体吞吐量趋近于最慢阶段的速度而不是所有阶段之和。
+    每个阶段按提交顺序收集结果，最终输出顺序与输入顺序一致。
+    """
+
+    def __init__(self, stages: List[Stage], queue_size: int = 4):
+        if not stages:
+            raise ValueError("流水线至少需要一个阶段")
+        self.stages = stages
+        self.queue_size = max(1, queue_size)
+        self._stop = threading.Event()
+
+    def _put(self, q: queue.Queue, item: Any) -> bool:
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q: queue.Queue) -> Any:
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _END
+
+    def _feed(self, items: Iterable, q_out: queue.Queue, errors: list):
+        try:
+            for seq, item in enumerate(items):
+                if not self._put(q_out, (seq, item)):
+                    return
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            self._put(q_out, _END)
+
+    def _dispatch(self, stage: Stage, executor, q_in: queue.Queue, pending: queue.Queue):
+        if stage.batch_size > 1:
+            return self._dispatch_batches(stage, executor, q_in, pending)
+        while True:
+            entry = self._get(q_in)
+            if entry is _END:
+                self._put(pending, _END)
+                return
+            seq, payload = entry
+            if isinstance(payload, StageFailure):
+                future = Future()
+                future.set_result(payload)
+            else:
+                try:
+                    future = executor.submit(stage.func, payload)
+                except Exception as e:
+                    future = Future()
+                    future.set_result(StageFailure(stage.name, seq, e))
+            if not self._put(pending, (seq, future)):
+                return
+
+    def _dispatch_batches(self, stage: Stage, executor, q_in: queue.Queue, pending: queue.Queue):
+        """批处理阶段：取出已就绪的条目组成一批提交，上游的失败条目原样跟随在批中"""
+        end = False
+        while not end:
+            entry = self._get(q_in)
+            if entry is _END:
+                break
+            batch = [entry]
+            while len(batch) < stage.batch_size:
+                try:
+                    entry = q_in.get_nowait()
+                except queue.Empty:
+                    break
+                if entry is _END:
+                    end = True
+                    break
+                batch.append(entry)
+            payloads = [payload for _, payload in batch if not isinstance(payload, StageFailure)]
+            if payloads:
+                try:
+                    future = executor.submit(stage.func, payloads)
+                except Exception as e:
+                    future = Future()
+                    future.set_exception(e)
+            else:
+                future = Future()
+                future.set_result([])
+            if not self._put(pending, (batch, future)):
+                return
+        self._put(pending, _END)
+
+    def _collect(self, stage: Stage, pending: queue.Queue, q_out: queue.Queue):
+        while True:
+            entry = self._get(pending)
+            if entry is _END:
+                self._put(q_out, _END)
+                return
+            seq, future = entry
+            if isinstance(seq, list):
+                if not self._collect_batch(stage, seq, future, q_out):
+                    return
+                continue
+            try:
+                result = future.result()
+            except BaseException as e:
+                result = StageFailure(stage.name, seq, e)
+            if not self._put(q_out, (seq, result)):
+                return
+
+    def _collect_batch(self, stage: Stage, batch: list, future: Future, q_out: queue.Queue) -> bool:
+        """按输入顺序展开一批的结果"""
+        try:
+            results = iter(future.result())
+            error = None
+        except BaseException as e:
+            error = e
+        for seq, payload in batch:
+            if isinstance(payload, StageFailure):
+                result = payload
+            elif error is not None:
+                result = StageFailure(stage.name, seq, error)
+            else:
+                result = next(results)
+                if isinstance(result, BaseException):
+                    result = StageFailure(stage.name, seq, result)
+            if not self._put(q_out, (seq, result)):
+                return False
+        return True
+
+    def run(self, items: Iterable) -> Iterator[Tuple[int, Any]]:
+        """
+        运行流水线
+
+        Args:
+            items: 输入条目，按需惰性读取
+
+        Yields:
+            Tuple[int, Any]: 输入序号与最后一个阶段的输出；失败的条目输出 StageFailure
+        """
+        self._stop.clear()
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        feed_errors = []
+        threads = [threading.Thread(target=self._feed, args=(items, queues[0], feed_errors), daemon=True)]
+        executors = []
+
+        for i, stage in enumerate(self.stages):
+            executor = stage.create_executor()
+            executors.append(executor)
+            pending = queue.Queue(maxsize=stage.workers * 2)
+            threads.append(threading.Thread(
+                target=self._dispatch, args=(stage, executor, queues[i], pending), daemon=True
+            ))
+            threads.append(threading.Thread(
+                target=self._collect, args=(stage, pending, queues[i + 1]), daemon=True
+            ))
+
+        for t in threads:
+            t.start()
+
+        try:
+            while True:
+                entry = self._get(queues[-1])
+                if entry is _END:
+                    break
+                yield entry
+            if feed_errors:
+                raise feed_errors[0]
+        finally:
+            self._stop.set()
+            for t in threads:
+                t.join()
+            for executor in executors:
+                executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,243 @@
+import re
+import json
+import math
+import time
+import argparse
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+
+FORBIDDEN_REFERENCES = ("本指南", "本文")
+RULES = ("empty", "forbidden_reference", "short_answer", "restates_question", "duplicate")
+POLARITY_TERMS = ("不", "否", "是", "推荐")
+_YES_NO = re.compile("是否|是不是|能否|可否|有没有|吗")
+
+_IGNORABLE = None
+_IGNORABLE_MAP = None
+
+
+def _ignorable_table() -> np.ndarray:
+    """BMP 内的空白、标点与符号字符查找表，首次使用时构建"""
+    global _IGNORABLE
+    if _IGNORABLE is None:
+        table = np.zeros(0x10000, dtype=bool)
+        for cp in range(0x10000):
+            category = unicodedata.category(chr(cp))
+            table[cp] = category[0] in "PZSC"
+        _IGNORABLE = table
+    return _IGNORABLE
+
+
+def _codepoints(texts: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    把一批文本拼接为一个码位数组，并给出每个码位所属的文本编号
+
+    去掉空白、标点与符号，ASCII 大写字母转为小写，之后的特征都在这个数组上向量化计算。
+    """
+    lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+    cp = np.frombuffer("".join(texts).encode("utf-32-le"), dtype=np.uint32)
+    seg = np.repeat(np.arange(len(texts), dtype=np.int64), lengths)
+    keep = cp >= 0x10000
+    keep[~keep] = ~_ignorable_table()[cp[~keep]]
+    cp, seg = cp[keep], seg[keep]
+    upper = (cp >= 65) & (cp <= 90)
+    cp = np.where(upper, cp + 32, cp)
+    return cp, seg
+
+
+def _bigram_keys(cp: np.ndarray, seg: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """同一文本内相邻码位组成的二元组，编码为 (文本编号, 二元组) 的 64 位整数键"""
+    same = seg[1:] == seg[:-1]
+    first, second, owner = cp[:-1][same], cp[1:][same], seg[:-1][same]
+    keys = (owner.astype(np.uint64) << np.uint64(42)) | (first.astype(np.uint64) << np.uint64(21)) | second.astype(np.uint64)
+    return keys, owner
+
+
+def answers_yes_no(question: str, answer: str) -> bool:
+    """
+    答案是否对问题给出了肯定或否定的判断
+
+    是非问题（是否、能否、……吗）的答案即使几乎照抄问题（“是否推荐使用X？”答“不推荐使用X。”），
+    只要答案本身不是问句就是完整的回答；其他问题的答案比问题多出“不”“否”“是”“推荐”等判断词时同样如此。
+    """
+    if _YES_NO.search(question) and not _YES_NO.search(answer):
+        return True
+    return any(answer.count(term) > question.count(term) for term in POLARITY_TERMS)
+
+
+class PreFilter:
+
+    def __init__(self, min_answer_chars: int = 4, restate_threshold: float = 0.9, min_novel_bigrams: int = 2,
+                 forbidden: Iterable[str] = FORBIDDEN_REFERENCES):
+        """
+        在模型质量检查之前运行的本地规则过滤
+
+        对一批问答对一次性计算向量化特征，按规则级联判定（每个问答对只记在第一条命中的规则下）：
+            empty: 问题或答案去掉空白与标点后为空
+            forbidden_reference: 问题或答案出现“本指南”“本文”等 qa_create 提示词禁止的指代
+            short_answer: 答案有效字符数少于 min_answer_chars
+            restates_question: 答案的字符二元组有 restate_threshold 以上出现在问题中，
+                且不在问题里的二元组少于 min_novel_bigrams 个（答案只是重复问题）；
+                对问题给出肯定或否定判断的答案不算（见 answers_yes_no）
+            duplicate: 与之前出现过的问答对（去掉空白、标点与符号后）完全相同
+        未命中任何规则的问答对交给模型判断。
+
+        Args:
+            min_answer_chars: 答案最少有效字符数
+            restate_threshold: 判为重复问题的答案二元组覆盖率
+            min_novel_bigrams: 答案中至少应有的新二元组数
+            forbidden: 禁止出现的指代词
+        """
+        self.min_answer_chars = min_answer_chars
+        self.restate_threshold = restate_threshold
+        self.min_novel_bigrams = min_novel_bigrams
+        self._forbidden = re.compile("|".join(map(re.escape, forbidden)))
+        self._seen = set()
+        self.counts = {rule: 0 for rule in RULES}
+        self.total = 0
+
+    def features(self, pairs: List[Dict]) -> Dict[str, np.ndarray]:
+        """
+        计算一批问答对的特征
+
+        Returns:
+            Dict[str, np.ndarray]: question_chars、answer_chars（有效字符数）、forbidden（是否含禁用指代）、
+            containment（答案二元组出现在问题中的比例）、novel_bigrams（答案中不在问题里的二元组数）
+        """
+        n = len(pairs)
+        questions = [str(p.get("human") or "") for p in pairs]
+        answers = [str(p.get("assistant") or "") for p in pairs]
+
+        q_cp, q_seg = _codepoints(questions)
+        a_cp, a_seg = _codepoints(answers)
+        question_chars = np.bincount(q_seg, minlength=n)
+        answer_chars = np.bincount(a_seg, minlength=n)
+
+        q_keys, _ = _bigram_keys(q_cp, q_seg)
+        a_keys, a_owner = _bigram_keys(a_cp, a_seg)
+        a_keys, first = np.unique(a_keys, return_index=True)
+        a_owner = a_owner[first]
+        found = np.isin(a_keys, q_keys)
+        answer_bigrams = np.bincount(a_owner, minlength=n)
+        shared = np.bincount(a_owner, weights=found, minlength=n)
+        containment = np.divide(shared, answer_bigrams, out=np.zeros(n), where=answer_bigrams > 0)
+
+        # 禁用指代：在拼接文本上做一次正则扫描，再按偏移映射回问答对
+        joined = "\n".join(q + "\n" + a for q, a in zip(questions, answers))
+        ends = np.cumsum([len(q) + len(a) + 2 for q, a in zip(questions, answers)])
+        forbidden = np.zeros(n, dtype=bool)
+        hits = [m.start() for m in self._forbidden.finditer(joined)]
+        if hits:
+            forbidden[np.searchsorted(ends, hits, side="right")] = True
+
+        return {
+            "question_chars": question_chars,
+            "answer_chars": answer_chars,
+            "forbidden": forbidden,
+            "containment": containment,
+            "novel_bigrams": answer_bigrams - shared.astype(np.int64),
+        }
+
+    def apply(self, pairs: List[Dict]) -> List[Optional[str]]:
+        """
+        对一批问答对应用规则级联
+
+        Returns:
+            List[Optional[str]]: 每个问答对命中的第一条规则名，None 表示需要交给模型判断
+        """
+        if not pairs:
+            return []
+        f = self.features(pairs)
+        masks = {
+            "empty": (f["question_chars"] == 0) | (f["answer_chars"] == 0),
+            "forbidden_reference": f["forbidden"],
+            "short_answer": f["answer_chars"] < self.min_answer_chars,
+            "restates_question": (f["containment"] >= self.restate_threshold)
+                                 & (f["novel_bigrams"] < self.min_novel_bigrams),
+        }
+        # 只有少数问答对命中，逐个排除是非问题的完整答案，本地规则只过滤没有歧义的情况
+        restates = masks["restates_question"]
+        for i in np.flatnonzero(restates).tolist():
+            if answers_yes_no(str(pairs[i].get("human") or ""), str(pairs[i].get("assistant") or "")):
+                restates[i] = False
+        rule_index = np.full(len(pairs), -1, dtype=np.int64)
+        for i, rule in reversed(list(enumerate(RULES[:4]))):
+            rule_index[masks[rule]] = i
+
+        verdicts: List[Optional[str]] = []
+        for pair, index in zip(pairs, rule_index.tolist()):
+            if index < 0:
+                key = (normalize_key(pair.get("human")), normalize_key(pair.get("assistant")))
+                if key in self._seen:
+                    index = RULES.index("duplicate")
+                else:
+                    self._seen.add(key)
+            verdicts.append(RULES[index] if index >= 0 else None)
+            if index >= 0:
+                self.counts[RULES[index]] += 1
+        self.total += len(pairs)
+        return verdicts
+
+    def remember(self, pairs: List[Dict]):
+        """把已经过滤过的问答对计入重复检查，不计入统计；续跑时用中断前读过的输入重建"""
+        counts, total = dict(self.counts), self.total
+        self.apply(pairs)
+        self.counts, self.total = counts, total
+
+    def stats(self) -> Dict[str, float]:
+        rejected = sum(self.counts.values())
+        return {
+            "total": self.total,
+            "rejected": rejected,
+            "rejected_ratio": rejected / self.total if self.total else 0.0,
+            **self.counts,
+        }
+
+
+def normalize_key(text) -> str:
+    """去重用的键：去掉空白、标点与符号（与特征计算忽略的字符相同）"""
+    global _IGNORABLE_MAP
+    if _IGNORABLE_MAP is None:
+        _IGNORABLE_MAP = dict.fromkeys(np.flatnonzero(_ignorable_table()).tolist())
+    return str(text or "").translate(_IGNORABLE_MAP)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="统计本地规则过滤在问答对数据集上的效果")
+    parser.add_argument("--data", type=str, default="medical_qa.json", help="JSON Lines 格式的问答对文件")
+    parser.add_argument("--batch_size", type=int, default=8, help="模型检查时每次调用评估的问答对数量")
+    parser.add_argument("--min_answer_chars", type=int, default=4, help="答案最少有效字符数")
+    parser.add_argument("--show", type=int, default=3, help="每条规则展示的样例数")
+    args = parser.parse_args()
+
+    with open(args.data, "r", encoding="utf-8") as f:
+        pairs = [json.loads(line) for line in f if line.strip()]
+
+    prefilter = PreFilter(min_answer_chars=args.min_answer_chars)
+    start = time.perf_counter()
+    verdicts = prefilter.apply(pairs)
+    elapsed = time.perf_counter() - start
+
+    stats = prefilter.stats()
+    remaining = stats["total"] - stats["rejected"]
+    calls_before = math.ceil(stats["total"] / args.batch_size)
+    calls_after = math.ceil(remaining / args.batch_size)
+    print(f"{stats['total']} 个问答对，过滤耗时 {elapsed * 1000:.0f} ms（{stats['total'] / elapsed:,.0f} 对/秒）")
+    for rule in RULES:
+        print(f"  {rule}: {stats[rule]}")
+        examples = [p for p, v in zip(pairs, verdicts) if v == rule][:args.show]
+        for pair in examples:
+            print(f"      Q: {pair.get('human', '')[:60]}  A: {pair.get('assistant', '')[:60]}")
+    print(f"规则过滤 {stats['rejected']} 个（{stats['rejected_ratio']:.1%}），剩余 {remaining} 个交给模型；"
+          f"每次评估 {args.batch_size} 个时模型调用 {calls_before} -> {calls_after} 次，"
+          f"减少 {1 - calls_after / calls_before if calls_before else 0:.1%}")
+
+
+if __name__ == "__main__":
+    # 是非问题的完整答案虽然几乎照抄问题，也不能被当作重复问题过滤
+    assert PreFilter().apply([{"human": "在没有高血压的情况下是否推荐使用ACEI/ARB和β受体阻滞剂？",
+                               "assistant": "不推荐使用ACEI/ARB和β受体阻滞剂。"},
+                              {"human": "是否推荐使用β受体阻滞剂？", "assistant": "是否推荐使用β受体阻滞剂"}]) \
+        == [None, "restates_question"]
+    main()
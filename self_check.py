@@ -1,21 +1,31 @@
+import os
+import ast
 import json
-from typing import List
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
 import requests
+from llm_client import LLMClient, get_shared_client
+from match import extract_json
+from checkpoint import atomic_write_json
+from prefilter import PreFilter, RULES
 
 
 class TextCheckEngine:
-    
-    def __init__(self, base_url: str = 'http://localhost:11434', model: str = 'qwen2.5:7b'):
+
+    def __init__(self, base_url: str = 'http://localhost:11434', model: str = 'qwen2.5:7b',
+                 client: LLMClient = None):
         self.base_url = base_url.rstrip('/')
         self.model = model
+        self.client = client or get_shared_client(self.base_url)
+        self.calls = 0
+        self._calls_lock = threading.Lock()
         self._setup_system_prompts()
-    
-    def _setup_system_prompts(self) -> None:
-        self.cleaning_prompts = {
-            "qa_check": """ 角色设定
-            你是一个专业的医疗内容质量评估专家，擅长识别和过滤低质量的医疗问答内容。
 
-            评估标准
+    def _setup_system_prompts(self) -> None:
+        criteria = """评估标准
             必须去除的情况（出现任一即去除）：
             答案为空 - 助理回复为空字符串或null
 
@@ -35,7 +45,12 @@ class TextCheckEngine:
             问答高度相关，直接解决问题
 
             内容具有临床实用性
+"""
+        self.cleaning_prompts = {
+            "qa_check": f""" 角色设定
+            你是一个专业的医疗内容质量评估专家，擅长识别和过滤低质量的医疗问答内容。
 
+            {criteria}
             处理流程
             逐一分析每个问答对
 
@@ -52,12 +67,28 @@ class TextCheckEngine:
 
             不包含任何评估过程说明
 
-            不保留被去除的问答对 """
+            不保留被去除的问答对 """,
+            "qa_check_batch": f""" 角色设定
+            你是一个专业的医疗内容质量评估专家，擅长识别和过滤低质量的医疗问答内容。
+
+            {criteria}
+            处理流程
+            输入是一个JSON数组，每个元素包含 id、human（问题）与 assistant（答案）
+
+            逐一分析每个问答对，应用上述标准进行严格评判
+
+            输出要求
+            只输出一个JSON数组，输入中的每个 id 对应一个元素，顺序与输入相同：
+            [{{"id": 编号, "keep": true}}, {{"id": 编号, "keep": false}}]
+
+            keep 为 true 表示通过质量检查，false 表示应去除
+
+            不输出问答对原文，不包含任何评估过程说明 """
         }
-    
-    def _call_model_api(self, prompt: str, text_chunk: str, system_prompt_key: str) -> str:
-        url = f"{self.base_url}/api/generate"
-        
+
+    def _call_model_api(self, prompt: str, text_chunk: str, system_prompt_key: str,
+                        num_predict: Optional[int] = None) -> Optional[str]:
+        """调用模型，失败时返回 None（由调用方按未通过处理，不能把输入原样当作结果）"""
         payload = {
             "model": self.model,
             "prompt": prompt,
@@ -66,54 +97,293 @@ class TextCheckEngine:
             "options": {
                 "temperature": 0.1,
                 "top_p": 0.8,
-                "num_predict": min(len(text_chunk) * 2, 4000),
+                "num_predict": num_predict or min(len(text_chunk) * 2, 4000),
                 "repeat_penalty": 1.2
             }
         }
-        
+
         try:
-            response = requests.post(
-                url,
-                json=payload,
-                headers={"Content-Type": "application/json"},
-                timeout=60
-            )
-            response.raise_for_status()
-            
-            result = response.json()
+            result = self.client.generate(payload)
             return result.get('response', '').strip()
-            
+
         except requests.exceptions.RequestException as e:
             print(f"API调用失败: {e}")
-            return text_chunk
         except json.JSONDecodeError as e:
             print(f"JSON解析失败: {e}")
-            return text_chunk
         except Exception as e:
             print(f"未知错误: {e}")
-            return text_chunk
-    
+        return None
+
     def _create_cleaning_prompt(self, text_chunk: str) -> str:
         return f"需要处理的文本：\n{text_chunk}\n\n请返回清洗后的文本："
-    
-    
+
+    def _create_batch_prompt(self, pairs: List[Tuple[int, Dict]]) -> str:
+        items = [{"id": pair_id, "human": pair.get("human", ""), "assistant": pair.get("assistant", "")}
+                 for pair_id, pair in pairs]
+        return f"需要评估的问答对：\n{json.dumps(items, ensure_ascii=False, indent=1)}\n\n请输出每个问答对的评估结果："
+
     def QA_text_check(self, text_chunk: str) -> str:
         if not text_chunk or not text_chunk.strip():
             return text_chunk
-            
+
         cleaning_prompt = self._create_cleaning_prompt(text_chunk)
         cleaned_text = self._call_model_api(cleaning_prompt, text_chunk, "qa_check")
 
-        return cleaned_text
+        return cleaned_text or ""
+
+    def check_pairs(self, pairs: List[Tuple[int, Dict]]) -> Dict[int, Optional[bool]]:
+        """
+        一次模型调用评估多个问答对
+
+        每个问答对带有稳定的编号，模型按编号返回是否保留。模型漏掉的编号会单独再合并请求一次。
+
+        Args:
+            pairs: (编号, 问答对) 列表
+
+        Returns:
+            Dict[int, Optional[bool]]: 编号 -> True 保留 / False 去除 / None 未能得到结论（调用失败或结果缺失）
+        """
+        verdicts = self._check_once(pairs)
+        missing = [(pair_id, pair) for pair_id, pair in pairs if verdicts.get(pair_id) is None]
+        if missing and len(missing) < len(pairs):
+            verdicts.update(self._check_once(missing))
+        return {pair_id: verdicts.get(pair_id) for pair_id, _ in pairs}
+
+    def _check_once(self, pairs: List[Tuple[int, Dict]]) -> Dict[int, Optional[bool]]:
+        with self._calls_lock:
+            self.calls += 1
+        response = self._call_model_api(self._create_batch_prompt(pairs), "", "qa_check_batch",
+                                         num_predict=24 * len(pairs) + 64)
+        if response is None:
+            return {}
+        data = extract_json(response)
+        if isinstance(data, dict):
+            data = [data]
+        if not isinstance(data, list):
+            return {}
+
+        wanted = {pair_id for pair_id, _ in pairs}
+        verdicts = {}
+        for entry in data:
+            if not isinstance(entry, dict):
+                continue
+            try:
+                pair_id = int(entry.get("id"))
+            except (TypeError, ValueError):
+                continue
+            keep = entry.get("keep")
+            if isinstance(keep, str):
+                keep = {"true": True, "false": False, "是": True, "否": False}.get(keep.strip().lower())
+            if pair_id in wanted and isinstance(keep, bool):
+                verdicts[pair_id] = keep
+        return verdicts
+
+
+def parse_pair(line: str) -> Optional[Dict]:
+    """解析一行问答对：JSON 或 QA.txt 中的 Python 字典写法，无法解析时返回 None"""
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        pair = json.loads(line)
+    except json.JSONDecodeError:
+        try:
+            pair = ast.literal_eval(line)
+        except (ValueError, SyntaxError, MemoryError, RecursionError):
+            return None
+    if isinstance(pair, dict) and pair.get("human") and pair.get("assistant"):
+        return pair
+    return None
+
+
+def iter_pair_lines(path: str, offset: int = 0, line_no: int = 0) -> Iterator[Tuple[int, int, Optional[Dict]]]:
+    """
+    从字节偏移 offset 处开始逐行读取问答对文件
+
+    Yields:
+        Tuple[int, int, Optional[Dict]]: 行号（作为问答对编号）、该行结束处的字节偏移、解析结果
+    """
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for raw in f:
+            offset += len(raw)
+            yield line_no, offset, parse_pair(raw.decode("utf-8", errors="replace"))
+            line_no += 1
+
+
+class QACheckRunner:
+
+    def __init__(self, engine: TextCheckEngine, batch_size: int = 8, workers: int = 4,
+                 prefilter: Optional[PreFilter] = None, block_size: int = 1024):
+        """
+        流式、批量地检查问答对文件
+
+        输入逐行读取，每 batch_size 个问答对合并为一次模型调用，最多 workers 个批次同时进行，
+        在途批次数有上限，内存占用与文件大小无关。结果按输入顺序由唯一的缓冲写入器写出，
+        每写完一个批次记录一次进度（输入字节偏移与输出文件长度），中断后可从该偏移继续。
+
+        未能得到结论的问答对（调用失败或模型漏掉）不会写入结果文件，而是写入 .unchecked 文件，
+        可以之后再单独检查。没有进度文件（或不续跑）时覆盖已有的输出文件。
+
+        给出 prefilter 时，每读入 block_size 行先整体做一次本地规则过滤，命中规则的问答对直接去除，
+        只有其余问答对才组成批次交给模型。
+
+        Args:
+            engine: 检查引擎
+            batch_size: 每次模型调用评估的问答对数量
+            workers: 同时进行的模型调用数
+            prefilter: 模型检查之前的本地规则过滤，None 表示不过滤
+            block_size: 本地规则过滤每次处理的行数
+        """
+        self.engine = engine
+        self.batch_size = max(1, batch_size)
+        self.workers = max(1, workers)
+        self.prefilter = prefilter
+        self.block_size = max(1, block_size)
+
+    def run(self, input_path: str, output_path: str, resume: bool = True) -> Dict[str, int]:
+        """
+        检查 input_path 中的问答对，通过检查的问答对以 JSON Lines 写入 output_path
+
+        Returns:
+            Dict[str, int]: 本次运行的统计（读取行数、通过、模型去除、规则去除、未能检查、无法解析、模型调用次数）
+        """
+        progress_path = output_path + ".progress"
+        unchecked_path = output_path + ".unchecked"
+        progress = {"offset": 0, "line": 0, "output_bytes": 0, "unchecked_bytes": 0}
+        if resume and os.path.exists(progress_path):
+            with open(progress_path, "r", encoding="utf-8") as f:
+                progress.update(json.load(f))
+            print(f"从第 {progress['line']} 行（字节偏移 {progress['offset']}）继续检查")
+            if self.prefilter is not None and progress["offset"]:
+                self._restore_prefilter(input_path, progress["offset"])
+
+        stats = {"lines": 0, "kept": 0, "dropped": 0, "prefiltered": 0, "unchecked": 0, "invalid": 0, "calls": 0}
+        calls_before = self.engine.calls
+        out = self._open_output(output_path, progress["output_bytes"])
+        unchecked = self._open_output(unchecked_path, progress["unchecked_bytes"])
+        pending = deque()
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                try:
+                    for batch in self._batches(input_path, progress):
+                        pending.append((batch, executor.submit(self._check_batch, batch)))
+                        if len(pending) >= self.workers * 2:
+                            self._write(*pending.popleft(), out, unchecked, progress, progress_path, stats)
+                    while pending:
+                        self._write(*pending.popleft(), out, unchecked, progress, progress_path, stats)
+                except BaseException:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    raise
+        finally:
+            out.close()
+            unchecked.close()
+            stats["calls"] = self.engine.calls - calls_before
+        return stats
+
+    @staticmethod
+    def _open_output(path: str, size: int):
+        """以追加方式打开输出文件，并截掉上次中断后未记录进度的部分"""
+        f = open(path, "a+b")
+        f.truncate(size)
+        return f
+
+    def _blocks(self, input_path: str, progress: Dict) -> Iterator[List[Tuple[int, int, Optional[Dict], Optional[str]]]]:
+        """按 block_size 行分块读取输入，并对每块中可解析的问答对整体做一次规则过滤"""
+        block = []
+        for entry in iter_pair_lines(input_path, progress["offset"], progress["line"]):
+            block.append(entry)
+            if len(block) >= self.block_size:
+                yield self._prefilter_block(block)
+                block = []
+        if block:
+            yield self._prefilter_block(block)
+
+    def _restore_prefilter(self, input_path: str, offset: int):
+        """重新过滤中断前已读过的输入，恢复重复问答对规则的已见集合（该集合不随进度保存）"""
+        block = []
+        for _, end, pair in iter_pair_lines(input_path):
+            if end > offset:
+                break
+            if pair is not None:
+                block.append(pair)
+            if len(block) >= self.block_size:
+                self.prefilter.remember(block)
+                block = []
+        if block:
+            self.prefilter.remember(block)
+
+    def _prefilter_block(self, block: List[Tuple[int, int, Optional[Dict]]]) -> List[Tuple[int, int, Optional[Dict], Optional[str]]]:
+        rules = iter(self.prefilter.apply([pair for _, _, pair in block if pair is not None]) if self.prefilter else ())
+        return [(line_no, end, pair, next(rules, None) if pair is not None else None) for line_no, end, pair in block]
+
+    def _batches(self, input_path: str, progress: Dict) -> Iterator[Dict]:
+        batch = {"lines": [], "pairs": [], "rejected": 0, "end": progress["offset"], "next_line": progress["line"]}
+        for block in self._blocks(input_path, progress):
+            for line_no, end, pair, rule in block:
+                batch["lines"].append(line_no)
+                if rule is not None:
+                    batch["rejected"] += 1
+                elif pair is not None:
+                    batch["pairs"].append((line_no, pair))
+                batch["end"], batch["next_line"] = end, line_no + 1
+                if len(batch["pairs"]) >= self.batch_size:
+                    yield batch
+                    batch = {"lines": [], "pairs": [], "rejected": 0, "end": end, "next_line": line_no + 1}
+        if batch["lines"]:
+            yield batch
+
+    def _check_batch(self, batch: Dict) -> Dict[int, Optional[bool]]:
+        if not batch["pairs"]:
+            return {}
+        return self.engine.check_pairs(batch["pairs"])
+
+    def _write(self, batch: Dict, future, out, unchecked, progress: Dict, progress_path: str, stats: Dict):
+        """按输入顺序写出一个批次的结果并记录进度"""
+        verdicts = future.result()
+        stats["lines"] += len(batch["lines"])
+        stats["prefiltered"] += batch["rejected"]
+        stats["invalid"] += len(batch["lines"]) - len(batch["pairs"]) - batch["rejected"]
+        for pair_id, pair in batch["pairs"]:
+            verdict = verdicts.get(pair_id)
+            line = (json.dumps(pair, ensure_ascii=False) + "\n").encode("utf-8")
+            if verdict is True:
+                out.write(line)
+                stats["kept"] += 1
+            elif verdict is False:
+                stats["dropped"] += 1
+            else:
+                unchecked.write(line)
+                stats["unchecked"] += 1
+
+        out.flush()
+        unchecked.flush()
+        progress.update(offset=batch["end"], line=batch["next_line"],
+                        output_bytes=out.tell(), unchecked_bytes=unchecked.tell())
+        atomic_write_json(progress_path, progress)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量检查问答对质量")
+    parser.add_argument("--input", type=str, default="out/QA_check.txt", help="每行一个问答对（JSON 或 QA.txt 格式）")
+    parser.add_argument("--output", type=str, default="out/QA_check_new.txt", help="通过检查的问答对，JSON Lines 格式")
+    parser.add_argument("--batch_size", type=int, default=8, help="每次模型调用评估的问答对数量")
+    parser.add_argument("--workers", type=int, default=4, help="同时进行的模型调用数")
+    parser.add_argument("--restart", action="store_true", help="忽略已有进度，从头开始检查")
+    parser.add_argument("--no_prefilter", action="store_true", help="不做本地规则过滤，所有问答对都交给模型检查")
+    parser.add_argument("--llm_base_url", type=str, default="http://localhost:11434", help="Ollama服务地址")
+    args = parser.parse_args()
+
+    engine = TextCheckEngine(args.llm_base_url, client=get_shared_client(args.llm_base_url, pool_size=args.workers))
+    prefilter = None if args.no_prefilter else PreFilter()
+    stats = QACheckRunner(engine, args.batch_size, args.workers, prefilter).run(args.input, args.output,
+                                                                                resume=not args.restart)
+    print(f"检查 {stats['lines']} 行：通过 {stats['kept']}，模型去除 {stats['dropped']}，规则去除 {stats['prefiltered']}，"
+          f"未能检查 {stats['unchecked']}，无法解析 {stats['invalid']}，模型调用 {stats['calls']} 次")
+    if prefilter is not None:
+        print("规则去除明细：" + "，".join(f"{rule} {prefilter.counts[rule]}" for rule in RULES))
 
 
-engine = TextCheckEngine()
-with open("out/QA_check.txt", "r", encoding="utf-8") as f:
-    code = f.readlines()
-    for i in code:
-        print(i)
-        checked_text = engine.QA_text_check(i)
-        print(checked_text)
-        if checked_text != " " and checked_text != "{}" and checked_text != "空":
-            with open ("out/QA_check_new.txt", "a+", encoding="utf-8") as f2:
-                f2.write(checked_text + "\n")
+if __name__ == "__main__":
+    main()
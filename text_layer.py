@@ -0,0 +1,145 @@
+import re
+import time
+import argparse
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+from Layout_pic_Order import reading_order
+
+
+_CJK_END = re.compile(r"[　-〿㐀-䶿一-鿿＀-￯]$")
+_CJK_START = re.compile(r"^[　-〿㐀-䶿一-鿿＀-￯]")
+_HYPHENATED = re.compile(r"[a-z]-$")
+# unmapped glyphs (U+FFFD), private-use code points and control characters
+_GARBAGE = re.compile(r"[\ufffd\ue000-\uf8ff\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def join_lines(text: str) -> str:
+    """
+    Join the lines of one text block into a single line
+
+    Lines are joined without a separator around CJK text, words hyphenated
+    across a line break are rejoined, and other lines are separated by one
+    space.
+    """
+    lines = [line.strip() for line in text.splitlines()]
+    out = ""
+    for line in lines:
+        if not line:
+            continue
+        if not out:
+            out = line
+        elif _HYPHENATED.search(out) and line[:1].islower():
+            out = out[:-1] + line
+        elif _CJK_END.search(out) or _CJK_START.search(line):
+            out += line
+        else:
+            out += " " + line
+    return out
+
+
+def page_text(page, drop_margins: bool = False, min_chars: int = 50, max_garbage: float = 0.05,
+              max_image_coverage: float = 0.5) -> Tuple[Optional[str], str]:
+    """
+    Extract the embedded text of a PDF page in reading order, if it is usable
+
+    The page is routed to the vision path (None is returned) when:
+        - images cover more than `max_image_coverage` of the page (scans,
+          and figure pages whose text is only in the pixels), unless the
+          text layer alone already has `min_chars` characters while the
+          images do not cover the whole page;
+        - the text layer is too short and the page has any images;
+        - more than `max_garbage` of the characters are not text (broken
+          font encodings extract as U+FFFD or private-use code points).
+
+    Text blocks are ordered with the same XY-cut reading order as detected
+    boxes, and each block becomes one line, matching the OCR output of one
+    text region.
+
+    Args:
+        page: PyMuPDF page
+        drop_margins: Drop running headers and footers
+        min_chars: Non-space characters a page needs before its text layer is trusted
+        max_garbage: Maximum share of characters that are not text
+        max_image_coverage: Maximum share of the page area covered by images
+
+    Returns:
+        Tuple[Optional[str], str]: Page text (None when the page needs OCR)
+        and the routing reason
+    """
+    import pymupdf
+
+    # keep image blocks, expand ligatures, and let unmapped glyphs come out as U+FFFD
+    flags = pymupdf.TEXT_PRESERVE_WHITESPACE | pymupdf.TEXT_PRESERVE_IMAGES | pymupdf.TEXT_MEDIABOX_CLIP
+    width, height = page.rect.width, page.rect.height
+    boxes, texts = [], []
+    image_area = 0.0
+    for x0, y0, x1, y1, text, _, block_type in page.get_text("blocks", flags=flags):
+        if block_type == 1:
+            image_area += max(0.0, min(x1, width) - max(x0, 0)) * max(0.0, min(y1, height) - max(y0, 0))
+            continue
+        line = join_lines(text)
+        if line:
+            boxes.append((x0, y0, x1, y1))
+            texts.append(line)
+
+    coverage = min(image_area / (width * height), 1.0) if width and height else 0.0
+    chars = sum(len(t) - t.count(" ") for t in texts)
+    if coverage > max_image_coverage and (chars < min_chars or coverage >= 0.95):
+        return None, f"image coverage {coverage:.0%}"
+    if chars < min_chars and coverage > 0:
+        return None, f"only {chars} characters beside images"
+    if not texts:
+        return "", "empty page"
+
+    order = reading_order(np.array(boxes), width, height, drop_margins=drop_margins)
+    text = "".join(texts[i] + "\n" for i in order)
+    garbage = len(_GARBAGE.findall(text)) / max(chars, 1)
+    if garbage > max_garbage:
+        return None, f"garbage ratio {garbage:.1%}"
+    return text, f"{chars} characters"
+
+
+def iter_text_layer(pdf_path: str, page_nums: Iterable[int], **kwargs) -> Iterator[Tuple[int, Optional[str], str]]:
+    """
+    Extract the text layer of the given pages from one open document
+
+    Yields:
+        Tuple[int, Optional[str], str]: 0-based page index, text (None when the
+        page needs OCR) and the routing reason, see `page_text`
+    """
+    import pymupdf
+
+    with pymupdf.open(pdf_path) as doc:
+        for page_num in page_nums:
+            yield (page_num, *page_text(doc[page_num], **kwargs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Route PDF pages between the embedded text layer and OCR")
+    parser.add_argument("pdf_path", type=str, help="PDF file")
+    parser.add_argument("--drop_margins", action="store_true", help="Drop running headers and footers")
+    parser.add_argument("--show", type=int, default=None, help="Print the extracted text of this 0-based page")
+    args = parser.parse_args()
+
+    import pymupdf
+    with pymupdf.open(args.pdf_path) as doc:
+        n_pages = len(doc)
+
+    start = time.perf_counter()
+    routes: Dict[str, List[int]] = {"text": [], "vision": []}
+    reasons = {}
+    for page_num, text, reason in iter_text_layer(args.pdf_path, range(n_pages), drop_margins=args.drop_margins):
+        routes["vision" if text is None else "text"].append(page_num)
+        reasons[page_num] = reason
+        if page_num == args.show:
+            print(text)
+    elapsed = time.perf_counter() - start
+
+    print(f"{n_pages} pages in {elapsed:.3f}s ({n_pages / elapsed:.0f} pages/s): "
+          f"{len(routes['text'])} from the text layer, {len(routes['vision'])} need OCR")
+    for page_num in routes["vision"]:
+        print(f"  page {page_num + 1}: {reasons[page_num]}")
+
+
+if __name__ == "__main__":
+    main()
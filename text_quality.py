@@ -0,0 +1,101 @@
+import os
+import re
+import argparse
+from typing import Dict
+
+
+_CJK = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff]")
+_NORMAL = re.compile(r"[\w\s\u3000-\u303f\uff00-\uffef.,;:!?'\"()\[\]{}<>/%+\-=*&#@~$·•–—“”‘’…]")
+_SYMBOL = re.compile(r"[^\w\s\u3000-\u303f\uff00-\uffef]")
+_FRAGMENT_SPLIT = re.compile(r"[。！？；!?;\n]+|\.(?=\s|$)")
+_LATIN_WORD = re.compile(r"[A-Za-z]+")
+_BROKEN_HYPHEN = re.compile(r"[a-z]-[a-z]")
+
+# 每项指标达到该值时扣满对应权重
+_LIMITS = {
+    'garbage_ratio': (0.02, 0.30),
+    'symbol_density': (0.12, 0.15),
+    'fragment_ratio': (0.40, 0.25),
+    'merged_word_ratio': (0.05, 0.25),
+    'broken_hyphen_rate': (0.06, 0.05),
+}
+
+
+def score_text(text: str) -> Dict[str, float]:
+    """
+    本地估算OCR文本质量，不调用模型
+
+    指标：
+        garbage_ratio: 不属于文字、数字、常见标点的字符比例（OCR乱码）
+        symbol_density: 标点与符号字符的比例
+        fragment_ratio: 按句末标点或换行切分后过短片段（中文少于6字、英文少于3词）的比例
+        merged_word_ratio: 长度超过15个字母的英文“单词”比例（OCR丢失空格）
+        broken_hyphen_rate: 单词内部连字符（如 signif-cant）的出现率
+
+    Returns:
+        Dict[str, float]: 各项指标与综合得分 score（0~1，越高越干净）
+    """
+    chars = [c for c in text if not c.isspace()]
+    n = len(chars)
+    if n == 0:
+        return {'score': 1.0, 'chars': 0, **{key: 0.0 for key in _LIMITS}}
+
+    garbage = sum(1 for c in chars if not _NORMAL.match(c))
+    symbols = sum(1 for c in chars if _SYMBOL.match(c))
+
+    fragments = [f.strip() for f in _FRAGMENT_SPLIT.split(text) if f.strip()]
+    short = 0
+    for fragment in fragments:
+        if _CJK.search(fragment):
+            short += len(_CJK.findall(fragment)) < 6
+        else:
+            short += len(_LATIN_WORD.findall(fragment)) < 3
+    words = _LATIN_WORD.findall(text)
+
+    metrics = {
+        'garbage_ratio': garbage / n,
+        'symbol_density': symbols / n,
+        'fragment_ratio': short / len(fragments) if fragments else 0.0,
+        'merged_word_ratio': sum(len(w) > 15 for w in words) / len(words) if words else 0.0,
+        'broken_hyphen_rate': len(_BROKEN_HYPHEN.findall(text)) / len(words) if words else 0.0,
+    }
+    penalty = sum(weight * min(metrics[key] / limit, 1.0) for key, (limit, weight) in _LIMITS.items())
+    metrics['score'] = max(0.0, 1.0 - penalty)
+    metrics['chars'] = n
+    return metrics
+
+
+def needs_cleaning(text: str, threshold: float = 0.75) -> bool:
+    """质量得分低于阈值的文本才需要送入模型清洗"""
+    return score_text(text)['score'] < threshold
+
+
+def main():
+    parser = argparse.ArgumentParser(description="统计输出目录中页面文本的质量得分")
+    parser.add_argument("--output_dir", type=str, default="output", help="包含 pageo_{n}.txt / page_{n}.txt 的输出目录")
+    parser.add_argument("--threshold", type=float, default=0.75, help="低于该得分的页面需要清洗")
+    args = parser.parse_args()
+
+    pattern = re.compile(r"^(pageo?)_(\d+)\.txt$")
+    rows = []
+    for name in os.listdir(args.output_dir):
+        m = pattern.match(name)
+        if m:
+            with open(os.path.join(args.output_dir, name), "r", encoding="utf-8") as f:
+                rows.append((m.group(1), int(m.group(2)), score_text(f.read())))
+
+    for kind, label in (("pageo", "原始OCR文本"), ("page", "清洗后文本")):
+        scores = sorted((num, s) for k, num, s in rows if k == kind)
+        if not scores:
+            continue
+        dirty = sum(s['score'] < args.threshold for _, s in scores)
+        mean = sum(s['score'] for _, s in scores) / len(scores)
+        print(f"{label}: {len(scores)} 页, 平均得分 {mean:.3f}, 需要清洗 {dirty} 页")
+        for num, s in scores:
+            print(f"  第 {num} 页: score={s['score']:.3f} garbage={s['garbage_ratio']:.3f} "
+                  f"symbol={s['symbol_density']:.3f} fragment={s['fragment_ratio']:.3f} "
+                  f"merged={s['merged_word_ratio']:.3f} hyphen={s['broken_hyphen_rate']:.3f}")
+
+
+if __name__ == "__main__":
+    main()